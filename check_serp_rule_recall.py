@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Measure what the rule-based SERP extractor saves and what it gets wrong.
+
+For a directory of SERP files it reports how many items the rules answer,
+and how many items and prompt chunks (LLM calls) remain compared to sending
+everything to the LLM. Given the JSONL output of a full LLM run
+
+    python llm_serp_parser_qwen.py --input-dir data_raw --no-rules --output llm_baseline.jsonl
+
+it also reports recall and precision against it:
+- recall: a baseline event counts as kept if a rule-extracted event in the
+  same file matches it, or if the item it came from still goes to the LLM.
+  Baseline events that match a rule-extracted venue are listed separately;
+  they are not kept, since venues are not emitted as events.
+- precision: share of rule-extracted events that match a baseline event of
+  the same file, over the files the baseline run covered.
+
+    python check_serp_rule_recall.py --input-dir data_raw --llm-events llm_baseline.jsonl
+"""
+import os
+import re
+import json
+import argparse
+from pathlib import Path
+
+from serp_rule_extractor import MIN_CONFIDENCE, iter_serp_items, route_serp_items
+from llm_serp_parser_qwen import CHUNK_TOKEN_BUDGET, chunk_serp_blocks, format_serp_item, iter_serp_files, load_sample_data
+
+NAME_MATCH = 0.6  # Share of an event name's words that must match
+
+
+def estimate_tokens(text):
+    # ~4 characters per token; close enough to count chunks without loading a tokenizer
+    return max(1, len(text) // 4)
+
+
+def words(text):
+    return set(re.findall(r"[a-z0-9]+", str(text or "").lower()))
+
+
+def canonical_url(url):
+    url = re.sub(r"^https?://(www\.)?", "", str(url or "").strip().lower())
+    return url.rstrip("/") or None
+
+
+def name_matches(name, text_words):
+    name_words = words(name)
+    return bool(name_words) and len(name_words & text_words) / len(name_words) >= NAME_MATCH
+
+
+def item_text_words(item):
+    texts = [item.get("title"), item.get("description"), item.get("snippet"), item.get("url")]
+    for element in item.get("items") or []:
+        if isinstance(element, dict):
+            texts.extend(element.get(key) for key in ("title", "snippet", "description", "url"))
+    return words(" ".join(str(text) for text in texts if text))
+
+
+def item_urls(item):
+    urls = {canonical_url(item.get("url"))}
+    urls.update(canonical_url(element.get("url")) for element in item.get("items") or [] if isinstance(element, dict))
+    urls.discard(None)
+    return urls
+
+
+def events_match(event, other, other_name_field="event_name"):
+    url = canonical_url(event.get("url"))
+    return bool(url and url == canonical_url(other.get("url"))) or \
+        name_matches(event.get("event_name"), words(other.get(other_name_field)))
+
+
+def classify_baseline_event(event, rule_events, venues, llm_items):
+    """'rules', 'llm', 'venue' or 'missed' for one event from the full LLM run"""
+    if any(events_match(event, rule_event) for rule_event in rule_events):
+        return "rules"
+    url = canonical_url(event.get("url"))
+    for item in llm_items:
+        if (url and url in item_urls(item)) or name_matches(event.get("event_name"), item_text_words(item)):
+            return "llm"
+    if any(events_match(event, venue, "venue_name") for venue in venues):
+        return "venue"
+    return "missed"
+
+
+def rule_event_confirmed(rule_event, baseline_events):
+    """Whether the full LLM run also found this rule-extracted event"""
+    return any(events_match(rule_event, event) or events_match(event, rule_event) for event in baseline_events)
+
+
+def load_baseline(path):
+    events_by_file = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                event = json.loads(line)
+                events_by_file.setdefault(event.get("source_file"), []).append(event)
+    return events_by_file
+
+
+def load_baseline_files(path):
+    """Files the baseline run parsed, from its _stats.jsonl; None when there is no stats file"""
+    stats_path = f"{os.path.splitext(path)[0]}_stats.jsonl"
+    if not os.path.exists(stats_path):
+        return None
+    with open(stats_path, 'r', encoding='utf-8') as f:
+        return {json.loads(line)["file"] for line in f if line.strip()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule-based SERP extraction: LLM savings, recall and precision")
+    parser.add_argument("--input-dir", required=True, help="Directory of SERP JSON files (e.g. data_raw)")
+    parser.add_argument("--pattern", default="**/*.json", help="Glob for SERP files under --input-dir")
+    parser.add_argument("--llm-events", help="JSONL from a --no-rules batch run of llm_serp_parser_qwen.py")
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE)
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKEN_BUDGET)
+    parser.add_argument("--show-missed", type=int, default=10, help="Missed baseline and unconfirmed rule events to print")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.llm_events) if args.llm_events else None
+    # Without a stats file, only files the baseline found events in count as covered
+    baseline_files = (load_baseline_files(args.llm_events) or set(baseline)) if baseline is not None else set()
+    totals = {"files": 0, "items": 0, "rule_events": 0, "venues": 0, "llm_items_before": 0, "llm_items_after": 0,
+              "chunks_before": 0, "chunks_after": 0, "files_without_llm": 0}
+    outcomes = {"rules": 0, "llm": 0, "venue": 0, "missed": 0}
+    checked_rule_events = confirmed_rule_events = 0
+    missed, unconfirmed = [], []
+    for path in iter_serp_files(args.input_dir, args.pattern):
+        name = str(path.relative_to(Path(args.input_dir)))
+        items = list(iter_serp_items(load_sample_data(str(path))))
+        rule_events, venues, llm_items, counts = route_serp_items(items, args.min_confidence)
+        before = [block for block in (format_serp_item(item, i + 1) for i, item in enumerate(items)) if block]
+        after = [block for block in (format_serp_item(item, i + 1) for i, item in enumerate(llm_items)) if block]
+        chunks_before = len(chunk_serp_blocks(before, estimate_tokens, args.chunk_tokens))
+        chunks_after = len(chunk_serp_blocks(after, estimate_tokens, args.chunk_tokens))
+        totals["files"] += 1
+        totals["items"] += counts["items"]
+        totals["rule_events"] += counts["rule_events"]
+        totals["venues"] += counts["venues"]
+        totals["llm_items_before"] += len(before)
+        totals["llm_items_after"] += len(after)
+        totals["chunks_before"] += chunks_before
+        totals["chunks_after"] += chunks_after
+        totals["files_without_llm"] += chunks_before > 0 and chunks_after == 0
+        baseline_events = (baseline or {}).get(name, [])
+        for event in baseline_events:
+            outcome = classify_baseline_event(event, rule_events, venues, llm_items)
+            outcomes[outcome] += 1
+            if outcome in ("venue", "missed"):
+                missed.append((name, event.get("event_name"), event.get("url")))
+        if name in baseline_files:
+            for rule_event in rule_events:
+                checked_rule_events += 1
+                if rule_event_confirmed(rule_event, baseline_events):
+                    confirmed_rule_events += 1
+                else:
+                    unconfirmed.append((name, rule_event.get("event_name"), rule_event.get("url")))
+
+    print(f"Files: {totals['files']}, SERP items: {totals['items']}, rule-extracted events: {totals['rule_events']}, "
+          f"venues: {totals['venues']}")
+    print(f"Items sent to the LLM: {totals['llm_items_before']} -> {totals['llm_items_after']}")
+    reduction = 100 * (1 - totals["chunks_after"] / totals["chunks_before"]) if totals["chunks_before"] else 0
+    print(f"LLM calls ({args.chunk_tokens}-token chunks): {totals['chunks_before']} -> {totals['chunks_after']} "
+          f"({reduction:.0f}% fewer); {totals['files_without_llm']} files need no LLM call at all")
+    if baseline is not None:
+        total = sum(outcomes.values())
+        kept = outcomes["rules"] + outcomes["llm"]
+        print(f"Recall vs full LLM run: {kept}/{total} ({100 * kept / total if total else 100:.1f}%) - "
+              f"{outcomes['rules']} matched by rules, {outcomes['llm']} still from the LLM, "
+              f"{outcomes['venue']} only as a venue, {outcomes['missed']} missed")
+        for name, event_name, url in missed[:args.show_missed]:
+            print(f"  missed: {name}: {event_name!r} {url or ''}")
+        precision = 100 * confirmed_rule_events / checked_rule_events if checked_rule_events else 100
+        print(f"Precision of rule events vs full LLM run: {confirmed_rule_events}/{checked_rule_events} "
+              f"({precision:.1f}%) over {len(baseline_files)} files")
+        for name, event_name, url in unconfirmed[:args.show_missed]:
+            print(f"  not in LLM run: {name}: {event_name!r} {url or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -102,6 +102,11 @@ if __name__ == "__main__":
     from concurrent.futures import ThreadPoolExecutor
     import boto3
 
+    # Shared service modules (event_dedup) live in services/
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services'))
+    from event_dedup import insert_raw_events, setup_dedup_columns
+    from enrichment_cache import EnrichmentCache, enrichment_cache_key, setup_enrichment_cache_table
+
 # Load environment variables
 load_dotenv()
 
@@ -449,29 +454,12 @@ def process_dataforseo_events_response(response, city_id, query_type, conn):
                 
                 events.append(raw_event)
     
-    # Insert events into event_raw
+    # Insert events into event_raw in one batch; the (source, url_hash) index skips known URLs
     inserted_count = 0
     
     try:
-        with conn.cursor() as cur:
-            for event in events:
-                # Check if event already exists (by URL)
-                if event.get('url'):
-                    cur.execute("""
-                        SELECT id FROM event_raw 
-                        WHERE raw_json->>'url' = %s
-                    """, (event['url'],))
-                    if cur.fetchone():
-                        continue
-                
-                cur.execute("""
-                    INSERT INTO event_raw 
-                    (raw_json, metro_id, created_at) 
-                    VALUES (%s, %s, CURRENT_TIMESTAMP)
-                """, (Json(event), city_id))
-                inserted_count += 1
-            
-            conn.commit()
+        inserted_count = insert_raw_events(conn, [(event['source'], None, city_id, event) for event in events])
+        conn.commit()
     except psycopg2.Error as e:
         conn.rollback()
         print(f"Error inserting events: {e}")
@@ -491,8 +479,9 @@ def run_dance_data_collection(args, conn):
     # Define query types - just dance and dancing
     query_types = ['dance', 'dancing']
     
-    # Setup progress tracking
+    # Setup progress tracking and the event_raw URL dedup key
     setup_progress_tracking(conn)
+    setup_dedup_columns(conn)
     create_dance_tasks(cities, query_types, conn)
     
     # Get progress
@@ -680,13 +669,22 @@ def process_raw_events(conn, limit=100):
     
     return processed_count
 
-def invoke_ai_enrichment(lambda_client, event_data):
+AI_ENRICHMENT_MODEL = "anthropic.claude-3-haiku-20240307"  # Or your preferred model
+# Bump when the prompt below changes; it is part of every cache key
+AI_ENRICHMENT_PROMPT_VERSION = "dance-v1"
+AI_ENRICHMENT_FIELDS = ["start_time", "end_time", "venue", "address", "price", "live_band", "class_before"]
+AI_ENRICHMENT_CACHE = EnrichmentCache()
+
+def invoke_ai_enrichment(lambda_client, event_data, conn=None):
     """
     Invoke AI via Lambda to extract missing fields from event description.
+    Results are memoized by content hash, so repeated descriptions (weekly
+    classes, cross-posted events) skip the model call.
     
     Args:
         lambda_client: Initialized AWS Lambda client
         event_data: Dict containing event information with description
+        conn: Optional database connection for the shared enrichment cache
         
     Returns:
         Dict with extracted fields or None if processing failed
@@ -702,6 +700,15 @@ def invoke_ai_enrichment(lambda_client, event_data):
             print(f"No description available for event ID {event_data['id']}")
             return None
         
+        cache_key = enrichment_cache_key(
+            event_data['json_data'].get('name', ''), description, AI_ENRICHMENT_FIELDS,
+            f"{AI_ENRICHMENT_MODEL}:{AI_ENRICHMENT_PROMPT_VERSION}"
+        )
+        cached = AI_ENRICHMENT_CACHE.get(conn, cache_key)
+        if cached:
+            print(f"  Using cached enrichment for event ID {event_data['id']}")
+            return cached
+        
         # Prepare the specialized prompt for dance events
         prompt = f"""Extract structured data from the event description below. Return only a valid JSON object with these exact fields:
 
@@ -722,7 +729,7 @@ Respond only with the JSON object. Do not include any commentary or formatting."
         # Prepare payload for Lambda function
         payload = {
             "prompt": prompt,
-            "model": "anthropic.claude-3-haiku-20240307",  # Or your preferred model
+            "model": AI_ENRICHMENT_MODEL,
             "max_tokens": 1000,
             "temperature": 0.1  # Low temperature for more deterministic response
         }
@@ -753,6 +760,7 @@ Respond only with the JSON object. Do not include any commentary or formatting."
             else:
                 extracted_data = json.loads(ai_response)
             
+            AI_ENRICHMENT_CACHE.put(conn, 'dance-enrichment', cache_key, extracted_data)
             return extracted_data
         except json.JSONDecodeError as e:
             print(f"Failed to parse AI response: {e}")
@@ -954,6 +962,7 @@ def process_pipeline(args, conn, lambda_client):
             enrichment_records = get_events_needing_enrichment(conn, args.batch_size)
             if enrichment_records:
                 print(f"Found {len(enrichment_records)} dance records needing enrichment")
+                setup_enrichment_cache_table(conn)
                 enriched_count = 0
                 
                 for record in enrichment_records:
@@ -964,7 +973,7 @@ def process_pipeline(args, conn, lambda_client):
                     }
                     
                     print(f"Enriching dance event ID {event_id}...")
-                    enrichment_data = invoke_ai_enrichment(lambda_client, event_data)
+                    enrichment_data = invoke_ai_enrichment(lambda_client, event_data, conn)
                     
                     if enrichment_data:
                         success = update_event_with_enrichment(conn, event_id, enrichment_data)
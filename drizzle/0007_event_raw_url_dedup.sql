@@ -0,0 +1,14 @@
+-- Databases where services/event_dedup.py or services/semantic_dedup.py already ran have these objects; IF NOT EXISTS keeps the migration safe there.
+ALTER TABLE "event_raw" ADD COLUMN IF NOT EXISTS "canonical_url" text;--> statement-breakpoint
+ALTER TABLE "event_raw" ADD COLUMN IF NOT EXISTS "url_hash" text;--> statement-breakpoint
+CREATE UNIQUE INDEX IF NOT EXISTS "event_raw_source_url_hash_idx" ON "event_raw" USING btree ("source","url_hash");--> statement-breakpoint
+CREATE TABLE IF NOT EXISTS "event_duplicate" (
+	"event_id" integer PRIMARY KEY NOT NULL,
+	"canonical_event_id" integer NOT NULL,
+	"metro_id" integer,
+	"similarity" real,
+	"method" text NOT NULL,
+	"detected_at" timestamp with time zone DEFAULT now() NOT NULL
+);
+--> statement-breakpoint
+CREATE INDEX IF NOT EXISTS "event_duplicate_canonical_idx" ON "event_duplicate" USING btree ("canonical_event_id");
\ No newline at end of file
@@ -1,22 +1,33 @@
+import numpy as np
 import pandas as pd
 import pytz
 from datetime import datetime
 from shapely.geometry import Point
-import unicodedata
-import re
+import time
 import argparse
 
-# Function to create a slug
-def create_slug(name, country_code):
-    if pd.isna(name) or pd.isna(country_code):
-        return None
-    # Normalize to NFD (Normalization Form D) to decompose combined characters
-    s = unicodedata.normalize('NFD', str(name).lower())
-    # Remove diacritics (marks)
-    s = ''.join(c for c in s if unicodedata.category(c) != 'Mn')
-    s = re.sub(r'[^a-z0-9\s-]', '', s)  # Remove special characters except space and hyphen
-    s = re.sub(r'[\s_]+|-', '-', s).strip('-') # Replace whitespace/underscores with hyphens, clean multiple/leading/trailing hyphens
-    return f"{s}-{str(country_code).lower()}"
+# Slug body (without the country suffix) for each unique name seen so far; the
+# same place names repeat across chunks and countries
+_slug_cache = {}
+
+# Function to create slugs for a column of names
+def create_slugs(names, country_codes):
+    """
+    Vectorized slug ("sao-paulo-br") for each row. Each distinct name is
+    normalized once: NFD decomposition, diacritics and special characters
+    dropped (they are all non-ASCII or punctuation), whitespace/underscores
+    and hyphens replaced with hyphens.
+    """
+    new_names = pd.Series(pd.unique(names.dropna()), dtype=object)
+    new_names = new_names[~new_names.isin(_slug_cache.keys())]
+    if len(new_names):
+        bodies = (new_names.astype(str).str.lower().str.normalize('NFD')
+                  .str.replace(r'[^a-z0-9\s-]', '', regex=True)
+                  .str.replace(r'[\s_]+|-', '-', regex=True)
+                  .str.strip('-'))
+        _slug_cache.update(zip(new_names, bodies))
+    slugs = names.map(_slug_cache) + '-' + country_codes.str.lower()
+    return slugs.where(names.notna() & country_codes.notna(), None)
 
 # Function to calculate timezone offset in minutes
 def get_tz_offset_minutes(tz_id):
@@ -36,23 +47,23 @@ def get_tz_offset_minutes(tz_id):
         print(f"Warning: Could not get offset for {tz_id}: {e}")
         return None # Catch any other potential errors during offset calculation
 
-# Function to determine metro tier
-def get_metro_tier(population):
-    if pd.isna(population):
-        return None
-    try:
-        pop = int(population)
-    except ValueError:
-        return None # Population might not be a valid integer
-        
-    if pop >= 10000000:
-        return 1
-    elif pop >= 3000000:
-        return 2
-    elif pop >= 1000000:
-        return 3
-    else:
-        return 4
+# UTC offset per timezone id, looked up once per distinct timezone
+_tz_offset_cache = {}
+
+def get_tz_offsets_minutes(tz_ids):
+    for tz_id in pd.unique(tz_ids.dropna()):
+        if tz_id not in _tz_offset_cache:
+            _tz_offset_cache[tz_id] = get_tz_offset_minutes(tz_id)
+    return tz_ids.map(_tz_offset_cache).astype('Int64')
+
+# Function to determine metro tiers
+def get_metro_tiers(population):
+    tiers = np.select(
+        [population >= 10000000, population >= 3000000, population >= 1000000, population.notna()],
+        [1, 2, 3, 4],
+        default=0,
+    )
+    return pd.Series(tiers, index=population.index).astype('Int64').where(population.notna())
 
 # Function to create a bounding box (25km buffer, returns WKT string)
 # Approximate conversion: 1 degree of latitude is approx 111 km.
@@ -62,70 +73,77 @@ KM_PER_DEGREE_LAT = 111.0
 KM_PER_DEGREE_LON_EQUATOR = 111.32 # At the equator
 BUFFER_KM = 25.0
 
-def get_bbox_wkt(latitude, longitude):
-    if pd.isna(latitude) or pd.isna(longitude):
-        return None
-    try:
-        lat = float(latitude)
-        lon = float(longitude)
-        # Approximate buffer in degrees
-        lat_buffer = BUFFER_KM / KM_PER_DEGREE_LAT
-        # Approximation for lon_buffer, gets smaller away from equator
-        import math
-        lon_buffer_denominator = (KM_PER_DEGREE_LON_EQUATOR * abs(math.cos(math.radians(lat))))
-        if lon_buffer_denominator == 0: # Avoid division by zero at poles
-            lon_buffer = BUFFER_KM / KM_PER_DEGREE_LON_EQUATOR # fallback or handle as error
-        else:
-            lon_buffer = BUFFER_KM / lon_buffer_denominator
-        
-        min_lon, min_lat = lon - lon_buffer, lat - lat_buffer
-        max_lon, max_lat = lon + lon_buffer, lat + lat_buffer
-        
-        # Create a WKT polygon string for the bounding box
-        return f'POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, {max_lon} {max_lat}, {min_lon} {max_lat}, {min_lon} {min_lat}))'
-    except ValueError: # Handle cases where lat/lon might not be convertible to float
-        return None
-    except Exception as e:
-        print(f"Warning: Could not calculate bbox for lat={latitude}, lon={longitude}: {e}")
-        return None
+def get_bbox_wkts(latitude, longitude):
+    """Vectorized WKT bounding box polygon for each row; None where lat/lon is missing."""
+    lat = latitude.to_numpy(dtype=float)
+    lon = longitude.to_numpy(dtype=float)
+    # Approximate buffer in degrees
+    lat_buffer = BUFFER_KM / KM_PER_DEGREE_LAT
+    # Approximation for lon_buffer, gets smaller away from equator
+    lon_buffer_denominator = KM_PER_DEGREE_LON_EQUATOR * np.abs(np.cos(np.radians(lat)))
+    with np.errstate(divide='ignore'):
+        lon_buffer = np.where(lon_buffer_denominator == 0, BUFFER_KM / KM_PER_DEGREE_LON_EQUATOR,
+                              BUFFER_KM / lon_buffer_denominator)  # Fallback at the poles
+
+    # Corners rounded to 6 decimals (~0.1 m), each formatted once per row
+    def text(values):
+        return [f'{value:.6f}' for value in values.tolist()]
+
+    min_lon, min_lat = text(lon - lon_buffer), text(lat - lat_buffer)
+    max_lon, max_lat = text(lon + lon_buffer), text(lat + lat_buffer)
+    missing = (np.isnan(lat) | np.isnan(lon)).tolist()
+    wkt = [
+        None if skip else f'POLYGON(({x0} {y0}, {x1} {y0}, {x1} {y1}, {x0} {y1}, {x0} {y0}))'
+        for x0, y0, x1, y1, skip in zip(min_lon, min_lat, max_lon, max_lat, missing)
+    ]
+    return pd.Series(wkt, index=latitude.index, dtype=object)
+
+def enrich_chunk(df):
+    # Convert relevant columns to appropriate types if necessary, after loading
+    df['population'] = pd.to_numeric(df['population'], errors='coerce')
+    df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
+    df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
 
-def main(input_file, output_file):
+    df['tz_offset_min'] = get_tz_offsets_minutes(df['timezone'])
+    df['metro_tier'] = get_metro_tiers(df['population'])
+    df['slug'] = create_slugs(df['asciiname'], df['country_code'])
+    df['bbox_wkt'] = get_bbox_wkts(df['latitude'], df['longitude'])
+    return df
+
+# Rows per chunk; keeps memory flat on the multi-GB allCountries dump
+CHUNK_SIZE = 500000
+
+def main(input_file, output_file, chunk_size=CHUNK_SIZE):
     geonames_fields = [
         'geonameid', 'name', 'asciiname', 'alternatenames', 'latitude', 
         'longitude', 'feature_class', 'feature_code', 'country_code', 
         'cc2', 'admin1_code', 'admin2_code', 'admin3_code', 'admin4_code', 
         'population', 'elevation', 'dem', 'timezone', 'modification_date'
     ]
+    # Codes stay text so every chunk gets the same types (and admin codes keep leading zeros)
+    text_fields = [
+        'name', 'asciiname', 'alternatenames', 'feature_class', 'feature_code', 'country_code',
+        'cc2', 'admin1_code', 'admin2_code', 'admin3_code', 'admin4_code', 'timezone', 'modification_date'
+    ]
 
     try:
         # Read tab-separated file, no header, assign column names
-        df = pd.read_csv(input_file, delimiter='\t', header=None, names=geonames_fields, low_memory=False)
-
-        # Convert relevant columns to appropriate types if necessary, after loading
-        df['population'] = pd.to_numeric(df['population'], errors='coerce')
-        df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-        df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
-
-        print(f"Processing {len(df)} rows from {input_file}...")
-
-        print("Computing tz_offset...")
-        df['tz_offset_min'] = df['timezone'].apply(get_tz_offset_minutes)
-        
-        print("Computing metro_tier...")
-        df['metro_tier'] = df['population'].apply(get_metro_tier)
-        
-        print("Computing slug...")
-        df['slug'] = df.apply(lambda row: create_slug(row['asciiname'], row['country_code']), axis=1)
-        
-        print("Computing bbox (WKT)...")
-        df['bbox_wkt'] = df.apply(lambda row: get_bbox_wkt(row['latitude'], row['longitude']), axis=1)
-
-        # Save the enriched DataFrame to CSV
-        df.to_csv(output_file, index=False, encoding='utf-8')
-
-        print(f"\nSuccessfully enriched data and saved to {output_file}")
-        # print("First 5 rows of the enriched CSV:")
-        # print(df.head().to_string()) # This might be too verbose for many rows
+        reader = pd.read_csv(input_file, delimiter='\t', header=None, names=geonames_fields,
+                             dtype={field: str for field in text_fields}, chunksize=chunk_size)
+
+        print(f"Processing {input_file} in chunks of {chunk_size} rows...")
+        started = time.time()
+        total_rows = 0
+        for chunk_number, df in enumerate(reader):
+            df = enrich_chunk(df)
+            # Save the enriched chunk to CSV, header with the first one
+            df.to_csv(output_file, index=False, encoding='utf-8', mode='w' if chunk_number == 0 else 'a',
+                      header=chunk_number == 0)
+            total_rows += len(df)
+            print(f"Enriched {total_rows} rows ({time.time() - started:.1f}s)")
+
+        print(f"\nSuccessfully enriched {total_rows} rows ({len(_tz_offset_cache)} timezones, "
+              f"{len(_slug_cache)} distinct names) and saved to {output_file}")
 
     except FileNotFoundError:
         print(f"Error: The file {input_file} was not found.")
@@ -136,7 +154,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Enrich Geonames data with additional fields.')
     parser.add_argument('input_file', type=str, help='Path to the input Geonames TXT file (tab-delimited, no header).')
     parser.add_argument('output_file', type=str, help='Path to save the enriched CSV file.')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows read and enriched at a time.')
     
     args = parser.parse_args()
     
-    main(args.input_file, args.output_file) 
\ No newline at end of file
+    main(args.input_file, args.output_file, args.chunk_size) 
\ No newline at end of file
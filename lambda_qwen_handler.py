@@ -3,12 +3,14 @@
 lambda_qwen_handler.py
 
 AWS Lambda handler for extracting structured information from event descriptions
-using Alibaba's Qwen 3 large language model.
+using Alibaba's Qwen 3 large language model. Accepts a single event or a batch
+({"events": [...]}) whose items are extracted concurrently.
 """
 
 import os
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 import dashscope
 from dashscope import Generation
@@ -22,6 +24,9 @@ logger.setLevel(logging.INFO)
 DASHSCOPE_API_KEY = os.environ.get('DASHSCOPE_API_KEY')
 dashscope.api_key = DASHSCOPE_API_KEY
 
+# Concurrent Qwen calls per batched invocation
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 5))
+
 def extract_fields_from_description(description, title, fields_to_extract):
     """
     Use Qwen 3 to extract specified fields from event description text.
@@ -92,12 +97,48 @@ Format your response as a JSON object with these fields. If you can't find infor
         logger.error(f"Error calling Qwen API: {e}")
         return {}
 
+def process_single_event(event):
+    """
+    Extract fields for one event item.
+    
+    Returns:
+        Dict with event_id and either extracted_data or error
+    """
+    event_id = event.get('event_id')
+    description = event.get('description', '')
+    fields_to_extract = event.get('fields_to_extract', [])
+    if not description:
+        return {'event_id': event_id, 'error': 'No description provided'}
+    if not fields_to_extract:
+        return {'event_id': event_id, 'error': 'No fields to extract specified'}
+    try:
+        extracted_data = extract_fields_from_description(description, event.get('title', ''), fields_to_extract)
+        return {'event_id': event_id, 'extracted_data': extracted_data}
+    except Exception as e:
+        logger.error(f"Error processing event {event_id}: {e}")
+        return {'event_id': event_id, 'error': str(e)}
+
+def handle_batch(events):
+    """
+    Extract fields for a list of events, several Qwen calls at a time.
+    
+    Returns:
+        Lambda response with one result per input event, in input order
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(events)))) as pool:
+        results = list(pool.map(process_single_event, events))
+    return {
+        'statusCode': 200,
+        'results': results
+    }
+
 def lambda_handler(event, context):
     """
     AWS Lambda handler function.
     
     Args:
-        event: Lambda event object containing:
+        event: Lambda event object containing either:
+            - events: List of items with the fields below (batched mode), or
             - event_id: ID of the event
             - description: Event description text
             - title: Event title
@@ -105,8 +146,13 @@ def lambda_handler(event, context):
         context: Lambda context
         
     Returns:
-        Dict containing the extracted information
+        Dict containing the extracted information. Batched calls return
+        'results': [{'event_id', 'extracted_data' | 'error'}, ...]
     """
+    if isinstance(event.get('events'), list):
+        logger.info(f"Received batch of {len(event['events'])} events")
+        return handle_batch(event['events'])
+    
     try:
         # Log the event
         logger.info(f"Received event: {event}")
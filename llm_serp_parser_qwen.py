@@ -3,12 +3,14 @@ import os
 import json
 import argparse
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from pathlib import Path
 import time
 
+from serp_rule_extractor import MIN_CONFIDENCE, iter_serp_items, route_serp_items
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -21,6 +23,18 @@ DEFAULT_MODEL = "Qwen/Qwen3-7B"
 MAX_NEW_TOKENS = 4096
 TEMPERATURE = 0.7
 
+# Batch mode (--input-dir)
+CHUNK_TOKEN_BUDGET = 3000  # SERP result text per prompt; the instructions come on top
+BATCH_SIZE = 8  # Chunks (from any files) per generate() call
+BATCH_MAX_NEW_TOKENS = 1536  # A chunk holds far fewer results than a whole SERP
+# SERP features that never describe a dance event (search suggestions, flights, reviews, ...)
+SKIPPED_ITEM_TYPES = {
+    "related_searches", "people_also_search", "people_also_ask", "google_flights", "google_reviews",
+    "third_party_reviews", "images", "video", "product_considerations", "knowledge_graph",
+    "discussions_and_forums",
+}
+FILE_STATS_FIELDS = ("items", "rule_events", "venues", "llm_items", "chunks", "prompt_tokens", "output_tokens", "events", "seconds")
+
 # Sample prompt template for extracting dance class events from SERP results
 PROMPT_TEMPLATE = """
 You are a specialized AI designed to extract dance class events from search engine results.
@@ -82,27 +96,78 @@ def save_output(data: Any, output_path: str) -> None:
     except Exception as e:
         logger.error(f"Error saving output: {e}")
 
-def format_serp_for_prompt(serp_data: Dict[str, Any]) -> str:
-    """Format the SERP data for inclusion in the prompt"""
-    formatted_results = []
-    
-    # Extract organic results
-    organic_results = serp_data.get("organic_results", [])
-    for i, result in enumerate(organic_results):
-        formatted_result = f"Result {i+1}:\n"
-        formatted_result += f"Title: {result.get('title', 'N/A')}\n"
-        formatted_result += f"URL: {result.get('link', 'N/A')}\n"
-        formatted_result += f"Snippet: {result.get('snippet', 'N/A')}\n"
-        
-        # Add rich snippet data if available
-        if "rich_snippet" in result:
-            rich = result["rich_snippet"]
-            if "top" in rich:
-                formatted_result += f"Rich Data: {rich['top']}\n"
-        
-        formatted_results.append(formatted_result)
-    
-    return "\n\n".join(formatted_results)
+def build_prompt(formatted_serp: str) -> str:
+    """Fill the prompt template (str.format would trip over the JSON braces in it)"""
+    return PROMPT_TEMPLATE.replace("{serp_results}", formatted_serp)
+
+def format_serp_item(item: Dict[str, Any], index: int) -> Optional[str]:
+    """Format one SERP item (and its sub-elements) as a prompt block; None for items that cannot hold events"""
+    item_type = item.get("type") or "unknown"
+    if item_type in SKIPPED_ITEM_TYPES:
+        return None
+    lines = [f"Result {index} ({item_type}):"]
+    for label, key in (("Title", "title"), ("URL", "url"), ("Snippet", "description"), ("Snippet", "snippet"),
+                       ("Address", "address"), ("Category", "category"), ("Rich Data", "rich_data")):
+        if item.get(key):
+            lines.append(f"{label}: {item[key]}")
+    for element in item.get("items") or []:
+        if not isinstance(element, dict):
+            continue
+        parts = [str(element[key]) for key in ("title", "snippet", "description", "url") if element.get(key)]
+        if parts:
+            lines.append("- " + " | ".join(parts))
+    return "\n".join(lines) if len(lines) > 1 else None
+
+def split_serp_for_llm(serp_data: Dict[str, Any], use_rules: bool = True,
+                       min_confidence: float = MIN_CONFIDENCE) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[str], Dict[str, int]]:
+    """
+    Rule-extract the structured items of a SERP file and format the rest for
+    the LLM. Returns (rule events, venues, prompt blocks, counts); with
+    use_rules off, every item goes to the LLM.
+    """
+    items = list(iter_serp_items(serp_data))
+    if use_rules:
+        rule_events, venues, llm_items, counts = route_serp_items(items, min_confidence)
+    else:
+        rule_events, venues, llm_items = [], [], items
+        counts = {"items": len(items), "rule_items": 0, "rule_events": 0, "venues": 0, "llm_items": len(items),
+                  "skipped_items": 0}
+    blocks = [block for block in (format_serp_item(item, i + 1) for i, item in enumerate(llm_items)) if block]
+    return rule_events, venues, blocks, counts
+
+def tag_llm_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Mark LLM-extracted events so they can be told apart from rule-extracted ones"""
+    return [dict(event, extraction="llm") for event in events if isinstance(event, dict)]
+
+def chunk_serp_blocks(blocks: List[str], count_tokens, token_budget: int = CHUNK_TOKEN_BUDGET) -> List[Tuple[str, int]]:
+    """
+    Pack formatted result blocks, in order, into chunks of at most
+    token_budget tokens. A single block over budget is cut to fit.
+    Returns (chunk text, token count) pairs.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for block in blocks:
+        tokens = count_tokens(block)
+        if tokens > token_budget:
+            # Characters per token is stable enough within one block to cut proportionally
+            block = block[:int(len(block) * token_budget / tokens)]
+            tokens = count_tokens(block)
+        if current and current_tokens + tokens > token_budget:
+            chunks.append(("\n\n".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(block)
+        current_tokens += tokens
+    if current:
+        chunks.append(("\n\n".join(current), current_tokens))
+    return chunks
+
+def iter_serp_files(input_dir: str, pattern: str = "**/*.json", max_files: Optional[int] = None) -> Iterator[Path]:
+    """Lazily yield SERP files under input_dir in a stable order"""
+    for count, path in enumerate(sorted(Path(input_dir).glob(pattern))):
+        if max_files is not None and count >= max_files:
+            return
+        if path.is_file():
+            yield path
 
 def load_model_and_tokenizer(model_name_or_path: str):
     """Load the LLM model and tokenizer"""
@@ -175,6 +240,133 @@ def generate_response(model, tokenizer, prompt: str, max_new_tokens: int = MAX_N
         logger.error(f"Error generating response: {e}")
         return ""
 
+def generate_batch(model, tokenizer, prompts: List[str], max_new_tokens: int = BATCH_MAX_NEW_TOKENS,
+                   temperature: float = TEMPERATURE) -> List[Tuple[str, int]]:
+    """Generate responses for several prompts in one padded generate() call; returns (text, output tokens) pairs"""
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(model.device)
+    prompt_length = inputs.input_ids.shape[1]
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            do_sample=temperature > 0,
+            pad_token_id=tokenizer.pad_token_id
+        )
+    results = []
+    for row in outputs:
+        output_ids = row[prompt_length:].tolist()
+        # Rows that finished early are padded up to the longest row
+        while output_ids and output_ids[-1] == tokenizer.pad_token_id:
+            output_ids.pop()
+        results.append((tokenizer.decode(output_ids, skip_special_tokens=True).strip(), len(output_ids)))
+    return results
+
+def merge_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge events found in several chunks of one file; later copies only fill fields that are still null"""
+    merged = {}
+    for event in events:
+        if not isinstance(event, dict):
+            continue
+        key = tuple(str(event.get(field) or "").strip().lower() for field in ("event_name", "date_time", "url"))
+        if key in merged:
+            for field, value in event.items():
+                if merged[key].get(field) is None and value is not None:
+                    merged[key][field] = value
+        else:
+            merged[key] = dict(event)
+    return list(merged.values())
+
+def run_batch_mode(args, model, tokenizer) -> None:
+    """
+    Parse a directory of SERP files on one loaded model. Each file is split
+    into result chunks within --chunk-tokens; chunks from consecutive files
+    share generate() calls of up to --batch-size prompts. Merged events go to
+    --output as JSONL (one event per line, tagged with its source file),
+    rule-extracted venues to --venues-output and per-file stats to
+    --stats-output.
+    """
+    count_tokens = lambda text: len(tokenizer(text, add_special_tokens=False).input_ids)
+    prompt_overhead = count_tokens(build_prompt(""))
+    input_dir = Path(args.input_dir)
+    stats_path = args.stats_output or f"{os.path.splitext(args.output)[0]}_stats.jsonl"
+    venues_path = args.venues_output or f"{os.path.splitext(args.output)[0]}_venues.jsonl"
+    pending = {}  # file -> stats and events collected so far
+    batch = []  # (file, prompt, prompt tokens)
+    totals = {"files": 0, "chunks": 0, "batches": 0, "rule_events": 0, "venues": 0, "events": 0, "prompt_tokens": 0, "output_tokens": 0}
+    started = time.time()
+
+    with open(args.output, 'w', encoding='utf-8') as events_out, open(stats_path, 'w', encoding='utf-8') as stats_out, \
+            open(venues_path, 'w', encoding='utf-8') as venues_out:
+        def finish_file(name):
+            state = pending.pop(name)
+            events = merge_events(state["events"])
+            for event in events:
+                events_out.write(json.dumps({"source_file": name, **event}, ensure_ascii=False) + "\n")
+            state.update(events=len(events), seconds=round(state["seconds"], 2))
+            stats_out.write(json.dumps({"file": name, **{key: state[key] for key in FILE_STATS_FIELDS}}) + "\n")
+            totals["events"] += len(events)
+            logger.info(f"{name}: {state['items']} items ({state['llm_items']} to the LLM in {state['chunks']} chunks) -> {len(events)} events "
+                        f"({state['prompt_tokens']} prompt / {state['output_tokens']} output tokens, {state['seconds']}s)")
+
+        def run_batch():
+            batch_started = time.time()
+            try:
+                results = generate_batch(model, tokenizer, [prompt for _, prompt, _ in batch], args.max_tokens,
+                                         args.temperature)
+            except Exception as e:
+                logger.error(f"Error generating batch of {len(batch)} chunks: {e}")
+                results = [("", 0)] * len(batch)
+            # Rows of one batch finish together, so each gets an equal share of its time
+            share = (time.time() - batch_started) / len(batch)
+            totals["batches"] += 1
+            for (name, _, prompt_tokens), (response, output_tokens) in zip(batch, results):
+                state = pending[name]
+                state["events"].extend(tag_llm_events(parse_llm_response(response)))
+                state["prompt_tokens"] += prompt_tokens
+                state["output_tokens"] += output_tokens
+                state["seconds"] += share
+                state["chunks_left"] -= 1
+                totals["prompt_tokens"] += prompt_tokens
+                totals["output_tokens"] += output_tokens
+                if state["chunks_left"] == 0:
+                    finish_file(name)
+            batch.clear()
+
+        for path in iter_serp_files(args.input_dir, args.pattern, args.max_files):
+            name = str(path.relative_to(input_dir))
+            rule_events, venues, blocks, counts = split_serp_for_llm(load_sample_data(str(path)), not args.no_rules,
+                                                                     args.min_confidence)
+            for venue in venues:
+                venues_out.write(json.dumps({"source_file": name, **venue}, ensure_ascii=False) + "\n")
+            chunks = chunk_serp_blocks(blocks, count_tokens, args.chunk_tokens)
+            totals["files"] += 1
+            totals["chunks"] += len(chunks)
+            totals["rule_events"] += len(rule_events)
+            totals["venues"] += len(venues)
+            pending[name] = {"items": counts["items"], "rule_events": len(rule_events), "venues": len(venues),
+                             "llm_items": counts["llm_items"],
+                             "chunks": len(chunks), "chunks_left": len(chunks),
+                             "prompt_tokens": 0, "output_tokens": 0, "seconds": 0.0, "events": list(rule_events)}
+            if not chunks:
+                finish_file(name)
+                continue
+            for chunk_text, chunk_tokens in chunks:
+                batch.append((name, build_prompt(chunk_text), chunk_tokens + prompt_overhead))
+                if len(batch) >= args.batch_size:
+                    run_batch()
+        if batch:
+            run_batch()
+
+    elapsed = time.time() - started
+    logger.info(f"Batch parsing done: {totals['files']} files, {totals['chunks']} chunks in {totals['batches']} batches, "
+                f"{totals['events']} events ({totals['rule_events']} from rules before merging), {totals['venues']} venues, {totals['prompt_tokens']} prompt / {totals['output_tokens']} output tokens "
+                f"in {elapsed:.1f}s ({totals['output_tokens'] / elapsed if elapsed else 0:.1f} output tokens/s)")
+    logger.info(f"Events saved to: {args.output}; venues saved to: {venues_path}; per-file stats saved to: {stats_path}")
+
 def parse_llm_response(response: str) -> List[Dict[str, Any]]:
     """Parse the LLM response into structured data"""
     try:
@@ -201,10 +393,22 @@ def parse_llm_response(response: str) -> List[Dict[str, Any]]:
 
 def main():
     parser = argparse.ArgumentParser(description="Parse SERP data with Qwen-3 LLM")
-    parser.add_argument("--input", required=True, help="Path to sample SERP JSON data")
-    parser.add_argument("--output", default="parsed_events.json", help="Path to output file")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Path to sample SERP JSON data")
+    source.add_argument("--input-dir", help="Batch mode: directory of SERP JSON files (e.g. data_raw)")
+    parser.add_argument("--output", help="Path to output file (default parsed_events.json, or parsed_events.jsonl in batch mode)")
     parser.add_argument("--model", default=DEFAULT_MODEL, help="Model path or name")
-    parser.add_argument("--max-tokens", type=int, default=MAX_NEW_TOKENS, help="Maximum new tokens to generate")
+    parser.add_argument("--max-tokens", type=int, help=f"Maximum new tokens to generate (default {MAX_NEW_TOKENS}, "
+                                                       f"{BATCH_MAX_NEW_TOKENS} per chunk in batch mode)")
+    parser.add_argument("--pattern", default="**/*.json", help="Batch mode: glob for SERP files under --input-dir")
+    parser.add_argument("--max-files", type=int, help="Batch mode: stop after this many files")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKEN_BUDGET, help="Batch mode: SERP tokens per prompt")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Batch mode: prompts per generate() call")
+    parser.add_argument("--no-rules", action="store_true", help="Send every SERP item to the LLM (baseline for recall checks)")
+    parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE,
+                        help="Rule-extracted events or venues below this confidence go to the LLM instead")
+    parser.add_argument("--venues-output", help="Rule-extracted venues (default <output>_venues.jsonl, or <output>_venues.json)")
+    parser.add_argument("--stats-output", help="Batch mode: per-file stats JSONL (default <output>_stats.jsonl)")
     parser.add_argument("--temperature", type=float, default=TEMPERATURE, help="Sampling temperature")
     parser.add_argument("--skip-gpu-check", action="store_true", help="Skip GPU availability check")
     args = parser.parse_args()
@@ -217,17 +421,36 @@ def main():
             logger.info("Exiting due to no GPU.")
             return
     
+    if args.input_dir:
+        args.output = args.output or "parsed_events.jsonl"
+        args.max_tokens = args.max_tokens or BATCH_MAX_NEW_TOKENS
+        model, tokenizer = load_model_and_tokenizer(args.model)
+        run_batch_mode(args, model, tokenizer)
+        return
+    args.output = args.output or "parsed_events.json"
+    args.max_tokens = args.max_tokens or MAX_NEW_TOKENS
+    
     # Load sample data
     sample_data = load_sample_data(args.input)
     if not sample_data:
         logger.error("No sample data loaded. Exiting.")
         return
     
-    # Format SERP data for prompt
-    formatted_serp = format_serp_for_prompt(sample_data)
+    # Structured items (events, local pack, maps) are extracted by rules; only the rest goes to the LLM
+    rule_events, venues, blocks, counts = split_serp_for_llm(sample_data, not args.no_rules, args.min_confidence)
+    logger.info(f"{counts['items']} SERP items: {counts['rule_events']} events and {counts['venues']} venues from rules, "
+                f"{counts['llm_items']} items for the LLM")
+    if venues:
+        venues_path = args.venues_output or f"{os.path.splitext(args.output)[0]}_venues.json"
+        save_output(venues, venues_path)
+        logger.info(f"Venues saved to: {venues_path}")
+    if not blocks:
+        save_output(rule_events, args.output)
+        logger.info(f"Nothing left for the LLM; {len(rule_events)} rule-extracted events saved to: {args.output}")
+        return
     
     # Create the full prompt
-    prompt = PROMPT_TEMPLATE.format(serp_results=formatted_serp)
+    prompt = build_prompt("\n\n".join(blocks))
     
     # Log the prompt (for debugging)
     logger.info(f"Prompt length: {len(prompt)} characters")
@@ -246,7 +469,7 @@ def main():
         )
         
         # Parse structured data from response
-        events = parse_llm_response(response)
+        events = rule_events + tag_llm_events(parse_llm_response(response))
         
         # Save raw response for debugging
         raw_output_path = f"{os.path.splitext(args.output)[0]}_raw.txt"
@@ -256,7 +479,7 @@ def main():
         save_output(events, args.output)
         
         # Print summary
-        logger.info(f"Extracted {len(events)} events from SERP data")
+        logger.info(f"Extracted {len(events)} events from SERP data ({len(rule_events)} by rules)")
         logger.info(f"Raw response saved to: {raw_output_path}")
         logger.info(f"Structured data saved to: {args.output}")
         
@@ -6,6 +6,8 @@ import logging
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
+from serp_rule_extractor import iter_serp_items, route_serp_items
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -81,6 +83,22 @@ def format_serp_for_prompt(serp_data: Dict[str, Any]) -> str:
     
     return "\n\n".join(formatted_results)
 
+def format_items_for_prompt(items: List[Dict[str, Any]]) -> str:
+    """Format SERP items left over after rule extraction (see serp_rule_extractor.py)"""
+    formatted_results = []
+    for i, item in enumerate(items):
+        formatted_result = f"Result {i+1} ({item.get('type', 'unknown')}):\n"
+        formatted_result += f"Title: {item.get('title', 'N/A')}\n"
+        formatted_result += f"URL: {item.get('url', 'N/A')}\n"
+        formatted_result += f"Snippet: {item.get('description', 'N/A')}\n"
+        if item.get("rich_data"):
+            formatted_result += f"Rich Data: {item['rich_data']}\n"
+        for element in item.get("items") or []:
+            if isinstance(element, dict) and element.get("title"):
+                formatted_result += f"- {element['title']} | {element.get('url', 'N/A')}\n"
+        formatted_results.append(formatted_result)
+    return "\n\n".join(formatted_results)
+
 def run_inference_local(prompt: str) -> str:
     """
     Placeholder for running inference locally.
@@ -103,8 +121,19 @@ def main():
         logger.error("No sample data loaded. Exiting.")
         return
     
+    # Structured items are extracted by rules; only organic and other free-text results go to the LLM
+    rule_events, venues, llm_items, counts = route_serp_items(iter_serp_items(sample_data))
+    logger.info(f"{counts['items']} SERP items: {counts['rule_events']} events and {counts['venues']} venues from rules, "
+                f"{counts['llm_items']} items for the LLM")
+    if venues:
+        save_output(venues, f"{os.path.splitext(args.output)[0]}_venues.json")
+    if not llm_items:
+        save_output(rule_events, args.output)
+        logger.info("No free-text results left for the LLM.")
+        return
+    
     # Format SERP data for prompt
-    formatted_serp = format_serp_for_prompt(sample_data)
+    formatted_serp = format_items_for_prompt(llm_items)
     
     # Create the full prompt
     prompt = PROMPT_TEMPLATE.format(serp_results=formatted_serp)
@@ -124,7 +153,7 @@ def main():
         result = run_inference_local(prompt)  # Using placeholder for now
     
     # Save the result
-    save_output(result, args.output)
+    save_output(rule_events + json.loads(result), args.output)
     
     logger.info("LLM parsing test completed.")
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+pipeline_metrics.py
+
+Shared Prometheus instrumentation for the workers and pipeline scripts.
+Long-running processes expose /metrics over HTTP (METRICS_PORT); batch jobs
+push to a Pushgateway (PUSHGATEWAY_URL) when they finish. Without
+prometheus_client installed every metric becomes a no-op so scripts still run.
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+try:
+    from prometheus_client import (
+        CollectorRegistry, Counter, Gauge, Histogram,
+        start_http_server, push_to_gateway,
+    )
+    PROMETHEUS_AVAILABLE = True
+except ImportError:
+    PROMETHEUS_AVAILABLE = False
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # 0 disables the HTTP endpoint
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL")
+QUEUE_DEPTH_INTERVAL = float(os.getenv("QUEUE_DEPTH_INTERVAL", 5.0))
+
+# Buckets tuned for the stages we time: sub-10ms DB writes up to multi-second page loads
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class _NoopMetric:
+    """Stands in for a metric when prometheus_client is not installed."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+
+if PROMETHEUS_AVAILABLE:
+    registry = CollectorRegistry()
+
+    fetch_latency = Histogram('fetch_latency_seconds', 'Page fetch latency in seconds',
+                              ['worker'], buckets=LATENCY_BUCKETS, registry=registry)
+    extraction_seconds = Histogram('extraction_seconds', 'Structured data extraction/parse time in seconds',
+                                   ['worker'], buckets=LATENCY_BUCKETS, registry=registry)
+    db_write_latency = Histogram('db_write_latency_seconds', 'Database write latency in seconds',
+                                 ['worker'], buckets=LATENCY_BUCKETS, registry=registry)
+    geocode_latency = Histogram('geocode_latency_seconds', 'Geocoding request latency in seconds',
+                                ['provider'], buckets=LATENCY_BUCKETS, registry=registry)
+    cache_requests_total = Counter('cache_requests_total', 'Cache lookups by result; hit rate = hit / (hit + miss)',
+                                   ['cache', 'result'], registry=registry)
+    items_processed_total = Counter('items_processed_total', 'Items handled per worker and outcome',
+                                    ['worker', 'outcome'], registry=registry)
+    queue_depth = Gauge('queue_depth', 'Length of the Redis work queues', ['queue'], registry=registry)
+else:
+    registry = None
+    fetch_latency = extraction_seconds = db_write_latency = geocode_latency = _NoopMetric()
+    cache_requests_total = items_processed_total = queue_depth = _NoopMetric()
+
+_server_lock = threading.Lock()
+_server_started = False
+
+
+def start_metrics_server(port=None):
+    """
+    Starts the /metrics HTTP endpoint once per process. Safe to call from
+    every worker thread (run_workers.py runs several in one process).
+    """
+    global _server_started
+    port = port or METRICS_PORT
+    if not PROMETHEUS_AVAILABLE or not port:
+        return False
+    with _server_lock:
+        if _server_started:
+            return True
+        try:
+            start_http_server(port, registry=registry)
+            _server_started = True
+            print(f"Metrics endpoint listening on :{port}/metrics")
+        except OSError as e:
+            print(f"Could not start metrics endpoint on port {port}: {e}")
+    return _server_started
+
+
+def push_metrics(job, metrics_registry=None):
+    """Pushes a registry to the Pushgateway, for batch jobs that exit before being scraped."""
+    if not PROMETHEUS_AVAILABLE or not PUSHGATEWAY_URL:
+        return False
+    try:
+        push_to_gateway(PUSHGATEWAY_URL, job=job, registry=metrics_registry or registry)
+        return True
+    except Exception as e:
+        print(f"Failed to push metrics to {PUSHGATEWAY_URL}: {e}")
+        return False
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Times the enclosed block into histogram (with the given labels)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(**labels).observe(time.perf_counter() - start)
+
+
+def record_cache_lookup(cache, hit):
+    """Counts one cache lookup as a hit or miss."""
+    cache_requests_total.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def start_queue_depth_monitor(redis_conn, queues=("url_queue", "jsonld_raw"), interval=QUEUE_DEPTH_INTERVAL):
+    """
+    Samples LLEN for each queue on a daemon thread. Only one monitor runs per
+    process; later calls are ignored.
+    """
+    if not PROMETHEUS_AVAILABLE or getattr(start_queue_depth_monitor, "_thread", None):
+        return None
+
+    def _sample():
+        while True:
+            try:
+                pipe = redis_conn.pipeline(transaction=False)
+                for queue in queues:
+                    pipe.llen(queue)
+                for queue, depth in zip(queues, pipe.execute()):
+                    queue_depth.labels(queue=queue).set(depth)
+            except Exception as e:
+                print(f"Queue depth sampling failed: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=_sample, name="queue-depth-monitor", daemon=True)
+    thread.start()
+    start_queue_depth_monitor._thread = thread
+    return thread
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+pipeline_stages.py
+
+Small stage DAG runner for the batch pipelines. Each stage declares the
+stages it depends on; stages whose dependencies are done run concurrently,
+so total wall-clock is the longest chain rather than the sum of all stages.
+Inside a stage, run_bounded fans work out to a worker pool while capping the
+number of in-flight items, and StageStats keeps per-stage throughput.
+"""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from pipeline_metrics import items_processed_total
+
+_EXHAUSTED = object()
+
+
+class StageStats:
+    """Thread-safe per-stage counters."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.succeeded = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, ok, count=1):
+        with self.lock:
+            if ok:
+                self.succeeded += count
+            else:
+                self.failed += count
+        items_processed_total.labels(worker=self.name, outcome="success" if ok else "error").inc(count)
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def summary(self):
+        total = self.succeeded + self.failed
+        rate = total / self.elapsed if self.elapsed else 0.0
+        return (f"{self.name}: {self.succeeded} ok, {self.failed} failed in {self.elapsed:.1f}s "
+                f"({rate:.2f} items/s)")
+
+
+class Stage:
+    """
+    One node of the pipeline DAG.
+
+    Args:
+        name: Stage name, also the metrics label.
+        func: Called as func(stats); should record outcomes on stats.
+        depends_on: Names of stages that must finish first.
+    """
+
+    def __init__(self, name, func, depends_on=()):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+def run_bounded(func, items, workers, on_result, max_in_flight=None):
+    """
+    Runs func(item) on a pool of workers with at most max_in_flight items
+    submitted at once (default 2 x workers), so large batches do not queue
+    unbounded work. on_result(item, result, error) is called on the calling
+    thread as each item finishes, which keeps DB writes on one connection.
+    """
+    workers = max(1, workers)
+    max_in_flight = max(workers, max_in_flight or workers * 2)
+    items = iter(items)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            while len(in_flight) < max_in_flight:
+                item = next(items, _EXHAUSTED)
+                if item is _EXHAUSTED:
+                    break
+                in_flight[pool.submit(func, item)] = item
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                error = future.exception()
+                on_result(item, None if error else future.result(), error)
+
+
+def run_stage_graph(stages):
+    """
+    Runs stages as soon as their dependencies have completed. A stage whose
+    dependency failed is skipped. Returns {name: StageStats}.
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        # A dependency that is not part of this run (e.g. skipped via flags) counts as done
+        stage.depends_on = tuple(dep for dep in stage.depends_on if dep in names)
+
+    stats = {stage.name: StageStats(stage.name) for stage in stages}
+    done, failed = set(), set()
+    running = {}
+
+    def _run(stage):
+        stage_stats = stats[stage.name]
+        stage_stats.started_at = time.monotonic()
+        print(f"\n=== Stage '{stage.name}' started ===")
+        try:
+            stage.func(stage_stats)
+        finally:
+            stage_stats.finished_at = time.monotonic()
+            print(f"=== Stage '{stage.name}' finished: {stage_stats.summary()} ===")
+
+    with ThreadPoolExecutor(max_workers=max(1, len(stages)), thread_name_prefix="stage") as pool:
+        pending = list(stages)
+        while pending or running:
+            for stage in list(pending):
+                if any(dep in failed for dep in stage.depends_on):
+                    print(f"Skipping stage '{stage.name}': a dependency failed")
+                    pending.remove(stage)
+                    failed.add(stage.name)
+                elif all(dep in done for dep in stage.depends_on):
+                    pending.remove(stage)
+                    running[pool.submit(_run, stage)] = stage
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                error = future.exception()
+                if error:
+                    print(f"Stage '{stage.name}' failed: {error}")
+                    failed.add(stage.name)
+                else:
+                    done.add(stage.name)
+
+    print("\n=== Stage summary ===")
+    for stage in stages:
+        print(stats[stage.name].summary())
+    return stats
@@ -14,6 +14,7 @@ import datetime
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2.extras import DictCursor, Json
+from pipeline_metrics import record_cache_lookup
 
 # Load environment variables
 load_dotenv()
@@ -333,6 +334,7 @@ def resolve_venue_address(venue_name, original_address=None, city=None):
         
         # Try to get from cache first
         cached_data = check_venue_cache(conn, venue_name, city)
+        record_cache_lookup("venue_cache", bool(cached_data))
         if cached_data:
             print(f"Found venue in cache: {venue_name}")
             return cached_data
@@ -0,0 +1,141 @@
+"""
+Admission control for the Qwen inference service.
+
+Every generation is charged an estimated token cost (prompt + max_new_tokens)
+against a global in-flight budget. Requests that do not fit wait in a bounded
+priority queue, so short /style and /dedupe calls are admitted ahead of long
+/extract calls. When the queue is full, or a request waits longer than
+queue_timeout_s, the request is rejected and the API answers 429 with a
+Retry-After estimate instead of piling up threads until the box runs out of
+memory.
+"""
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+PRIORITY_HIGH = 0  # /style, /dedupe: short prompts, short outputs
+PRIORITY_LOW = 1   # /extract: large HTML prompts, long outputs
+
+CHARS_PER_TOKEN = 4  # Cheap estimate; tokenizing a 2 MB body just to admit it would cost more than it saves
+
+
+def estimate_cost(prompt_text, max_new_tokens):
+    """Estimated tokens a request holds while in flight."""
+    return len(prompt_text) // CHARS_PER_TOKEN + 1 + max_new_tokens
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after_s):
+        super().__init__(reason)
+        self.retry_after_s = retry_after_s
+
+
+class AdmissionController:
+    """
+    Token-budget admission with a bounded priority wait queue.
+
+    Args:
+        token_budget: Most estimated tokens admitted at once. A single request
+            larger than the budget is admitted alone.
+        max_queue: Most requests waiting for admission.
+        queue_timeout_s: Longest a request waits before it is rejected.
+    """
+
+    def __init__(self, token_budget=32768, max_queue=64, queue_timeout_s=60.0):
+        self.token_budget = token_budget
+        self.max_queue = max_queue
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight_tokens = 0
+        self.in_flight_requests = 0
+        self.waiters = []  # heap of (priority, sequence, cost, future)
+        self.sequence = itertools.count()
+        self.tokens_per_second = None  # EWMA of completed-token throughput
+        self.admitted = 0
+        self.rejected = 0
+
+    def _fits(self, cost):
+        return self.in_flight_requests == 0 or self.in_flight_tokens + min(cost, self.token_budget) <= self.token_budget
+
+    def _grant(self, cost):
+        self.in_flight_tokens += min(cost, self.token_budget)
+        self.in_flight_requests += 1
+        self.admitted += 1
+
+    def _wake(self):
+        # Strict priority order: a waiting /extract never jumps ahead of a waiting /style
+        while self.waiters:
+            priority, _, cost, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            if not self._fits(cost):
+                break
+            heapq.heappop(self.waiters)
+            self._grant(cost)
+            future.set_result(True)
+
+    def retry_after(self):
+        """Seconds until the queued work is likely drained."""
+        queued = sum(cost for _, _, cost, future in self.waiters if not future.done()) + self.in_flight_tokens
+        if not self.tokens_per_second:
+            return 5
+        return max(1, min(120, math.ceil(queued / self.tokens_per_second)))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        raise AdmissionRejected(reason, self.retry_after())
+
+    async def acquire(self, cost, priority=PRIORITY_LOW):
+        blocked = any(waiter[0] <= priority and not waiter[3].done() for waiter in self.waiters)
+        if not blocked and self._fits(cost):
+            self._grant(cost)
+            return
+        if sum(1 for waiter in self.waiters if not waiter[3].done()) >= self.max_queue:
+            self._reject("Admission queue is full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), cost, future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            if future.done():
+                # Granted just as the timeout fired; keep the slot
+                return
+            future.cancel()
+            self._reject("Timed out waiting for admission")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Client went away after being admitted; hand the tokens back
+                self.release(cost)
+            else:
+                future.cancel()
+            raise
+
+    def release(self, cost, elapsed_s=None):
+        self.in_flight_tokens -= min(cost, self.token_budget)
+        self.in_flight_requests -= 1
+        if elapsed_s:
+            rate = cost / elapsed_s
+            self.tokens_per_second = rate if self.tokens_per_second is None else 0.8 * self.tokens_per_second + 0.2 * rate
+        self._wake()
+
+    @asynccontextmanager
+    async def admit(self, cost, priority=PRIORITY_LOW):
+        await self.acquire(cost, priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(cost, time.monotonic() - started)
+
+    def stats(self):
+        return {
+            "in_flight_tokens": self.in_flight_tokens,
+            "in_flight_requests": self.in_flight_requests,
+            "token_budget": self.token_budget,
+            "queued": sum(1 for waiter in self.waiters if not waiter[3].done()),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
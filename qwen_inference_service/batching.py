@@ -0,0 +1,299 @@
+"""
+Micro-batching for the Qwen inference service.
+
+Concurrent /style, /extract and /dedupe requests used to run as separate
+batch-size-1 generate() calls contending for one model. MicroBatcher queues
+prompts, waits up to max_wait_ms for more to arrive (or until max_batch_size
+is reached), runs one padded generate() per group of requests that share
+generation settings, and resolves each request's future with its own slice
+of the output.
+
+Backends are pluggable: TransformersBackend wraps the real (or a tiny)
+Hugging Face model, StubBackend simulates per-batch and per-token cost so the
+scheduling logic can be exercised and benchmarked on CPU
+(see benchmark_batching.py). Both also expose stream(), a single-prompt
+token iterator used by the streaming endpoints, which bypass batching.
+Requests may name the fixed leading part of their prompt (prefix); single
+prompt generations then reuse its prefilled KV cache (see prefix_cache.py).
+A request may also carry a JSONConstraint; its logits processor then keeps
+the output schema-valid (see json_constraint.py). Such requests run without
+thinking: the chat template gets enable_thinking=False, so the schema applies
+from the first generated token instead of after a free-form <think> block.
+"""
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, field
+
+
+@dataclass
+class GenerationRequest:
+    prompt: str
+    max_new_tokens: int
+    enable_thinking: bool
+    future: asyncio.Future
+    prefix: str | None = None
+    constraint: object = None
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def batch_key(self):
+        # Only requests with the same sampling settings and length cap share a generate() call,
+        # so a short /style request never waits for a 2048-token /extract in the same batch;
+        # rows of one batch also share the output constraint
+        return (self.enable_thinking, self.max_new_tokens, self.constraint)
+
+
+def render_chat_prompt(tokenizer, prompt, enable_thinking=True):
+    """Chat-templated text for one user prompt; Qwen3's template closes an empty think block when thinking is off."""
+    return tokenizer.apply_chat_template(
+        [{"role": "user", "content": prompt}], tokenize=False, add_generation_prompt=True,
+        enable_thinking=enable_thinking,
+    )
+
+
+def sampling_kwargs(enable_thinking):
+    """Qwen3 recommended sampling settings for thinking/non-thinking mode."""
+    return {
+        "temperature": 0.6 if enable_thinking else 0.7,
+        "top_p": 0.95 if enable_thinking else 0.8,
+        "top_k": 20,
+        "do_sample": True,
+    }
+
+
+class TransformersBackend:
+    """Batched generation with a Hugging Face causal LM (left padding), with an optional PrefixKVCache."""
+
+    def __init__(self, tokenizer, model, device, prefix_cache=None):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.device = device
+        self.prefix_cache = prefix_cache
+        self.tokenizer.padding_side = "left"
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+    @property
+    def eos_token(self):
+        return self.tokenizer.eos_token
+
+    def count_tokens(self, text):
+        return len(self.tokenizer(text, add_special_tokens=False).input_ids)
+
+    def _constraint_kwargs(self, constraint, prompt_length, enable_thinking):
+        if constraint is None:
+            return {}
+        from transformers import LogitsProcessorList
+        processor = constraint.logits_processor(self.tokenizer, prompt_length, allow_think=enable_thinking)
+        return {"logits_processor": LogitsProcessorList([processor])}
+
+    def _decode(self, output_ids):
+        # The EOS that ends a finished answer would otherwise trail the JSON and fail parsing;
+        # <think>/</think> are ordinary added tokens for Qwen3, so they survive skip_special_tokens
+        return self.tokenizer.decode(output_ids, skip_special_tokens=True)
+
+    def _single_inputs(self, prompt, prefix, enable_thinking):
+        """Inputs for one prompt, reusing the prefix KV cache when possible."""
+        if self.prefix_cache is not None and prefix:
+            inputs = self.prefix_cache.build_inputs(prompt, prefix, enable_thinking=enable_thinking)
+            if inputs is not None:
+                return inputs
+        chat_text = render_chat_prompt(self.tokenizer, prompt, enable_thinking)
+        return self.tokenizer([chat_text], return_tensors="pt").to(self.device)
+
+    def generate_batch(self, prompts, max_new_tokens, enable_thinking, prefixes=None, constraint=None):
+        import torch
+
+        if len(prompts) == 1:
+            model_inputs = self._single_inputs(prompts[0], prefixes[0] if prefixes else None, enable_thinking)
+            with torch.no_grad():
+                generated_ids = self.model.generate(
+                    **model_inputs,
+                    max_new_tokens=max_new_tokens,
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    **self._constraint_kwargs(constraint, model_inputs["input_ids"].shape[1], enable_thinking),
+                    **sampling_kwargs(enable_thinking),
+                )
+            output_ids = generated_ids[0][model_inputs["input_ids"].shape[1]:].tolist()
+            return [self._decode(output_ids)]
+
+        chat_texts = [render_chat_prompt(self.tokenizer, prompt, enable_thinking) for prompt in prompts]
+        model_inputs = self.tokenizer(chat_texts, return_tensors="pt", padding=True).to(self.device)
+        with torch.no_grad():
+            generated_ids = self.model.generate(
+                **model_inputs,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **self._constraint_kwargs(constraint, model_inputs.input_ids.shape[1], enable_thinking),
+                **sampling_kwargs(enable_thinking),
+            )
+        prompt_length = model_inputs.input_ids.shape[1]
+        pad_id = self.tokenizer.pad_token_id
+        outputs = []
+        for row in generated_ids:
+            output_ids = row[prompt_length:].tolist()
+            # Rows that finished early are padded up to the longest row
+            while output_ids and output_ids[-1] == pad_id:
+                output_ids.pop()
+            outputs.append(self._decode(output_ids))
+        return outputs
+
+    def stream(self, prompt, max_new_tokens, enable_thinking, stop_event=None, prefix=None, constraint=None):
+        """
+        Yields decoded text chunks for one prompt as they are generated.
+        Setting stop_event (e.g. when the client disconnects) ends generation
+        at the next token.
+        """
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        class _StopOnEvent(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                stop = stop_event is not None and stop_event.is_set()
+                return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+        model_inputs = self._single_inputs(prompt, prefix, enable_thinking)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation = threading.Thread(target=self.model.generate, kwargs=dict(
+            **model_inputs,
+            max_new_tokens=max_new_tokens,
+            streamer=streamer,
+            stopping_criteria=StoppingCriteriaList([_StopOnEvent()]),
+            pad_token_id=self.tokenizer.pad_token_id,
+            **self._constraint_kwargs(constraint, model_inputs["input_ids"].shape[1], enable_thinking),
+            **sampling_kwargs(enable_thinking),
+        ), daemon=True)
+        generation.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        finally:
+            if stop_event is not None:
+                stop_event.set()
+            generation.join()
+
+
+class StubBackend:
+    """
+    CPU stand-in for the model: each generate() call costs a fixed overhead
+    plus a per-token cost that does not grow with batch size, roughly how a
+    memory-bound GPU decode behaves. The reply is configurable.
+    """
+
+    eos_token = "<|im_end|>"
+
+    def __init__(self, batch_overhead_s=0.05, per_token_s=0.002, output_tokens=32,
+                 reply="<think>\n\n</think>\n\n[\"Unknown\"]"):
+        self.batch_overhead_s = batch_overhead_s
+        self.per_token_s = per_token_s
+        self.output_tokens = output_tokens
+        self.reply = reply
+        self.batch_sizes = []
+
+    def count_tokens(self, text):
+        # ~4 characters per token is close enough for English prompts and HTML
+        return max(1, len(text) // 4)
+
+    def generate_batch(self, prompts, max_new_tokens, enable_thinking, prefixes=None, constraint=None):
+        self.batch_sizes.append(len(prompts))
+        time.sleep(self.batch_overhead_s + self.per_token_s * min(max_new_tokens, self.output_tokens))
+        return [self.reply for _ in prompts]
+
+    def stream(self, prompt, max_new_tokens, enable_thinking, stop_event=None, prefix=None, constraint=None):
+        time.sleep(self.batch_overhead_s)
+        for start in range(0, len(self.reply), 4):
+            if stop_event is not None and stop_event.is_set():
+                return
+            time.sleep(self.per_token_s)
+            yield self.reply[start:start + 4]
+
+
+class MicroBatcher:
+    """
+    Groups concurrent generation requests into batched backend calls.
+
+    Args:
+        backend: Object with generate_batch(prompts, max_new_tokens, enable_thinking, prefixes, constraint) -> list[str].
+        max_batch_size: Most prompts per generate() call.
+        max_wait_ms: How long the first queued request waits for company.
+    """
+
+    def __init__(self, backend, max_batch_size=8, max_wait_ms=10):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0, max_wait_ms) / 1000.0
+        self.queue = None
+        self.worker = None
+        self.batches_run = 0
+        self.requests_run = 0
+
+    def start(self):
+        """Starts the scheduler task; must be called from the running event loop."""
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.worker:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+            self.worker = None
+
+    async def submit(self, prompt, max_new_tokens=512, enable_thinking=True, prefix=None, constraint=None):
+        """Queues one prompt (optionally naming its fixed prefix) and returns its raw decoded output."""
+        if self.queue is None:
+            raise RuntimeError("MicroBatcher.start() has not been called")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put(GenerationRequest(prompt, max_new_tokens, enable_thinking, future, prefix, constraint))
+        return await future
+
+    async def _collect(self):
+        """Waits for one request, then gathers more until the batch is full or max_wait elapses."""
+        requests = [await self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(requests) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                requests.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return requests
+
+    async def _run(self):
+        while True:
+            requests = await self._collect()
+            groups = {}
+            for request in requests:
+                # Skip requests whose client already went away
+                if not request.future.done():
+                    groups.setdefault(request.batch_key, []).append(request)
+            for (enable_thinking, max_new_tokens, constraint), group in groups.items():
+                try:
+                    outputs = await asyncio.to_thread(
+                        self.backend.generate_batch, [request.prompt for request in group],
+                        max_new_tokens, enable_thinking, [request.prefix for request in group], constraint,
+                    )
+                except Exception as e:
+                    for request in group:
+                        if not request.future.done():
+                            request.future.set_exception(e)
+                    continue
+                self.batches_run += 1
+                self.requests_run += len(group)
+                for request, output in zip(group, outputs):
+                    if not request.future.done():
+                        request.future.set_result(output)
+
+    def stats(self):
+        return {
+            "batches": self.batches_run,
+            "requests": self.requests_run,
+            "avg_batch_size": round(self.requests_run / self.batches_run, 2) if self.batches_run else 0.0,
+            "queued": self.queue.qsize() if self.queue else 0,
+        }
@@ -0,0 +1,76 @@
+"""
+CPU benchmark for the micro-batching scheduler.
+
+Fires concurrent requests at MicroBatcher with batching off (max batch 1) and
+on, and prints throughput and latency for each. Uses StubBackend by default;
+pass --model with a small Hugging Face model (e.g. Qwen/Qwen3-0.6B) to measure
+real padded generation instead.
+
+    python benchmark_batching.py --requests 64 --concurrency 16
+    python benchmark_batching.py --model Qwen/Qwen3-0.6B --requests 16 --max-new-tokens 32
+"""
+import time
+import asyncio
+import argparse
+import statistics
+
+from batching import MicroBatcher, StubBackend, TransformersBackend
+
+
+def build_backend(args):
+    if not args.model:
+        return StubBackend(batch_overhead_s=args.stub_overhead_ms / 1000.0,
+                           per_token_s=args.stub_token_ms / 1000.0,
+                           output_tokens=args.max_new_tokens)
+    from transformers import AutoTokenizer, AutoModelForCausalLM
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    model = AutoModelForCausalLM.from_pretrained(args.model, trust_remote_code=True)
+    model.eval()
+    return TransformersBackend(tokenizer, model, "cpu")
+
+
+async def run_load(backend, max_batch_size, max_wait_ms, requests, concurrency, max_new_tokens):
+    batcher = MicroBatcher(backend, max_batch_size, max_wait_ms)
+    batcher.start()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(index):
+        async with semaphore:
+            started = time.monotonic()
+            await batcher.submit(f"Classify the dance styles in event #{index}: salsa and bachata social.",
+                                 max_new_tokens, enable_thinking=False)
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    elapsed = time.monotonic() - started
+    await batcher.stop()
+    return elapsed, latencies, batcher.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MicroBatcher throughput")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--max-new-tokens", type=int, default=32)
+    parser.add_argument("--model", help="Hugging Face model to run instead of the stub backend")
+    parser.add_argument("--stub-overhead-ms", type=float, default=50)
+    parser.add_argument("--stub-token-ms", type=float, default=2)
+    args = parser.parse_args()
+
+    backend = build_backend(args)
+    for label, batch_size in (("unbatched", 1), ("batched", args.max_batch_size)):
+        elapsed, latencies, stats = asyncio.run(run_load(
+            backend, batch_size, args.max_wait_ms, args.requests, args.concurrency, args.max_new_tokens))
+        latencies.sort()
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        print(f"{label:>9}: {args.requests / elapsed:7.1f} req/s, "
+              f"p50 {statistics.median(latencies) * 1000:7.1f} ms, p95 {p95 * 1000:7.1f} ms, "
+              f"avg batch {stats['avg_batch_size']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Check that distill_html keeps the event facts and drops the site chrome.
+
+Each fixture is an event page laid out the way real sites do it: the title
+and date in the article's <header>, venue and price in an <aside>, a ticket
+<form>/<button>, surrounded by a page-level header, nav and footer. The check
+fails if a fact is missing from the distilled text or if chrome text leaks in,
+and reports the token counts before and after.
+
+    python check_html_distill.py
+"""
+import sys
+
+from html_distill import distill_html
+
+SITE_CHROME = (
+    "<header><a href='/'>DanceCity</a><p>Sign in | Create account | Help Center 24/7</p></header>"
+    + "<nav>" + "".join(f"<a href='/c/{i}'>Category {i}</a>" for i in range(200)) + "</nav>"
+)
+SITE_FOOTER = "<footer><p>© 2025 DanceCity Inc. 100 Corporate Blvd, Austin TX 78701</p></footer>"
+
+FIXTURES = [
+    (
+        "article header and aside",
+        "<html><body>" + SITE_CHROME
+        + "<article><header><h1>Salsa Night</h1><p>Saturday June 1, 8pm</p></header>"
+          "<p>Join us for a fun evening of salsa with a live band.</p>"
+          "<aside><p>12 Main St, Boston MA 02110</p><p>Tickets $15</p></aside></article>"
+        + SITE_FOOTER + "</body></html>",
+        ["Salsa Night", "Saturday June 1, 8pm", "12 Main St, Boston MA 02110", "Tickets $15"],
+    ),
+    (
+        "ticket form in main",
+        "<html><body>" + SITE_CHROME
+        + "<main><section><header><h2>Bachata Sensual Weekender</h2><time>Fri, Jul 12 9:00 PM</time></header>"
+          "<p>Three nights of workshops and socials.</p>"
+          "<form action='/buy'><p>Full pass €89</p><select><option>1</option><option>2</option></select>"
+          "<button>Buy tickets</button></form>"
+          "<footer><p>Venue: La Sala, 45 Rue de Rivoli, 75001 Paris</p></footer></section></main>"
+        + SITE_FOOTER + "</body></html>",
+        ["Bachata Sensual Weekender", "Fri, Jul 12 9:00 PM", "Full pass €89", "Buy tickets", "45 Rue de Rivoli"],
+    ),
+    (
+        "page-level aside",
+        "<html><body>" + SITE_CHROME
+        + "<aside><p>Trending: 10 best brunch spots, sponsored $0 delivery</p></aside>"
+          "<div><h1>Tango Milonga</h1><p>Sunday Aug 4, 7:30pm at Studio 5, 200 Oak Ave</p></div>"
+        + SITE_FOOTER + "</body></html>",
+        ["Tango Milonga", "Sunday Aug 4, 7:30pm at Studio 5, 200 Oak Ave"],
+    ),
+]
+CHROME_TEXT = ["Sign in", "Category 7", "DanceCity Inc", "brunch spots"]
+
+
+def main():
+    failures = 0
+    for name, html, facts in FIXTURES:
+        result = distill_html(html)
+        missing = [fact for fact in facts if fact not in result.text]
+        leaked = [text for text in CHROME_TEXT if text in result.text]
+        status = "ok" if not missing and not leaked else "FAIL"
+        failures += status != "ok"
+        print(f"{status:4} {name}: {result.tokens_before} -> {result.tokens_after} tokens, "
+              f"{result.blocks_kept}/{result.blocks_total} blocks")
+        if missing:
+            print(f"     missing: {missing}")
+        if leaked:
+            print(f"     chrome kept: {leaked}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
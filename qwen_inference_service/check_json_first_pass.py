@@ -0,0 +1,78 @@
+"""
+First-pass parse rate of the schema-constrained endpoints.
+
+Runs the /style, /dedupe and /extract prompts through TransformersBackend
+with their JSONConstraint and token budget, once with thinking on (how the
+service used to call them) and once with thinking off (how it calls them
+now), and reports how often the first generation parses and validates
+without a retry.
+
+    python check_json_first_pass.py                      # Qwen/Qwen3-0.6B
+    python check_json_first_pass.py --model /path/to/small-model --runs 3 --extract-tokens 256
+"""
+import time
+import argparse
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from batching import TransformersBackend
+from main import (
+    STYLE_CONSTRAINT, STYLE_PROMPT_PREFIX, EXTRACT_CONSTRAINT, EXTRACT_PROMPT_PREFIX, DEDUPE_CONSTRAINT,
+    DEDUPE_PROMPT_PREFIX, build_style_prompt, parse_qwen_output,
+)
+
+# Qwen3-style ChatML for models without a chat template, so enable_thinking changes the prompt the same way
+FALLBACK_CHAT_TEMPLATE = (
+    "{% for message in messages %}<|im_start|>{{ message['role'] }}\n{{ message['content'] }}<|im_end|>\n{% endfor %}"
+    "{% if add_generation_prompt %}<|im_start|>assistant\n"
+    "{% if enable_thinking is defined and enable_thinking is false %}<think>\n\n</think>\n\n{% endif %}{% endif %}"
+)
+SAMPLE_TEXT = "Weekly salsa and bachata social with a beginner class at 8pm, live band from 10pm."
+SAMPLE_PAGE = ("Salsa Night at Club X\nSaturday June 1, 8pm - 2am\n12 Main St, Boston, MA 02110\n"
+               "Tickets $15 at the door, beginner lesson included.")
+EVENT_1 = "Salsa Night at Club X, Saturday June 1, 8pm, 12 Main St Boston"
+EVENT_2 = "Club X Salsa Social - Sat Jun 1 2025 20:00 - Boston"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="First-pass parse rate of constrained JSON endpoints")
+    parser.add_argument("--model", default="Qwen/Qwen3-0.6B")
+    parser.add_argument("--runs", type=int, default=10, help="Generations per endpoint and mode")
+    parser.add_argument("--extract-tokens", type=int, default=2048, help="/extract budget (the service uses 2048)")
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    if tokenizer.chat_template is None:
+        tokenizer.chat_template = FALLBACK_CHAT_TEMPLATE
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype="auto", trust_remote_code=True).to(device)
+    model.eval()
+    backend = TransformersBackend(tokenizer, model, device)
+
+    cases = [
+        ("style", STYLE_CONSTRAINT, STYLE_PROMPT_PREFIX, build_style_prompt(SAMPLE_TEXT), 150),
+        ("dedupe", DEDUPE_CONSTRAINT, DEDUPE_PROMPT_PREFIX,
+         f"{DEDUPE_PROMPT_PREFIX}Event 1: \"\"{EVENT_1}\"\"\nEvent 2: \"\"{EVENT_2}\"\"", 50),
+        ("extract", EXTRACT_CONSTRAINT, EXTRACT_PROMPT_PREFIX, EXTRACT_PROMPT_PREFIX + "Page text:\n" + SAMPLE_PAGE,
+         args.extract_tokens),
+    ]
+    for name, constraint, prefix, prompt, budget in cases:
+        for enable_thinking in (True, False):
+            parsed, example, started = 0, "", time.perf_counter()
+            for _ in range(args.runs):
+                raw = backend.generate_batch([prompt], budget, enable_thinking, [prefix], constraint)[0]
+                try:
+                    constraint.parse(parse_qwen_output(raw)["final"])
+                    parsed += 1
+                except ValueError:
+                    example = example or raw
+            seconds = (time.perf_counter() - started) / args.runs
+            print(f"{name:>8} thinking={'on ' if enable_thinking else 'off'} budget {budget:>4}: "
+                  f"{parsed}/{args.runs} parsed on first pass ({seconds:.2f}s per call)")
+            if example:
+                print(f"          failed output: {example[:160]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Correctness and speed check for the prompt-prefix KV cache on a small CPU model.
+
+For the /style and /extract prompt templates it runs greedy generation with
+the prefix cache and with a full uncached prefill of the same token ids,
+fails if the outputs differ, and reports the prefill time of each alongside
+the prefix share of the prompt.
+
+    python check_prefix_cache.py                      # Qwen/Qwen3-0.6B
+    python check_prefix_cache.py --model sshleifer/tiny-gpt2 --max-new-tokens 8
+"""
+import sys
+import time
+import argparse
+
+import torch
+from transformers import AutoTokenizer, AutoModelForCausalLM
+
+from prefix_cache import PrefixKVCache, split_chat_prompt
+from main import STYLE_PROMPT_PREFIX, EXTRACT_PROMPT_PREFIX, build_style_prompt
+
+SAMPLE_TEXT = "Weekly salsa and bachata social with a beginner class at 8pm, live band from 10pm."
+SAMPLE_PAGE = ("Salsa Night at Club X\nSaturday June 1, 8pm - 2am\n12 Main St, Boston, MA 02110\n"
+               "Tickets $15 at the door, beginner lesson included.")
+
+
+def greedy(model, tokenizer, inputs, max_new_tokens):
+    with torch.no_grad():
+        output = model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                pad_token_id=tokenizer.pad_token_id or tokenizer.eos_token_id)
+    return output[0][inputs["input_ids"].shape[1]:].tolist()
+
+
+def prefill_seconds(model, tokenizer, cache, prompt, prefix, use_cache, repeats):
+    timings = []
+    for _ in range(repeats):
+        inputs = cache.build_inputs(prompt, prefix, use_cache=use_cache)
+        started = time.perf_counter()
+        greedy(model, tokenizer, inputs, 1)  # One new token: prefill dominates
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prefix-cached and uncached generation")
+    parser.add_argument("--model", default="Qwen/Qwen3-0.6B")
+    parser.add_argument("--max-new-tokens", type=int, default=24)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model, trust_remote_code=True)
+    if tokenizer.chat_template is None:
+        # Base models without a chat template: the prompt is used as-is
+        tokenizer.chat_template = "{% for message in messages %}{{ message['content'] }}{% endfor %}"
+    model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32, trust_remote_code=True)
+    model.eval()
+    cache = PrefixKVCache(model, tokenizer, "cpu", version="check")
+
+    cases = [
+        ("style", STYLE_PROMPT_PREFIX, build_style_prompt(SAMPLE_TEXT)),
+        ("extract", EXTRACT_PROMPT_PREFIX, EXTRACT_PROMPT_PREFIX + "Page text:\n" + SAMPLE_PAGE),
+    ]
+    failures = 0
+    for name, prefix, prompt in cases:
+        uncached = greedy(model, tokenizer, cache.build_inputs(prompt, prefix, use_cache=False), args.max_new_tokens)
+        cached = greedy(model, tokenizer, cache.build_inputs(prompt, prefix, use_cache=True), args.max_new_tokens)
+        match = uncached == cached
+        failures += not match
+        total_tokens = cache.build_inputs(prompt, prefix, use_cache=False)["input_ids"].shape[1]
+        chat_prefix = split_chat_prompt(tokenizer, prompt, prefix)[0]
+        prefix_tokens = len(tokenizer(chat_prefix, add_special_tokens=False).input_ids)
+        full = prefill_seconds(model, tokenizer, cache, prompt, prefix, False, args.repeats)
+        reused = prefill_seconds(model, tokenizer, cache, prompt, prefix, True, args.repeats)
+        print(f"{name:>8}: outputs {'match' if match else 'DIFFER'}; prefix {prefix_tokens}/{total_tokens} tokens "
+              f"({100 * prefix_tokens / total_tokens:.0f}%); prefill {full * 1000:.1f} ms -> {reused * 1000:.1f} ms")
+        if not match:
+            print(f"          uncached: {tokenizer.decode(uncached)!r}\n          cached:   {tokenizer.decode(cached)!r}")
+    print(cache.stats())
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
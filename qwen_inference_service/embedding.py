@@ -0,0 +1,99 @@
+"""
+Sentence embeddings for the /embed endpoint.
+
+TransformersEmbedder runs a small sentence-embedding encoder (mean pooling
+over the last hidden state, L2-normalized, the sentence-transformers recipe
+for models such as all-MiniLM-L6-v2) in batches of batch_size texts.
+HashingEmbedder is the stub-backend stand-in: character trigrams hashed into
+a fixed number of buckets, so near-identical texts still get similar vectors
+and the dedupe service can be exercised without a model.
+
+Vectors are unit length, so the dot product of two embeddings is their
+cosine similarity.
+"""
+import math
+import hashlib
+import threading
+
+
+class TransformersEmbedder:
+    """
+    Args:
+        model_name: Hugging Face encoder, e.g. sentence-transformers/all-MiniLM-L6-v2.
+        device: "cuda" or "cpu".
+        batch_size: Texts per forward pass.
+        max_length: Tokens kept per text; event titles and snippets fit easily.
+    """
+
+    def __init__(self, model_name, device, batch_size=64, max_length=256):
+        from transformers import AutoTokenizer, AutoModel
+
+        self.model_name = model_name
+        self.device = device
+        self.batch_size = max(1, batch_size)
+        self.max_length = max_length
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).to(device)
+        self.model.eval()
+        self.dimensions = self.model.config.hidden_size
+        self.lock = threading.Lock()  # One encoder, one forward pass at a time
+        self.texts_embedded = 0
+        self.batches_run = 0
+
+    def embed(self, texts):
+        import torch
+
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            inputs = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_length,
+                                    return_tensors="pt").to(self.device)
+            with self.lock, torch.no_grad():
+                hidden = self.model(**inputs).last_hidden_state
+            mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+            vectors.extend(pooled.float().cpu().tolist())
+            self.batches_run += 1
+        self.texts_embedded += len(texts)
+        return vectors
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "dimensions": self.dimensions,
+            "texts": self.texts_embedded,
+            "batches": self.batches_run,
+        }
+
+
+class HashingEmbedder:
+    """Character-trigram hashing embedder used with the stub inference backend."""
+
+    def __init__(self, dimensions=256):
+        self.model_name = "hashing-trigram"
+        self.dimensions = dimensions
+        self.texts_embedded = 0
+        self.batches_run = 0
+
+    def _vector(self, text):
+        vector = [0.0] * self.dimensions
+        text = f"  {' '.join(str(text).lower().split())} "
+        for start in range(len(text) - 2):
+            digest = hashlib.md5(text[start:start + 3].encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed(self, texts):
+        self.texts_embedded += len(texts)
+        self.batches_run += 1
+        return [self._vector(text) for text in texts]
+
+    def stats(self):
+        return {
+            "model": self.model_name,
+            "dimensions": self.dimensions,
+            "texts": self.texts_embedded,
+            "batches": self.batches_run,
+        }
@@ -0,0 +1,362 @@
+"""
+HTML distillation for /extract.
+
+Raw pages are mostly scripts, styles, navigation and footers, and prompt
+length dominates generation latency and memory. distill_html() reduces a page
+to what the extractor needs:
+
+1. Structured hints: JSON-LD Event objects, schema.org microdata (itemprop)
+   and OpenGraph/meta tags, mapped onto the /extract schema.
+2. Text blocks from the visible content (script/style/nav/... removed, and
+   page-level header/footer/aside), keeping headings and blocks near date,
+   time, price or address patterns.
+3. A token budget on the distilled text.
+
+When the structured hints already fill every required field the caller can
+skip the LLM altogether. Only the standard library is used, so the service
+image gains no parser dependency.
+"""
+import re
+import json
+from html.parser import HTMLParser
+from dataclasses import dataclass, field
+
+CHARS_PER_TOKEN = 4  # Same estimate the admission controller uses
+DEFAULT_TOKEN_BUDGET = 3000
+
+EXTRACT_FIELDS = (
+    "event_name", "date_start", "time_start", "venue_name", "address", "description",
+    "organizer_name", "event_url", "ticket_url", "raw_price_info",
+)
+# Structured data answering all of these makes the LLM call unnecessary
+REQUIRED_FIELDS = ("event_name", "date_start", "time_start", "venue_name", "address")
+
+SKIP_TAGS = {"script", "style", "noscript", "nav", "svg", "iframe", "template", "select"}
+# Site chrome at page level, but event pages put the title, date, venue and price in
+# the header/aside of their <article>, so these are only skipped outside CONTENT_TAGS
+PAGE_CHROME_TAGS = {"header", "footer", "aside"}
+CONTENT_TAGS = {"article", "main", "section"}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+BLOCK_TAGS = {"p", "div", "li", "td", "th", "tr", "section", "article", "main", "dd", "dt", "address",
+              "time", "h1", "h2", "h3", "h4", "h5", "h6", "br", "table", "ul", "ol", "blockquote",
+              "header", "footer", "aside", "form", "button"}
+HEADING_TAGS = {"h1", "h2", "h3"}
+
+_MONTHS = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+_WEEKDAYS = r"(?:mon|tue|tues|wed|thu|thur|thurs|fri|sat|sun)[a-z]*\.?"
+DATE_RE = re.compile(
+    rf"\b(?:\d{{4}}-\d{{2}}-\d{{2}}|\d{{1,2}}[/.]\d{{1,2}}[/.]\d{{2,4}}|{_MONTHS}\s+\d{{1,2}}|\d{{1,2}}\s+{_MONTHS}|{_WEEKDAYS}\b)",
+    re.IGNORECASE,
+)
+TIME_RE = re.compile(r"\b\d{1,2}(?::\d{2})?\s*(?:am|pm|a\.m\.|p\.m\.)|\b\d{1,2}:\d{2}\b|\b\d{1,2}h\d{2}\b", re.IGNORECASE)
+ADDRESS_RE = re.compile(
+    r"\b\d{1,5}\s+[\w .'-]{2,40}\b(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|way|place|pl|square|sq|calle|rue|strasse|straße)\b"
+    r"|\b\d{5}(?:-\d{4})?\b|\b[A-Z]{1,2}\d[A-Z\d]?\s*\d[A-Z]{2}\b",
+    re.IGNORECASE,
+)
+PRICE_RE = re.compile(r"[$€£]\s?\d|\b\d+(?:[.,]\d{2})?\s?(?:usd|eur|gbp)\b|\bfree\b|\btickets?\b", re.IGNORECASE)
+
+
+@dataclass
+class DistillResult:
+    text: str
+    hints: dict
+    complete: bool
+    tokens_before: int
+    tokens_after: int
+    blocks_kept: int = 0
+    blocks_total: int = 0
+    sources: list = field(default_factory=list)
+
+    def report(self):
+        return {
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "blocks_kept": self.blocks_kept,
+            "blocks_total": self.blocks_total,
+            "structured_sources": self.sources,
+            "structured_fields": sorted(self.hints),
+            "llm_skipped": self.complete,
+        }
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1 if text else 0
+
+
+class _DistillParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip_depth = 0
+        self.skip_stack = []
+        self.content_depth = 0
+        self.in_jsonld = False
+        self.jsonld_chunks = []
+        self.jsonld_blocks = []
+        self.meta = {}
+        self.itemprop_stack = []
+        self.microdata = {}
+        self.blocks = []  # (text, is_heading)
+        self.current = []
+        self.heading_depth = 0
+
+    def _flush(self):
+        text = " ".join(" ".join(self.current).split())
+        if text:
+            self.blocks.append((text, self.heading_depth > 0))
+        self.current = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "meta":
+            key = (attrs.get("property") or attrs.get("name") or attrs.get("itemprop") or "").lower()
+            if key and attrs.get("content"):
+                self.meta.setdefault(key, attrs["content"].strip())
+            return
+        if tag == "script" and (attrs.get("type") or "").lower() == "application/ld+json":
+            self.in_jsonld = True
+            self.jsonld_chunks = []
+            return
+        if tag in SKIP_TAGS or (tag in PAGE_CHROME_TAGS and (self.skip_depth or not self.content_depth)):
+            if tag not in VOID_TAGS:
+                self.skip_depth += 1
+                self.skip_stack.append(tag)
+            return
+        if self.skip_depth:
+            return
+        if tag in CONTENT_TAGS:
+            self.content_depth += 1
+        if tag in BLOCK_TAGS:
+            self._flush()
+        if tag in HEADING_TAGS:
+            self.heading_depth += 1
+        itemprop = attrs.get("itemprop")
+        if itemprop:
+            # Attribute values (content/datetime/href) win over element text
+            value = attrs.get("content") or attrs.get("datetime") or (attrs.get("href") if tag == "a" else None)
+            if value:
+                self.microdata.setdefault(itemprop.lower(), value.strip())
+            elif tag not in VOID_TAGS:
+                self.itemprop_stack.append([tag, itemprop.lower(), []])
+
+    def handle_endtag(self, tag):
+        if tag == "script" and self.in_jsonld:
+            self.in_jsonld = False
+            self.jsonld_blocks.append("".join(self.jsonld_chunks))
+            return
+        if self.skip_stack and tag == self.skip_stack[-1]:
+            self.skip_stack.pop()
+            self.skip_depth -= 1
+            return
+        if self.skip_depth:
+            return
+        if self.itemprop_stack and self.itemprop_stack[-1][0] == tag:
+            _, name, parts = self.itemprop_stack.pop()
+            text = " ".join(" ".join(parts).split())
+            if text:
+                self.microdata.setdefault(name, text)
+        if tag in CONTENT_TAGS and self.content_depth:
+            self.content_depth -= 1
+        if tag in HEADING_TAGS and self.heading_depth:
+            self._flush()
+            self.heading_depth -= 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if self.in_jsonld:
+            self.jsonld_chunks.append(data)
+            return
+        if self.skip_depth:
+            return
+        self.current.append(data)
+        for entry in self.itemprop_stack:
+            entry[2].append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def _iter_jsonld_objects(raw_blocks):
+    for raw in raw_blocks:
+        try:
+            data = json.loads(raw.strip())
+        except (json.JSONDecodeError, ValueError):
+            continue
+        stack = [data]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, list):
+                stack.extend(item)
+            elif isinstance(item, dict):
+                yield item
+                if isinstance(item.get("@graph"), list):
+                    stack.extend(item["@graph"])
+
+
+def _is_event(item):
+    types = item.get("@type")
+    types = types if isinstance(types, list) else [types]
+    return any(isinstance(t, str) and t.endswith("Event") for t in types)
+
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+
+def _format_address(address):
+    if isinstance(address, str):
+        return address.strip() or None
+    if isinstance(address, dict):
+        parts = [address.get(key) for key in ("streetAddress", "addressLocality", "addressRegion",
+                                                "postalCode", "addressCountry")]
+        parts = [part.get("name") if isinstance(part, dict) else part for part in parts]
+        return ", ".join(str(part).strip() for part in parts if part) or None
+    return None
+
+
+def _split_datetime(value):
+    """'2025-06-01T20:00:00-04:00' -> ('2025-06-01', '20:00')."""
+    if not isinstance(value, str):
+        return None, None
+    match = re.match(r"(\d{4}-\d{2}-\d{2})(?:[T ](\d{2}:\d{2}))?", value.strip())
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def _hints_from_jsonld(event):
+    hints = {}
+    hints["event_name"] = event.get("name")
+    hints["date_start"], hints["time_start"] = _split_datetime(event.get("startDate"))
+    location = _first(event.get("location"))
+    if isinstance(location, dict):
+        hints["venue_name"] = location.get("name")
+        hints["address"] = _format_address(location.get("address"))
+    elif isinstance(location, str):
+        hints["venue_name"] = location
+    hints["description"] = event.get("description")
+    organizer = _first(event.get("organizer"))
+    hints["organizer_name"] = organizer.get("name") if isinstance(organizer, dict) else organizer
+    hints["event_url"] = event.get("url")
+    offers = _first(event.get("offers"))
+    if isinstance(offers, dict):
+        hints["ticket_url"] = offers.get("url")
+        price = offers.get("price", offers.get("lowPrice"))
+        if price is not None:
+            hints["raw_price_info"] = f"{price} {offers.get('priceCurrency', '')}".strip()
+    return hints
+
+
+def _hints_from_microdata(microdata):
+    date_start, time_start = _split_datetime(microdata.get("startdate"))
+    price = microdata.get("price")
+    return {
+        "event_name": microdata.get("name"),
+        "date_start": date_start,
+        "time_start": time_start,
+        "address": ", ".join(microdata[key] for key in ("streetaddress", "addresslocality", "postalcode")
+                             if microdata.get(key)) or None,
+        "description": microdata.get("description"),
+        "event_url": microdata.get("url"),
+        "raw_price_info": f"{price} {microdata.get('pricecurrency', '')}".strip() if price else None,
+    }
+
+
+def _hints_from_meta(meta):
+    date_start, time_start = _split_datetime(meta.get("event:start_time") or meta.get("og:start_time"))
+    return {
+        "event_name": meta.get("og:title"),
+        "date_start": date_start,
+        "time_start": time_start,
+        "description": meta.get("og:description") or meta.get("description"),
+        "event_url": meta.get("og:url"),
+    }
+
+
+def _merge(target, hints):
+    for key, value in hints.items():
+        if isinstance(value, str):
+            value = " ".join(value.split())
+        if key in EXTRACT_FIELDS and value and not target.get(key):
+            target[key] = value
+
+
+def structured_hints(parser):
+    """Merged hints in decreasing order of trust: JSON-LD, microdata, OpenGraph/meta."""
+    hints, sources = {}, []
+    for item in _iter_jsonld_objects(parser.jsonld_blocks):
+        if _is_event(item):
+            _merge(hints, _hints_from_jsonld(item))
+            sources.append("json-ld")
+            break
+    if parser.microdata:
+        before = len(hints)
+        _merge(hints, _hints_from_microdata(parser.microdata))
+        if len(hints) > before:
+            sources.append("microdata")
+    if parser.meta:
+        before = len(hints)
+        _merge(hints, _hints_from_meta(parser.meta))
+        if len(hints) > before:
+            sources.append("meta")
+    return hints, sources
+
+
+def _select_blocks(blocks, token_budget):
+    """Headings plus blocks matching date/time/address/price patterns and their neighbours, in page order."""
+    relevant = set()
+    for index, (text, is_heading) in enumerate(blocks):
+        if is_heading:
+            relevant.add(index)
+        if DATE_RE.search(text) or TIME_RE.search(text) or ADDRESS_RE.search(text) or PRICE_RE.search(text):
+            relevant.update((index - 1, index, index + 1))
+    selected = [index for index in range(len(blocks)) if index in relevant]
+    if not selected:
+        selected = list(range(len(blocks)))
+    kept, used, seen = [], 0, set()
+    for index in selected:
+        text = blocks[index][0]
+        if text in seen:
+            continue
+        cost = estimate_tokens(text)
+        if used + cost > token_budget:
+            remaining_chars = (token_budget - used) * CHARS_PER_TOKEN
+            if remaining_chars > 80:
+                kept.append(text[:remaining_chars])
+            break
+        seen.add(text)
+        kept.append(text)
+        used += cost
+    return kept
+
+
+def distill_html(html, token_budget=DEFAULT_TOKEN_BUDGET):
+    """Distills raw HTML into structured hints plus a budgeted text excerpt."""
+    parser = _DistillParser()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:  # html.parser is lenient, but never let a bad page fail the request
+        print(f"[DISTILL] HTML parse error, using partial result: {e}")
+    hints, sources = structured_hints(parser)
+    complete = all(hints.get(name) for name in REQUIRED_FIELDS)
+    hint_tokens = estimate_tokens(json.dumps(hints)) if hints else 0
+    kept = [] if complete else _select_blocks(parser.blocks, max(0, token_budget - hint_tokens))
+    text = "\n".join(kept)
+    return DistillResult(
+        text=text,
+        hints=hints,
+        complete=complete,
+        tokens_before=estimate_tokens(html),
+        tokens_after=estimate_tokens(text) + hint_tokens,
+        blocks_kept=len(kept),
+        blocks_total=len(parser.blocks),
+        sources=sources,
+    )
+
+
+def complete_from_hints(hints):
+    """A full /extract result from structured hints, with null for missing fields."""
+    return {name: hints.get(name) for name in EXTRACT_FIELDS}
@@ -0,0 +1,375 @@
+"""
+Schema-constrained JSON decoding.
+
+JSONConstraint wraps a small JSON-schema subset (object with known
+properties/required keys, array items, string enums, string, number,
+boolean, null and unions of those) and provides:
+
+- JSONSchemaLogitsProcessor: at every step only tokens that keep the output
+  a valid prefix of a schema-conforming document stay possible, and EOS is
+  forced as soon as the document closes, so generation stops early.
+  Candidates are checked in logit order (a bounded top slice first, the rest
+  of the vocabulary only if none of those fit), which keeps the per-step
+  cost small. When thinking is allowed, a leading Qwen3 <think>...</think>
+  block is left unconstrained; the service renders constrained prompts with
+  thinking off, so the schema applies from the first token.
+- parse(): strict parse plus schema validation of the final text, used for
+  the validated retry in main.py.
+
+The prefix check is a character-level pushdown automaton whose states are
+immutable tuples, so trying a candidate token costs only its length.
+"""
+import json
+
+WHITESPACE = " \t\n\r"
+MAX_WHITESPACE_RUN = 8  # Stop the model from padding JSON with endless whitespace
+NUMBER_CHARS = "0123456789+-.eE"
+LITERALS = {"t": "true", "f": "false", "n": "null"}
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _types(schema):
+    """Set of JSON types a schema accepts ('enum' counts as string)."""
+    if "enum" in schema:
+        types = {"string"}
+        if None in schema["enum"]:
+            types.add("null")
+        return types
+    declared = schema.get("type")
+    if declared is None:
+        return {"object", "array", "string", "number", "boolean", "null"}
+    return set(declared) if isinstance(declared, list) else {declared}
+
+
+class JSONSchemaMachine:
+    """
+    Character-level prefix validator. A state is (stack, whitespace_run);
+    stack is a tuple of frames, innermost last:
+
+        ("value", schema)                       expecting a value
+        ("string", options, text, escape, role) inside a string; role "value" or "key"
+        ("literal", word, index)                inside true/false/null
+        ("number", text)                        inside a number
+        ("object", schema, seen, expect, key)   expect in key_or_end/key/colon/comma_or_end
+        ("array", schema, expect)               expect in item_or_end/item/comma_or_end
+
+    An empty stack means the document is complete.
+    """
+
+    def __init__(self, schema):
+        self.schema = schema
+
+    def initial(self):
+        return ((("value", self.schema),), 0)
+
+    @staticmethod
+    def is_complete(state):
+        return state is not None and not state[0]
+
+    def feed(self, state, text):
+        for char in text:
+            state = self.step(state, char)
+            if state is None:
+                return None
+        return state
+
+    def step(self, state, char):
+        stack, ws_run = state
+        if char in WHITESPACE:
+            if not stack or stack[-1][0] in ("value", "object", "array"):
+                return (stack, ws_run + 1) if ws_run < MAX_WHITESPACE_RUN else None
+            if stack[-1][0] == "number":
+                return self._end_value(stack[:-1], char, ws_run)
+        new_stack = self._step(stack, char)
+        return None if new_stack is None else (new_stack, 0)
+
+    def _end_value(self, stack, char, ws_run):
+        # A number ends at the first character that cannot continue it; that character is then
+        # consumed by the enclosing container
+        stack = self._value_done(stack)
+        if stack is None:
+            return None
+        if char in WHITESPACE:
+            return (stack, ws_run + 1)
+        new_stack = self._step(stack, char)
+        return None if new_stack is None else (new_stack, 0)
+
+    @staticmethod
+    def _value_done(stack):
+        """Marks the value on top of the remaining stack as finished."""
+        if not stack:
+            return stack
+        frame = stack[-1]
+        if frame[0] == "object":
+            _, schema, seen, _, _ = frame
+            return stack[:-1] + (("object", schema, seen, "comma_or_end", None),)
+        if frame[0] == "array":
+            return stack[:-1] + (("array", frame[1], "comma_or_end"),)
+        return None
+
+    def _step(self, stack, char):
+        if not stack:
+            return None  # Nothing but whitespace may follow a complete document
+        frame = stack[-1]
+        kind = frame[0]
+        rest = stack[:-1]
+
+        if kind == "value":
+            schema = frame[1]
+            types = _types(schema)
+            if char == '"' and "string" in types:
+                options = tuple(v for v in schema["enum"] if isinstance(v, str)) if "enum" in schema else None
+                return rest + (("string", options, "", False, "value"),)
+            if char == "{" and "object" in types:
+                return rest + (("object", schema, frozenset(), "key_or_end", None),)
+            if char == "[" and "array" in types:
+                return rest + (("array", schema, "item_or_end"),)
+            if char in LITERALS:
+                word = LITERALS[char]
+                if (word == "null" and "null" in types) or (word != "null" and "boolean" in types):
+                    return rest + (("literal", word, 1),)
+                return None
+            if (char == "-" or char.isdigit()) and ({"number", "integer"} & types):
+                return rest + (("number", char),)
+            return None
+
+        if kind == "string":
+            _, options, text, escape, role = frame
+            if escape:
+                if options is not None:
+                    return None
+                return rest + (("string", options, text + char, False, role),)
+            if char == "\\":
+                return None if options is not None else rest + (("string", options, text, True, role),)
+            if char == '"':
+                if options is not None and text not in options:
+                    return None
+                if role == "key":
+                    _, schema, seen, _, _ = rest[-1]
+                    return rest[:-1] + (("object", schema, seen, "colon", text),)
+                return self._value_done(rest) if rest else ()
+            if ord(char) < 0x20:
+                return None  # Raw control characters are not valid JSON
+            text += char
+            if options is not None and not any(option.startswith(text) for option in options):
+                return None
+            return rest + (("string", options, text, False, role),)
+
+        if kind == "literal":
+            _, word, index = frame
+            if word[index] != char:
+                return None
+            if index + 1 == len(word):
+                return self._value_done(rest) if rest else ()
+            return rest + (("literal", word, index + 1),)
+
+        if kind == "number":
+            if char in NUMBER_CHARS:
+                return rest + (("number", frame[1] + char),)
+            state = self._end_value(rest, char, 0)
+            return None if state is None else state[0]
+
+        if kind == "object":
+            _, schema, seen, expect, key = frame
+            properties = schema.get("properties", {})
+            if expect in ("key_or_end", "comma_or_end") and char == "}":
+                if not set(schema.get("required", ())) <= seen:
+                    return None
+                return self._value_done(rest) if rest else ()
+            if expect in ("key_or_end", "key") and char == '"':
+                remaining = tuple(name for name in properties if name not in seen)
+                if not remaining:
+                    return None
+                return stack + (("string", remaining, "", False, "key"),)
+            if expect == "colon" and char == ":":
+                return rest + (("object", schema, seen | {key}, "comma_or_end", None), ("value", properties[key]))
+            if expect == "comma_or_end" and char == ",":
+                if len(seen) == len(properties):
+                    return None
+                return rest + (("object", schema, seen, "key", None),)
+            return None
+
+        if kind == "array":
+            _, schema, expect = frame
+            if expect in ("item_or_end", "comma_or_end") and char == "]":
+                return self._value_done(rest) if rest else ()
+            if expect == "comma_or_end" and char == ",":
+                return rest + (("array", schema, "item"),)
+            if expect in ("item_or_end", "item"):
+                item_stack = rest + (("array", schema, "comma_or_end"), ("value", schema.get("items", {})))
+                return self._step(item_stack, char)
+            return None
+
+        return None
+
+
+class JSONConstraint:
+    """A target schema shared by the logits processor and the post-generation validator."""
+
+    def __init__(self, name, schema):
+        self.name = name
+        self.schema = schema
+        self.machine = JSONSchemaMachine(schema)
+
+    def __repr__(self):
+        return f"JSONConstraint({self.name!r})"
+
+    def validate(self, value, schema=None):
+        """Raises ValueError when value does not match the schema."""
+        schema = self.schema if schema is None else schema
+        if "enum" in schema:
+            if value not in schema["enum"]:
+                raise ValueError(f"{value!r} is not one of {schema['enum']}")
+            return
+        types = _types(schema)
+        checks = {
+            "null": value is None,
+            "boolean": isinstance(value, bool),
+            "string": isinstance(value, str),
+            "number": isinstance(value, (int, float)) and not isinstance(value, bool),
+            "integer": isinstance(value, int) and not isinstance(value, bool),
+            "object": isinstance(value, dict),
+            "array": isinstance(value, list),
+        }
+        if not any(checks.get(t) for t in types):
+            raise ValueError(f"{value!r} is not of type {sorted(types)}")
+        if isinstance(value, dict):
+            properties = schema.get("properties", {})
+            missing = set(schema.get("required", ())) - set(value)
+            if missing:
+                raise ValueError(f"missing required fields {sorted(missing)}")
+            for key, item in value.items():
+                if properties and key not in properties:
+                    raise ValueError(f"unexpected field {key!r}")
+                if key in properties:
+                    self.validate(item, properties[key])
+        elif isinstance(value, list) and "items" in schema:
+            for item in value:
+                self.validate(item, schema["items"])
+
+    def parse(self, text):
+        """Parses and validates model output (think block and code fences tolerated)."""
+        if THINK_CLOSE in text:
+            text = text.split(THINK_CLOSE, 1)[1]
+        text = text.strip()
+        if text.startswith("```"):
+            text = text.strip("`")
+            text = text[4:] if text.startswith("json") else text
+        value = json.loads(text)
+        self.validate(value)
+        return value
+
+    def logits_processor(self, tokenizer, prompt_length, allow_think=True):
+        return JSONSchemaLogitsProcessor(self, tokenizer, prompt_length, allow_think=allow_think)
+
+
+_token_text_cache = {}
+
+
+def token_texts(tokenizer):
+    """Decoded text of every vocabulary id, computed once per tokenizer."""
+    key = id(tokenizer)
+    if key not in _token_text_cache:
+        special = set(tokenizer.all_special_ids)
+        size = len(tokenizer)
+        _token_text_cache[key] = [
+            "" if token_id in special else tokenizer.decode([token_id], skip_special_tokens=False)
+            for token_id in range(size)
+        ]
+    return _token_text_cache[key]
+
+
+class JSONSchemaLogitsProcessor:
+    """
+    transformers-compatible logits processor (callable on input_ids, scores)
+    enforcing a JSONConstraint on every row of a batch.
+
+    Args:
+        constraint: Target schema.
+        tokenizer: Model tokenizer (used for token texts and EOS).
+        prompt_length: Length of the (padded) prompt; later ids are generated.
+        top_candidates: Candidates checked per step before widening the search.
+        allow_think: Let the output open with a free-form <think> block; off for
+            prompts rendered with enable_thinking=False.
+    """
+
+    def __init__(self, constraint, tokenizer, prompt_length, top_candidates=64, allow_think=True):
+        self.constraint = constraint
+        self.machine = constraint.machine
+        self.texts = token_texts(tokenizer)
+        self.eos_ids = {tokenizer.eos_token_id, tokenizer.pad_token_id} - {None}
+        self.allow_think = allow_think
+        self.think_open_id = tokenizer.convert_tokens_to_ids(THINK_OPEN) if THINK_OPEN in tokenizer.get_vocab() else None
+        self.prompt_length = prompt_length
+        self.top_candidates = top_candidates
+        self.rows = {}  # row -> [phase, state, consumed, think_text]
+
+    def _advance(self, row, generated_ids):
+        entry = self.rows.setdefault(row, ["start" if self.allow_think else "json", self.machine.initial(), 0, ""])
+        phase, state, consumed, think_text = entry
+        for token_id in generated_ids[consumed:]:
+            text = self.texts[token_id] if token_id < len(self.texts) else ""
+            if phase == "done":
+                break
+            if phase == "start":
+                if token_id == self.think_open_id or text.strip() == THINK_OPEN:
+                    phase = "think"
+                    continue
+                phase = "json"
+            if phase == "think":
+                think_text += text
+                if THINK_CLOSE in think_text:
+                    phase = "json"
+                    state = self.machine.feed(self.machine.initial(), think_text.split(THINK_CLOSE, 1)[1].lstrip())
+                    think_text = ""
+                continue
+            if token_id in self.eos_ids:
+                phase = "done"
+                continue
+            state = self.machine.feed(state, text) if state is not None else None
+        entry[:] = [phase, state, len(generated_ids), think_text]
+        return entry
+
+    def _allowed(self, state, order):
+        if self.machine.is_complete(state):
+            return list(self.eos_ids)
+        allowed = []
+        for start in range(0, len(order), self.top_candidates):
+            for token_id in order[start:start + self.top_candidates]:
+                text = self.texts[token_id] if token_id < len(self.texts) else ""
+                if text and self.machine.feed(state, text) is not None:
+                    allowed.append(token_id)
+            if allowed:
+                break
+        return allowed
+
+    def __call__(self, input_ids, scores):
+        import torch
+
+        for row in range(input_ids.shape[0]):
+            generated = input_ids[row, self.prompt_length:].tolist()
+            phase, state, _, _ = self._advance(row, generated)
+            if phase in ("think", "done") or state is None:
+                continue  # Reasoning is free-form; a row that already finished is left alone
+            row_scores = scores[row]
+            order = torch.argsort(row_scores, descending=True).tolist()
+            allowed = self._allowed(state, order)
+            if phase == "start" and self.think_open_id is not None:
+                allowed.append(self.think_open_id)
+            if not allowed:
+                continue
+            mask = torch.full_like(row_scores, float("-inf"))
+            mask[allowed] = 0
+            scores[row] = row_scores + mask
+        return scores
+
+
+# --- Schemas used by the service ---
+
+def nullable_string():
+    return {"type": ["string", "null"]}
+
+
+def object_schema(fields, required=True):
+    return {"type": "object", "properties": fields, "required": list(fields) if required else []}
@@ -7,17 +7,47 @@ import asyncio
 import time
 import os
 import json # For robust JSON parsing
+from result_cache import ResultCache, cache_key
+from batching import MicroBatcher, StubBackend, TransformersBackend
+from prefix_cache import PrefixKVCache
+from json_constraint import JSONConstraint, nullable_string, object_schema
+from admission import AdmissionController, AdmissionRejected, PRIORITY_HIGH, PRIORITY_LOW, estimate_cost
+from html_distill import distill_html, complete_from_hints
+from streaming import IncrementalJSONFields, StreamingStats, ThinkStripper, iterate_in_thread
+from embedding import HashingEmbedder, TransformersEmbedder
 
 # --- Configuration --- 
 MODEL_NAME = os.getenv("MODEL_NAME", "glide-the/Qwen3-32B-GPTQ-4bits")
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-LLM_PRECISION = os.getenv("LLM_PRECISION", "4bit") # For future quant-swap
+LLM_PRECISION = os.getenv("LLM_PRECISION", "4bit") # "4bit" loads GPTQ; anything else loads unquantized (e.g. a tiny model for CPU)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "transformers") # "stub" skips the model to exercise batching on CPU
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 10))
+ADMISSION_TOKEN_BUDGET = int(os.getenv("ADMISSION_TOKEN_BUDGET", 32768)) # Estimated prompt + output tokens in flight
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", 60))
+PREFIX_CACHE_ENABLED = os.getenv("PREFIX_CACHE_ENABLED", "1") == "1" # Reuse prefilled KV cache of fixed prompt prefixes
+JSON_CONSTRAINED_DECODING = os.getenv("JSON_CONSTRAINED_DECODING", "1") == "1" # Schema-guided decoding for JSON outputs
+JSON_MAX_RETRIES = int(os.getenv("JSON_MAX_RETRIES", 1)) # Extra generations when the output still fails validation
+EXTRACT_TOKEN_BUDGET = int(os.getenv("EXTRACT_TOKEN_BUDGET", 3000)) # Distilled page text allowed into an /extract prompt
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "sentence-transformers/all-MiniLM-L6-v2") # Small encoder for /embed
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64)) # Texts per encoder forward pass
+EMBED_MAX_TEXTS = int(os.getenv("EMBED_MAX_TEXTS", 512)) # Texts accepted per /embed request
 MAX_REQUEST_BODY_SIZE = int(os.getenv("MAX_REQUEST_BODY_SIZE", 2 * 1024 * 1024)) # 2MB
 EXPECTED_BEARER_TOKEN = os.getenv("API_BEARER_TOKEN", "your-secret-token") # Simple bearer token
+PROMPT_VERSION = os.getenv("PROMPT_VERSION", "v1") # Bump when a prompt changes; part of every result cache key
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 5000))
+RESULT_CACHE_DATABASE_URL = os.getenv("DATABASE_URL") # Optional: share cached results across workers/instances
 
 # --- Global Model and Tokenizer --- 
 tokenizer = None
 model = None
+batcher = None
+embedder = None
+streaming_stats = StreamingStats()
+admission = AdmissionController(ADMISSION_TOKEN_BUDGET, ADMISSION_MAX_QUEUE, ADMISSION_QUEUE_TIMEOUT_S)
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DATABASE_URL)
+STYLE_PARSE_ERRORS = (["parsing_error_not_a_list"], ["parsing_error_not_a_json_list"], ["json_decode_error"])
 
 app = FastAPI(title="Qwen3 Inference Service")
 
@@ -29,7 +59,21 @@ async def verify_token(x_token: str = Header(None)):
 
 @app.on_event("startup")
 async def load_model_on_startup():
-    global tokenizer, model
+    global tokenizer, model, batcher, embedder
+    if INFERENCE_BACKEND == "stub":
+        print("Using stub inference backend; responses are canned and no model is loaded.")
+        batcher = MicroBatcher(StubBackend(), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+        batcher.start()
+        embedder = HashingEmbedder()
+        return
+
+    try:
+        print(f"Loading embedding model: {EMBEDDING_MODEL_NAME}")
+        embedder = TransformersEmbedder(EMBEDDING_MODEL_NAME, DEVICE, EMBED_BATCH_SIZE)
+    except Exception as e:
+        # /embed answers 503 without it; generation endpoints are unaffected
+        print(f"Error loading embedding model: {e}")
+
     if DEVICE == "cpu" and LLM_PRECISION != "cpu_debug": # Allow CPU for debug without full model
         print("WARNING: CUDA not available. Model loading will be slow and likely unusable for production.")
         # Optionally, prevent startup if CUDA is essential
@@ -40,25 +84,32 @@ async def load_model_on_startup():
         tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, trust_remote_code=True)
         print(f"Loading model: {MODEL_NAME} to device: {DEVICE} with precision: {LLM_PRECISION}")
         
-        # Explicit GPTQConfig as per checklist
-        # Note: group_size and desc_act might need to match how the model was quantized.
-        # desc_act=True is common, group_size=128 is also common.
-        # If the model's own quantization_config.json is sufficient, this explicit config might not be needed
-        # or could even conflict if not matched properly. Test with and without if issues arise.
-        gptq_quant_config = GPTQConfig(
-            bits=4, 
-            group_size=128, 
-            desc_act=True, #  For some models this might be False
-            # tokenizer=tokenizer # Sometimes passed during quantization, not always for loading
-        )
+        if LLM_PRECISION == "4bit":
+            # Explicit GPTQConfig as per checklist
+            # Note: group_size and desc_act might need to match how the model was quantized.
+            # desc_act=True is common, group_size=128 is also common.
+            # If the model's own quantization_config.json is sufficient, this explicit config might not be needed
+            # or could even conflict if not matched properly. Test with and without if issues arise.
+            gptq_quant_config = GPTQConfig(
+                bits=4, 
+                group_size=128, 
+                desc_act=True, #  For some models this might be False
+                # tokenizer=tokenizer # Sometimes passed during quantization, not always for loading
+            )
 
-        model = AutoModelForCausalLM.from_pretrained(
-            MODEL_NAME,
-            device_map="auto", # Handles GPU mapping
-            torch_dtype=torch.float16, # GPTQ models often loaded in float16
-            trust_remote_code=True,
-            quantization_config=gptq_quant_config # Explicitly pass it as per checklist
-        )
+            model = AutoModelForCausalLM.from_pretrained(
+                MODEL_NAME,
+                device_map="auto", # Handles GPU mapping
+                torch_dtype=torch.float16, # GPTQ models often loaded in float16
+                trust_remote_code=True,
+                quantization_config=gptq_quant_config # Explicitly pass it as per checklist
+            )
+        else:
+            model = AutoModelForCausalLM.from_pretrained(
+                MODEL_NAME,
+                torch_dtype=torch.float16 if DEVICE == "cuda" else torch.float32,
+                trust_remote_code=True
+            ).to(DEVICE)
         model.eval() # Set to evaluation mode
         print("Model and tokenizer loaded successfully.")
 
@@ -72,6 +123,16 @@ async def load_model_on_startup():
         # Consider exiting if model load fails critically
         raise RuntimeError(f"Failed to load model: {e}")
 
+    prefix_cache = PrefixKVCache(model, tokenizer, DEVICE, PROMPT_VERSION) if PREFIX_CACHE_ENABLED else None
+    batcher = MicroBatcher(TransformersBackend(tokenizer, model, DEVICE, prefix_cache), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+    batcher.start()
+    print(f"Micro-batching enabled: up to {BATCH_MAX_SIZE} prompts per generate, {BATCH_MAX_WAIT_MS}ms max wait.")
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    if batcher:
+        await batcher.stop()
+
 # --- Pydantic Models for API --- 
 class StyleRequest(BaseModel):
     text: str
@@ -87,6 +148,7 @@ class ExtractRequest(BaseModel):
 class ExtractResponse(BaseModel):
     extracted_data: dict
     raw_llm_output: str # For debugging
+    distillation: dict | None = None # Token counts before/after HTML distillation
 
 class DedupeRequest(BaseModel):
     event_text_1: str
@@ -97,6 +159,14 @@ class DedupeResponse(BaseModel):
     confidence: float # Optional
     raw_llm_output: str # For debugging
 
+class EmbedRequest(BaseModel):
+    texts: list[str]
+
+class EmbedResponse(BaseModel):
+    model: str
+    dimensions: int
+    embeddings: list[list[float]] # Unit length; dot product = cosine similarity
+
 class HealthResponse(BaseModel):
     status: str
     model_name: str
@@ -104,6 +174,12 @@ class HealthResponse(BaseModel):
     vram_allocated_tensors_gb: float | None = None
     vram_used_by_pytorch_gb: float | None = None
     vram_total_gb: float | None = None
+    batching: dict | None = None
+    admission: dict | None = None
+    streaming: dict | None = None
+    prefix_cache: dict | None = None
+    result_cache: dict | None = None
+    embedding: dict | None = None
 
 # --- Helper for LLM Interaction --- 
 def parse_qwen_output(raw_response_text: str):
@@ -118,60 +194,61 @@ def parse_qwen_output(raw_response_text: str):
             thinking_content = parts[0].split("<think>", 1)[1].strip()
         final_content = parts[1].strip()
         # Remove potential leading/trailing special tokens if tokenizer doesn't handle them well
-        if final_content.startswith(tokenizer.eos_token):
-            final_content = final_content[len(tokenizer.eos_token):].strip()
+        eos_token = batcher.backend.eos_token if batcher else None
+        if eos_token and final_content.startswith(eos_token):
+            final_content = final_content[len(eos_token):].strip()
     return {"thinking": thinking_content, "final": final_content.strip()}
 
-async def generate_qwen_response_async(prompt_text: str, max_new_tokens: int = 512, enable_thinking: bool = True):
-    if not tokenizer or not model:
+async def generate_qwen_response_async(prompt_text: str, max_new_tokens: int = 512, enable_thinking: bool = True,
+                                       priority: int = PRIORITY_LOW, prefix: str | None = None,
+                                       constraint: JSONConstraint | None = None):
+    if not batcher:
         raise HTTPException(status_code=503, detail="Model not loaded or still initializing.")
 
     # Logging the first 50 chars of prompt (as per checklist)
     print(f"[PROMPT_LOG] {prompt_text[:50]}...") 
     start_time = time.time()
 
-    messages = [{"role": "user", "content": prompt_text}]
-    chat_ml_text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True,
-        # enable_thinking for apply_chat_template might be specific to some Qwen setups/versions.
-        # The primary control is usually just the prompt structure for instruct models.
-        # The model card for Qwen3 suggests `enable_thinking` is a parameter for `apply_chat_template`.
-        # Let's assume it's available, if not, it might be ignored or error.
-        # enable_thinking=enable_thinking # This argument might not be standard for all Qwen versions in `apply_chat_template`
-    )
-    
-    model_inputs = tokenizer([chat_ml_text], return_tensors="pt").to(DEVICE)
-
-    generation_kwargs = {
-        "max_new_tokens": max_new_tokens,
-        "temperature": 0.6 if enable_thinking else 0.7, # Based on Qwen3 best practices
-        "top_p": 0.95 if enable_thinking else 0.8,
-        "top_k": 20,
-        "do_sample": True
-    }
-
-    # Wrap blocking I/O (GPU compute) in to_thread
+    # The prompt is queued and run together with concurrent requests in one padded generate()
+    # (chat template and Qwen3 sampling settings are applied by the backend, see batching.py).
+    # prefix names the fixed instruction part of the prompt so its KV cache can be reused.
+    # Admission keeps the estimated tokens in flight under budget; overflow gets a 429.
     try:
-        generated_ids = await asyncio.to_thread(
-            model.generate, 
-            **model_inputs, 
-            **generation_kwargs
-        )
+        async with admission.admit(estimate_cost(prompt_text, max_new_tokens), priority):
+            raw_response = await batcher.submit(prompt_text, max_new_tokens, enable_thinking, prefix,
+                                                constraint if JSON_CONSTRAINED_DECODING else None)
+    except AdmissionRejected as e:
+        print(f"[ADMISSION] Rejected request ({e}); retry after {e.retry_after_s}s")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
     except Exception as e:
         print(f"Error during model.generate: {e}")
         raise HTTPException(status_code=500, detail=f"LLM generation error: {e}")
     
-    output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
-    raw_response = tokenizer.decode(output_ids, skip_special_tokens=False) # Keep special for think parsing
-    
     latency = time.time() - start_time
     print(f"[LATENCY_LOG] {latency:.2f}s for prompt: {prompt_text[:50]}...")
 
     parsed_output = parse_qwen_output(raw_response)
     return parsed_output['final'] # Return only the final content after thought block
 
+async def generate_json_async(prompt_text: str, constraint: JSONConstraint, max_new_tokens: int,
+                              priority: int = PRIORITY_LOW, prefix: str | None = None):
+    """
+    Generates schema-constrained JSON and validates it, retrying up to
+    JSON_MAX_RETRIES times. Returns (parsed value or None, last raw output).
+    Thinking is off: with 50-150 token budgets a <think> block used up the
+    budget before the constrained JSON started.
+    """
+    llm_response_str = ""
+    for attempt in range(JSON_MAX_RETRIES + 1):
+        llm_response_str = await generate_qwen_response_async(prompt_text, max_new_tokens=max_new_tokens,
+                                                              enable_thinking=False, priority=priority, prefix=prefix,
+                                                              constraint=constraint)
+        try:
+            return constraint.parse(llm_response_str), llm_response_str
+        except ValueError as e: # json.JSONDecodeError is a ValueError
+            print(f"[JSON_RETRY] {constraint.name} output failed validation (attempt {attempt + 1}): {e}")
+    return None, llm_response_str
+
 # --- API Endpoints --- 
 @app.get("/healthz", response_model=HealthResponse, dependencies=[Depends(verify_token)])
 async def health_check():
@@ -182,110 +259,356 @@ async def health_check():
         # For memory reserved by PyTorch (total used by the allocator)
         vram_used_pytorch = torch.cuda.memory_reserved(DEVICE) / (1024**3)
         
+    prefix_cache = getattr(batcher.backend, "prefix_cache", None) if batcher else None
     return HealthResponse(
-        status="OK" if model and tokenizer else "Model not loaded",
-        model_name=MODEL_NAME,
+        status="OK" if batcher else "Model not loaded",
+        model_name=MODEL_NAME if INFERENCE_BACKEND != "stub" else "stub",
         device=DEVICE,
         vram_allocated_tensors_gb=vram_allocated_tensors,
         vram_used_by_pytorch_gb=vram_used_pytorch, 
-        vram_total_gb=vram_total
+        vram_total_gb=vram_total,
+        result_cache=result_cache.stats(),
+        batching=batcher.stats() if batcher else None,
+        admission=admission.stats(),
+        streaming=streaming_stats.stats(),
+        prefix_cache=prefix_cache.stats() if prefix_cache else None,
+        embedding=embedder.stats() if embedder else None
     )
 
+ALLOWED_STYLES = ["Salsa", "Bachata", "Kizomba", "Zouk", "Tango", "Swing", "Other", "Unknown"]
+
+# Fixed instruction prefixes come first so their KV cache can be shared (see prefix_cache.py)
+STYLE_PROMPT_PREFIX = (
+    f"You are an expert dance style classifier. Based on the text below, identify all applicable dance styles. "
+    f"Respond ONLY with a valid JSON list of strings. The strings must be from the following allowed styles: {ALLOWED_STYLES}. "
+    f"If no style is clear or applicable from the list, return [\"Unknown\"]. Text: \n"
+)
+
+def build_style_prompt(text):
+    return STYLE_PROMPT_PREFIX + f"\"\"{text}\"\""
+
+def parse_style_output(llm_response_str):
+    """Style list from the model's answer, or a single parsing_error/json_decode_error marker."""
+    # Robust JSON parsing
+    try:
+        # The LLM might return a string that looks like a list, but not perfect JSON.
+        # Try to clean it up. A more robust way is to ask LLM for JSON object `{"styles": [...]}`
+        # For now, simple parsing based on the prompt's request for a JSON list.
+        if llm_response_str.strip().startswith("[") and llm_response_str.strip().endswith("]"):
+            identified_styles = json.loads(llm_response_str.strip())
+            if not isinstance(identified_styles, list):
+                identified_styles = ["parsing_error_not_a_list"]
+        else:
+            identified_styles = ["parsing_error_not_a_json_list"]
+    except json.JSONDecodeError:
+        identified_styles = ["json_decode_error"]
+    return identified_styles
+
+STYLE_CONSTRAINT = JSONConstraint("style", {"type": "array", "items": {"enum": ALLOWED_STYLES}})
+
+def style_cache_key(text):
+    return cache_key(text, ALLOWED_STYLES, f"{MODEL_NAME}:{PROMPT_VERSION}:style")
+
 @app.post("/style", response_model=StyleResponse, dependencies=[Depends(verify_token)])
 async def style_endpoint(request: StyleRequest = Body(..., embed=True)):
-    allowed_styles_example = ["Salsa", "Bachata", "Kizomba", "Zouk", "Tango", "Swing", "Other", "Unknown"]
-    prompt = (
-        f"You are an expert dance style classifier. Based on the text below, identify all applicable dance styles. "
-        f"Respond ONLY with a valid JSON list of strings. The strings must be from the following allowed styles: {allowed_styles_example}. "
-        f"If no style is clear or applicable from the list, return [\"Unknown\"]. Text: \n"
-        f"\"\"{request.text}\"\""
-    )
+    prompt = build_style_prompt(request.text)
+    key = style_cache_key(request.text)
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached:
+        return StyleResponse(**cached)
     try:
-        llm_response_str = await generate_qwen_response_async(prompt, max_new_tokens=150)
-        # Robust JSON parsing
-        try:
-            # The LLM might return a string that looks like a list, but not perfect JSON.
-            # Try to clean it up. A more robust way is to ask LLM for JSON object `{"styles": [...]}`
-            # For now, simple parsing based on the prompt's request for a JSON list.
-            if llm_response_str.strip().startswith("[") and llm_response_str.strip().endswith("]"):
-                identified_styles = json.loads(llm_response_str.strip())
-                if not isinstance(identified_styles, list):
-                    identified_styles = ["parsing_error_not_a_list"]
-            else:
-                identified_styles = ["parsing_error_not_a_json_list"]
-        except json.JSONDecodeError:
-            identified_styles = ["json_decode_error"]
+        identified_styles, llm_response_str = await generate_json_async(prompt, STYLE_CONSTRAINT, 150, PRIORITY_HIGH,
+                                                                        prefix=STYLE_PROMPT_PREFIX)
+        if identified_styles is None:
+            identified_styles = parse_style_output(llm_response_str)
+        if identified_styles not in STYLE_PARSE_ERRORS: # Failed parses are retried, not cached
+            await asyncio.to_thread(result_cache.put, "style", key,
+                                    {"styles": identified_styles, "raw_llm_output": llm_response_str})
         
         return StyleResponse(styles=identified_styles, raw_llm_output=llm_response_str)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in /style endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+EXTRACT_SCHEMA_EXAMPLE = json.dumps({
+    "event_name": "string or null",
+    "date_start": "YYYY-MM-DD or null",
+    "time_start": "HH:MM or null",
+    "venue_name": "string or null",
+    "address": "string or null",
+    "description": "string (concise summary) or null",
+    "organizer_name": "string or null",
+    "event_url": "URL string or null",
+    "ticket_url": "URL string or null",
+    "raw_price_info": "string or null"
+}, indent=2)
+
+EXTRACT_PROMPT_PREFIX = (
+    f"You are an expert event information extractor. From the page content below, extract the event details. "
+    f"Respond ONLY with a valid JSON object that strictly adheres to the following schema. Do not add any commentary before or after the JSON. "
+    f"If a field is not found, use a JSON null value, not the string 'null'.\n\n"
+    f"JSON Schema to follow:\n{EXTRACT_SCHEMA_EXAMPLE}\n\n"
+)
+
+def build_extract_prompt(distilled):
+    """/extract prompt from a distill_html() result: structured hints first, then the kept page text."""
+    hints_section = ""
+    if distilled.hints:
+        hints_section = (
+            f"Structured data found on the page (trust it unless the text contradicts it):\n"
+            f"{json.dumps(distilled.hints, ensure_ascii=False, indent=2)}\n\n"
+        )
+    return (
+        f"{EXTRACT_PROMPT_PREFIX}"
+        f"{hints_section}"
+        f"Page text (scripts, styles, navigation and footers removed):\n"
+        f"{distilled.text}"
+    )
+
+EXTRACT_CONSTRAINT = JSONConstraint(
+    "extract", object_schema({name: nullable_string() for name in json.loads(EXTRACT_SCHEMA_EXAMPLE)})
+)
+
+def extract_cache_key(html_content):
+    return cache_key(html_content, json.loads(EXTRACT_SCHEMA_EXAMPLE), f"{MODEL_NAME}:{PROMPT_VERSION}:extract-distilled")
+
+def merge_structured_hints(extracted_data, hints):
+    """Structured data fills whatever the model left empty."""
+    for field_name, value in hints.items():
+        if not extracted_data.get(field_name):
+            extracted_data[field_name] = value
+    return extracted_data
+
 @app.post("/extract", response_model=ExtractResponse, dependencies=[Depends(verify_token)])
 async def extract_endpoint(request: ExtractRequest = Body(..., embed=True)):
-    json_schema_example = json.dumps({
-        "event_name": "string or null",
-        "date_start": "YYYY-MM-DD or null",
-        "time_start": "HH:MM or null",
-        "venue_name": "string or null",
-        "address": "string or null",
-        "description": "string (concise summary) or null",
-        "organizer_name": "string or null",
-        "event_url": "URL string or null",
-        "ticket_url": "URL string or null",
-        "raw_price_info": "string or null"
-    }, indent=2)
+    if len(request.html_content) > MAX_REQUEST_BODY_SIZE:
+        raise HTTPException(status_code=413, detail=f"html_content exceeds {MAX_REQUEST_BODY_SIZE} bytes")
 
-    prompt = (
-        f"You are an expert event information extractor. From the HTML content below, extract the event details. "
-        f"Respond ONLY with a valid JSON object that strictly adheres to the following schema. Do not add any commentary before or after the JSON. "
-        f"If a field is not found, use a JSON null value, not the string 'null'.\n\n"
-        f"JSON Schema to follow:\n{json_schema_example}\n\n"
-        f"HTML Content:\n"
-        f"<html>\n{request.html_content}\n</html>"
-    )
+    key = extract_cache_key(request.html_content)
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached:
+        return ExtractResponse(**cached)
+
+    # Parsing up to 2 MB of HTML is CPU work; keep it off the event loop
+    distilled = await asyncio.to_thread(distill_html, request.html_content, EXTRACT_TOKEN_BUDGET)
+    report = distilled.report()
+    print(f"[DISTILL_LOG] {distilled.tokens_before} -> {distilled.tokens_after} tokens, "
+          f"structured: {distilled.sources or 'none'}, llm_skipped: {distilled.complete}")
+    if distilled.complete:
+        # JSON-LD/microdata/OpenGraph already answer every required field
+        return ExtractResponse(extracted_data=complete_from_hints(distilled.hints), raw_llm_output="",
+                               distillation=report)
+
+    prompt = build_extract_prompt(distilled)
     try:
-        llm_response_str = await generate_qwen_response_async(prompt, max_new_tokens=2048) # Allow more for HTML + JSON
-        try:
-            extracted_data = json.loads(llm_response_str.strip()) # Strip whitespace that might break JSON
-        except json.JSONDecodeError:
-            # Checklist: "Add a JSON schema validator; retry with higher temp on fail."
-            # Retry logic is more complex; for now, return error.
-            # print(f"JSONDecodeError for /extract. Raw output: {llm_response_str}")
+        extracted_data, llm_response_str = await generate_json_async(prompt, EXTRACT_CONSTRAINT, 2048, # Allow more for HTML + JSON
+                                                                     prefix=EXTRACT_PROMPT_PREFIX)
+        if extracted_data is not None:
+            merge_structured_hints(extracted_data, distilled.hints)
+            await asyncio.to_thread(result_cache.put, "extract", key,
+                                    {"extracted_data": extracted_data, "raw_llm_output": llm_response_str,
+                                     "distillation": report})
+        else:
             extracted_data = {"error": "Failed to parse LLM JSON output", "raw_output_snippet": llm_response_str[:500]}
-        return ExtractResponse(extracted_data=extracted_data, raw_llm_output=llm_response_str)
+        return ExtractResponse(extracted_data=extracted_data, raw_llm_output=llm_response_str, distillation=report)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in /extract endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Streaming Endpoints ---
+# Newline-delimited JSON events: {"type": "token", "text": ...} for answer text as it is generated
+# (the <think> block is stripped on the fly), {"type": "field", "name": ..., "value": ...} for each
+# completed top-level /extract field, then {"type": "done", "result": ..., "ttfb_ms": ..., "latency_ms": ...}
+# or {"type": "error", "detail": ...}. Streams run outside the micro-batcher but under admission control.
+
+def ndjson_line(event):
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls release() when sending ends, however it ends. The body generator's finally
+    does not run if the client disconnects (or the send fails) before the first chunk is pulled.
+    """
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.release()
+
+async def stream_generation(prompt_text: str, max_new_tokens: int, priority: int, finalize,
+                            emit_fields: bool = False, enable_thinking: bool = True, label: str = "stream",
+                            prefix: str | None = None, constraint: JSONConstraint | None = None):
+    """
+    Admits one streamed generation and returns its StreamingResponse.
+    finalize(answer_text) builds the 'done' result (run on a worker thread; it may write the result cache).
+    Admission is checked before the response starts so an overloaded service still answers 429; the tokens
+    are released exactly once, by the generator or, if it never ran to completion, by the response.
+    """
+    if not batcher:
+        raise HTTPException(status_code=503, detail="Model not loaded or still initializing.")
+    cost = estimate_cost(prompt_text, max_new_tokens)
+    try:
+        await admission.acquire(cost, priority)
+    except AdmissionRejected as e:
+        print(f"[ADMISSION] Rejected {label} ({e}); retry after {e.retry_after_s}s")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
+    print(f"[PROMPT_LOG] {prompt_text[:50]}...")
+    released = False
+
+    def release(elapsed_s=None):
+        nonlocal released
+        if not released:
+            released = True
+            admission.release(cost, elapsed_s)
+
+    async def events():
+        start_time = time.monotonic()
+        ttfb = None
+        stripper = ThinkStripper(batcher.backend.eos_token)
+        fields = IncrementalJSONFields() if emit_fields else None
+        answer_parts = []
+
+        def emit(text):
+            nonlocal ttfb
+            if ttfb is None:
+                ttfb = time.monotonic() - start_time
+                print(f"[TTFB_LOG] {ttfb:.2f}s for {label}")
+            answer_parts.append(text)
+            lines = [ndjson_line({"type": "token", "text": text})]
+            if fields:
+                lines.extend(ndjson_line({"type": "field", "name": name, "value": value})
+                             for name, value in fields.feed(text))
+            return "".join(lines)
+
+        try:
+            chunks = iterate_in_thread(lambda stop_event: batcher.backend.stream(
+                prompt_text, max_new_tokens, enable_thinking, stop_event, prefix,
+                constraint if JSON_CONSTRAINED_DECODING else None))
+            async for chunk in chunks:
+                text = stripper.feed(chunk)
+                if text:
+                    yield emit(text)
+            tail = stripper.flush()
+            if tail:
+                yield emit(tail)
+            result = await asyncio.to_thread(finalize, "".join(answer_parts).strip()) # May write the result cache
+            latency = time.monotonic() - start_time
+            yield ndjson_line({"type": "done", "result": result,
+                               "ttfb_ms": round(ttfb * 1000, 1) if ttfb is not None else None,
+                               "latency_ms": round(latency * 1000, 1)})
+        except Exception as e:
+            print(f"Error in {label}: {e}")
+            yield ndjson_line({"type": "error", "detail": str(e)})
+        finally:
+            latency = time.monotonic() - start_time
+            streaming_stats.record(ttfb, latency)
+            release(latency)
+            print(f"[LATENCY_LOG] {latency:.2f}s for {label}: {prompt_text[:50]}...")
+
+    return AdmittedStreamingResponse(events(), release, media_type="application/x-ndjson")
+
+def single_event_stream(result, **extra):
+    return StreamingResponse(iter([ndjson_line({"type": "done", "result": result, **extra})]),
+                             media_type="application/x-ndjson")
+
+@app.post("/style/stream", dependencies=[Depends(verify_token)])
+async def style_stream_endpoint(request: StyleRequest = Body(..., embed=True)):
+    key = style_cache_key(request.text)
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached:
+        return single_event_stream(cached["styles"], cached=True)
+
+    def finalize(answer):
+        identified_styles = parse_style_output(answer)
+        if identified_styles not in STYLE_PARSE_ERRORS:
+            result_cache.put("style", key, {"styles": identified_styles, "raw_llm_output": answer})
+        return identified_styles
+
+    return await stream_generation(build_style_prompt(request.text), 150, PRIORITY_HIGH, finalize,
+                                   enable_thinking=False, label="/style/stream", prefix=STYLE_PROMPT_PREFIX,
+                                   constraint=STYLE_CONSTRAINT)
+
+@app.post("/extract/stream", dependencies=[Depends(verify_token)])
+async def extract_stream_endpoint(request: ExtractRequest = Body(..., embed=True)):
+    if len(request.html_content) > MAX_REQUEST_BODY_SIZE:
+        raise HTTPException(status_code=413, detail=f"html_content exceeds {MAX_REQUEST_BODY_SIZE} bytes")
+    key = extract_cache_key(request.html_content)
+    cached = await asyncio.to_thread(result_cache.get, key)
+    if cached:
+        return single_event_stream(cached["extracted_data"], cached=True)
+
+    distilled = await asyncio.to_thread(distill_html, request.html_content, EXTRACT_TOKEN_BUDGET)
+    if distilled.complete:
+        return single_event_stream(complete_from_hints(distilled.hints), distillation=distilled.report())
+
+    def finalize(answer):
+        try:
+            extracted_data = EXTRACT_CONSTRAINT.parse(answer)
+        except ValueError:
+            return {"error": "Failed to parse LLM JSON output", "raw_output_snippet": answer[:500]}
+        merge_structured_hints(extracted_data, distilled.hints)
+        result_cache.put("extract", key, {"extracted_data": extracted_data, "raw_llm_output": answer,
+                                          "distillation": distilled.report()})
+        return extracted_data
+
+    return await stream_generation(build_extract_prompt(distilled), 2048, PRIORITY_LOW, finalize,
+                                   emit_fields=True, enable_thinking=False, label="/extract/stream",
+                                   prefix=EXTRACT_PROMPT_PREFIX,
+                                   constraint=EXTRACT_CONSTRAINT)
+
+DEDUPE_CONSTRAINT = JSONConstraint("dedupe", object_schema({"same_event": {"type": "boolean"}}))
+
+DEDUPE_PROMPT_PREFIX = (
+    f"Analyze the two event descriptions below. Determine if they refer to the exact same event occurrence. "
+    'Respond ONLY with a valid JSON object in the format: {"same_event": true} or {"same_event": false}. '
+    f"Do not add any commentary before or after the JSON.\n\n"
+)
+
 @app.post("/dedupe", response_model=DedupeResponse, dependencies=[Depends(verify_token)])
 async def dedupe_endpoint(request: DedupeRequest = Body(..., embed=True)):
     prompt = (
-        f"Analyze the two event descriptions below. Determine if they refer to the exact same event occurrence. "
-        f"Respond ONLY with a valid JSON object in the format: {json.dumps({'same_event': True/False})}. "
-        f"Do not add any commentary before or after the JSON.\n\n"
+        f"{DEDUPE_PROMPT_PREFIX}"
         f"Event 1: \"\"{request.event_text_1}\"\"\n"
         f"Event 2: \"\"{request.event_text_2}\"\""
     )
     try:
-        llm_response_str = await generate_qwen_response_async(prompt, max_new_tokens=50)
-        try:
-            dedupe_result = json.loads(llm_response_str.strip())
-            is_same = dedupe_result.get("same_event", False)
-            if not isinstance(is_same, bool):
-                is_same = False # Default if type is wrong
-                # print(f"Dedupe output 'same_event' was not a bool. Raw: {llm_response_str}")
-        except json.JSONDecodeError:
-            # print(f"JSONDecodeError for /dedupe. Raw output: {llm_response_str}")
-            is_same = False # Default on parsing error
+        dedupe_result, llm_response_str = await generate_json_async(prompt, DEDUPE_CONSTRAINT, 50, PRIORITY_HIGH,
+                                                                    prefix=DEDUPE_PROMPT_PREFIX)
+        # Validated output always has a boolean same_event; default to False if every attempt failed
+        is_same = dedupe_result["same_event"] if dedupe_result is not None else False
         
         # Placeholder confidence, real confidence is hard to get from LLM directly
         confidence = 0.8 if is_same else 0.2 
         return DedupeResponse(is_same_event=is_same, confidence=confidence, raw_llm_output=llm_response_str)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in /dedupe endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/embed", response_model=EmbedResponse, dependencies=[Depends(verify_token)])
+async def embed_endpoint(request: EmbedRequest = Body(..., embed=True)):
+    if not embedder:
+        raise HTTPException(status_code=503, detail="Embedding model not loaded.")
+    if len(request.texts) > EMBED_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"At most {EMBED_MAX_TEXTS} texts per request.")
+    start_time = time.time()
+    try:
+        embeddings = await asyncio.to_thread(embedder.embed, request.texts)
+    except Exception as e:
+        print(f"Error in /embed endpoint: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    print(f"[LATENCY_LOG] {time.time() - start_time:.2f}s to embed {len(request.texts)} texts")
+    return EmbedResponse(model=embedder.model_name, dimensions=embedder.dimensions, embeddings=embeddings)
+
 # To run (save as main.py in qwen_inference_service directory):
 # Ensure Dockerfile and requirements.txt are in qwen_inference_service directory.
 # Build: docker build -t qwen-inference-service ./qwen_inference_service
@@ -0,0 +1,131 @@
+"""
+Prompt-prefix KV cache.
+
+/style, /extract and /dedupe prompts start with a long fixed instruction
+(allowed-styles list, JSON schema) followed by the per-request document.
+PrefixKVCache prefills each distinct prefix once, keyed on the template
+version and the prefix text, and hands out copies of its key/value cache so
+generate() only prefills the variable suffix.
+
+Input ids are always built as prefix ids + suffix ids (tokenized
+separately), with or without the cache, so cached and uncached runs see
+exactly the same tokens; check_prefix_cache.py compares them on a small CPU
+model.
+
+The cache applies to single-prompt generations (batches of one and streams):
+left-padded multi-prompt batches place each prompt's prefix at a different
+position, so they prefill in full as before.
+"""
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+
+from batching import render_chat_prompt
+
+
+def split_chat_prompt(tokenizer, prompt, prefix, enable_thinking=True):
+    """
+    Applies the chat template to prompt and splits the result at the end of
+    prefix. Returns (chat_prefix, chat_suffix), or None when prompt does not
+    start with prefix.
+    """
+    if not prefix or not prompt.startswith(prefix):
+        return None
+    chat_text = render_chat_prompt(tokenizer, prompt, enable_thinking)
+    position = chat_text.find(prompt)
+    if position < 0:
+        return None
+    cut = position + len(prefix)
+    return chat_text[:cut], chat_text[cut:]
+
+
+class PrefixKVCache:
+    """
+    LRU of prefilled prompt prefixes.
+
+    Args:
+        model: Causal LM used for prefill.
+        tokenizer: Its tokenizer.
+        device: Device the cache tensors live on.
+        version: Template version; part of every key so a prompt change never reuses stale entries.
+        max_entries: Distinct prefixes kept (one per template in practice).
+    """
+
+    def __init__(self, model, tokenizer, device, version="v1", max_entries=8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.version = version
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (prefix_ids tensor, past_key_values)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.tokens_reused = 0
+
+    def _key(self, chat_prefix):
+        return f"{self.version}:{hashlib.sha256(chat_prefix.encode('utf-8')).hexdigest()}"
+
+    def _prefill(self, chat_prefix):
+        import torch
+        from transformers import DynamicCache
+
+        prefix_ids = self.tokenizer(chat_prefix, return_tensors="pt", add_special_tokens=False).input_ids.to(self.device)
+        with torch.no_grad():
+            past_key_values = self.model(input_ids=prefix_ids, past_key_values=DynamicCache(), use_cache=True).past_key_values
+        return prefix_ids, past_key_values
+
+    def lookup(self, chat_prefix):
+        """Returns (prefix_ids, copy of the prefix KV cache), prefilling on first use."""
+        key = self._key(chat_prefix)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                entry = self._prefill(chat_prefix)
+                self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            else:
+                self.hits += 1
+            self.entries.move_to_end(key)
+            prefix_ids, past_key_values = entry
+            self.tokens_reused += prefix_ids.shape[1]
+            # generate() appends to the cache in place, so every request gets its own copy
+            return prefix_ids, copy.deepcopy(past_key_values)
+
+    def build_inputs(self, prompt, prefix, use_cache=True, enable_thinking=True):
+        """
+        Model inputs for one prompt as prefix ids + suffix ids. With use_cache,
+        also returns the prefilled prefix cache as past_key_values; otherwise
+        the same ids are prefilled from scratch. Returns None when the prompt
+        has no usable prefix.
+        """
+        import torch
+
+        parts = split_chat_prompt(self.tokenizer, prompt, prefix, enable_thinking)
+        if parts is None:
+            return None
+        chat_prefix, chat_suffix = parts
+        suffix_ids = self.tokenizer(chat_suffix, return_tensors="pt", add_special_tokens=False).input_ids.to(self.device)
+        if use_cache:
+            prefix_ids, past_key_values = self.lookup(chat_prefix)
+        else:
+            prefix_ids = self.tokenizer(chat_prefix, return_tensors="pt", add_special_tokens=False).input_ids.to(self.device)
+            past_key_values = None
+        input_ids = torch.cat([prefix_ids, suffix_ids], dim=1)
+        inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+        if past_key_values is not None:
+            inputs["past_key_values"] = past_key_values
+        return inputs
+
+    def stats(self):
+        with self.lock:
+            return {
+                "version": self.version,
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefix_tokens_reused": self.tokens_reused,
+            }
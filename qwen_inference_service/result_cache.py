@@ -0,0 +1,139 @@
+"""
+Content-hash cache for /style and /extract results.
+
+Keys hash the normalized input text, the requested fields and the prompt/model
+version, so a PROMPT_VERSION or MODEL_NAME change invalidates every entry.
+Each uvicorn worker keeps an in-process LRU; when DATABASE_URL is set (and
+psycopg2 is installed) results are also shared through the same
+enrichment_cache table the batch pipelines use (services/enrichment_cache.py).
+The service is built as its own Docker context, hence the separate module.
+"""
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import psycopg2
+    from psycopg2.extras import Json
+except ImportError:  # Postgres sharing is optional; the LRU still works
+    psycopg2 = None
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    if not text:
+        return ""
+    return _WHITESPACE_RE.sub(" ", str(text)).strip().lower()
+
+
+def cache_key(text, fields, version, title=""):
+    """Same key layout as services/enrichment_cache.enrichment_cache_key."""
+    material = json.dumps([normalize_text(title), normalize_text(text), sorted(fields or []), version],
+                          ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_entries=5000, database_url=None):
+        self.max_entries = max_entries
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.db_lock = threading.Lock()
+        self.database_url = database_url if psycopg2 else None
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+        if database_url and not psycopg2:
+            print("WARNING: DATABASE_URL set but psycopg2 is not installed; using the in-process cache only.")
+
+    def _connection(self):
+        # Called with db_lock held
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.database_url)
+            with self.conn.cursor() as cur:
+                cur.execute("""
+                    CREATE TABLE IF NOT EXISTS enrichment_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        namespace TEXT NOT NULL,
+                        result JSONB NOT NULL,
+                        hit_count INTEGER NOT NULL DEFAULT 0,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                        last_hit_at TIMESTAMPTZ
+                    );
+                """)
+            self.conn.commit()
+        return self.conn
+
+    def _db_get(self, key):
+        if not self.database_url:
+            return None
+        with self.db_lock:
+            try:
+                conn = self._connection()
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE enrichment_cache
+                        SET hit_count = hit_count + 1, last_hit_at = NOW()
+                        WHERE cache_key = %s
+                        RETURNING result
+                    """, (key,))
+                    row = cur.fetchone()
+                conn.commit()
+                return row[0] if row else None
+            except psycopg2.Error as e:
+                print(f"Result cache lookup failed: {e}")
+                if self.conn is not None and not self.conn.closed:
+                    self.conn.rollback()
+                return None
+
+    def _db_put(self, namespace, key, result):
+        if not self.database_url:
+            return
+        with self.db_lock:
+            try:
+                conn = self._connection()
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        INSERT INTO enrichment_cache (cache_key, namespace, result)
+                        VALUES (%s, %s, %s)
+                        ON CONFLICT (cache_key) DO UPDATE SET result = EXCLUDED.result, created_at = NOW()
+                    """, (key, namespace, Json(result)))
+                conn.commit()
+            except psycopg2.Error as e:
+                print(f"Result cache write failed: {e}")
+                if self.conn is not None and not self.conn.closed:
+                    self.conn.rollback()
+
+    def _remember(self, key, result):
+        with self.lock:
+            self.lru[key] = result
+            self.lru.move_to_end(key)
+            while len(self.lru) > self.max_entries:
+                self.lru.popitem(last=False)
+
+    def get(self, key):
+        """Blocking lookup (LRU, then Postgres); call through asyncio.to_thread from handlers."""
+        with self.lock:
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                self.hits += 1
+                return self.lru[key]
+        result = self._db_get(key)
+        with self.lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        self._remember(key, result)
+        return result
+
+    def put(self, namespace, key, result):
+        self._remember(key, result)
+        self._db_put(namespace, key, result)
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.lru)}
@@ -0,0 +1,182 @@
+"""
+Helpers for the streaming /extract/stream and /style/stream endpoints.
+
+ThinkStripper drops a leading <think>...</think> block as tokens arrive,
+IncrementalJSONFields emits top-level fields of a JSON object as soon as each
+value is complete, iterate_in_thread drives a blocking backend token iterator
+from async code, and StreamingStats keeps time-to-first-byte figures for
+/healthz.
+"""
+import json
+import asyncio
+import threading
+from collections import deque
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+class ThinkStripper:
+    """
+    Incrementally removes a leading <think>...</think> block (Qwen3 reasoning)
+    from streamed text. Tags split across chunks are held back until they can
+    be recognized; whitespace between the block and the answer is dropped.
+    """
+
+    def __init__(self, eos_token=None):
+        self.state = "start"  # start -> (thinking ->) content
+        self.buffer = ""
+        self.eos_token = eos_token
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        while True:
+            if self.state == "start":
+                stripped = self.buffer.lstrip()
+                if not stripped or (THINK_OPEN.startswith(stripped) and stripped != THINK_OPEN):
+                    return ""  # Not enough text yet to tell whether a think block follows
+                if stripped.startswith(THINK_OPEN):
+                    self.buffer = stripped[len(THINK_OPEN):]
+                    self.state = "thinking"
+                    continue
+                self.buffer = stripped
+                self.state = "content"
+            elif self.state == "thinking":
+                end = self.buffer.find(THINK_CLOSE)
+                if end < 0:
+                    # Keep just enough to catch a closing tag split across chunks
+                    self.buffer = self.buffer[-(len(THINK_CLOSE) - 1):]
+                    return ""
+                self.buffer = self.buffer[end + len(THINK_CLOSE):]
+                self.state = "start_content"
+            elif self.state == "start_content":
+                self.buffer = self.buffer.lstrip()
+                if not self.buffer:
+                    return ""
+                self.state = "content"
+            else:
+                text, self.buffer = self.buffer, ""
+                if self.eos_token:
+                    text = text.replace(self.eos_token, "")
+                return text
+
+    def flush(self):
+        """Text still held back at the end of generation (never the think block)."""
+        if self.state == "thinking":
+            return ""
+        text, self.buffer = self.buffer.strip() if self.state == "start" else self.buffer, ""
+        if self.eos_token:
+            text = text.replace(self.eos_token, "")
+        return text
+
+
+class IncrementalJSONFields:
+    """
+    Scans streamed text for one top-level JSON object and returns each
+    (name, value) pair once its value is complete. Text before the opening
+    brace (e.g. a ```json fence) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.started = False
+        self.finished = False
+        self.segment = []
+
+    def feed(self, text):
+        fields = []
+        for char in text:
+            if self.finished:
+                break
+            if not self.started:
+                if char == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self.in_string:
+                self.segment.append(char)
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+            elif char in "}]":
+                self.depth -= 1
+            if self.depth == 1 and char == ",":
+                fields.extend(self._pop_segment())
+                continue
+            if self.depth == 0:
+                fields.extend(self._pop_segment())
+                self.finished = True
+                continue
+            self.segment.append(char)
+        return fields
+
+    def _pop_segment(self):
+        segment = "".join(self.segment).strip()
+        self.segment = []
+        if not segment:
+            return []
+        try:
+            return list(json.loads("{" + segment + "}").items())
+        except json.JSONDecodeError:
+            return []
+
+
+async def iterate_in_thread(make_iterator):
+    """
+    Runs a blocking token iterator on a worker thread and yields its chunks.
+    make_iterator(stop_event) must return the iterator; stop_event is set when
+    the consumer goes away so generation can end early.
+    """
+    stop_event = threading.Event()
+    iterator = make_iterator(stop_event)
+    done = object()
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, done)
+            if chunk is done:
+                break
+            yield chunk
+    finally:
+        stop_event.set()
+        await asyncio.to_thread(iterator.close)
+
+
+class StreamingStats:
+    """Rolling time-to-first-byte and total latency for streamed responses."""
+
+    def __init__(self, window=500):
+        self.ttfb_s = deque(maxlen=window)
+        self.total_s = deque(maxlen=window)
+        self.streams = 0
+
+    def record(self, ttfb_s, total_s):
+        self.streams += 1
+        if ttfb_s is not None:
+            self.ttfb_s.append(ttfb_s)
+        self.total_s.append(total_s)
+
+    @staticmethod
+    def _percentile(values, fraction):
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[int(fraction * (len(ordered) - 1))] * 1000, 1)
+
+    def stats(self):
+        return {
+            "streams": self.streams,
+            "ttfb_p50_ms": self._percentile(self.ttfb_s, 0.5),
+            "ttfb_p95_ms": self._percentile(self.ttfb_s, 0.95),
+            "total_p50_ms": self._percentile(self.total_s, 0.5),
+        }
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+serp_rule_extractor.py
+
+Deterministic event extraction for the structured SERP item types, so only
+unstructured results need the LLM.
+
+DataForSEO already returns these item types in a fixed shape:
+- event_item (events endpoint): title, event_dates, location_info, url
+- events (Google events carousel): one events_element per event, with a
+  "May 10, 8:00 PM Venue City, ST $18" snippet
+- local_pack / maps_search: a studio or venue with address, phone and category
+
+Places have no date, so they are returned as venues, never as events. Each
+extracted event or venue carries a confidence in [0, 1] built from what the
+item actually provided (date, time, address, a dance keyword, ...).
+route_serp_items keeps those at or above min_confidence and sends structured
+items below it, plus organic and other free-text results, to the LLM;
+everything else (related searches, flights, reviews, ...) is dropped.
+check_serp_rule_recall.py measures recall and precision against a full LLM run.
+"""
+
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+RULE_ITEM_TYPES = {"event_item", "events", "local_pack", "maps_search"}
+# Free-text results: organic snippets and the SERP features that list organic-like links
+LLM_ITEM_TYPES = {"organic", "paid", "perspectives", "find_results_on", "compare_sites", "top_sights", "courses"}
+MIN_CONFIDENCE = 0.6
+
+# Longer names first so "west coast swing" wins over "swing"
+DANCE_STYLES = [
+    "west coast swing", "lindy hop", "cha cha", "salsa", "bachata", "kizomba", "zouk", "tango", "milonga",
+    "swing", "samba", "ballroom", "forro", "forró", "lambada", "cumbia", "hustle", "rumba", "merengue",
+    "reggaeton", "ballet", "hip hop", "latin",
+]
+DANCE_KEYWORD_RE = re.compile(r"danc|baile|" + "|".join(re.escape(style) for style in DANCE_STYLES), re.IGNORECASE)
+LEVEL_RE = re.compile(r"\b(beginner|intermediate|advanced|all levels)s?\b", re.IGNORECASE)
+MONTH = r"(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Sept|Oct|Nov|Dec)[a-z]*\.?"
+# "May 10, 8:00 PM ..." / "10 May, 20:00 ..." / "Sat, May 10, 8 PM ..."
+EVENT_SNIPPET_RE = re.compile(
+    rf"^(?:(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun)[a-z]*,?\s+)?"
+    rf"(?P<date>{MONTH}\s+\d{{1,2}}|\d{{1,2}}\s+{MONTH})"
+    rf"(?:,?\s+(?P<time>\d{{1,2}}(?::\d{{2}})?\s*[AaPp]\.?[Mm]\.?|\d{{1,2}}:\d{{2}}))?"
+    rf"(?:\s*[-–]\s*[^,]*?\d(?::\d{{2}})?\s*(?:[AaPp]\.?[Mm]\.?)?)?"
+    rf",?\s*(?P<rest>.*)$"
+)
+PRICE_RE = re.compile(r"\s*(?P<price>(?:[$£€]\s?\d+(?:[.,]\d{2})?(?:\s*[-–]\s*[$£€]?\s?\d+(?:[.,]\d{2})?)?)|Free)$",
+                      re.IGNORECASE)
+PHONE_RE = re.compile(r"^\+?[\d\s().-]{7,}$")
+NOT_ADDRESS_RE = re.compile(r"years? in business|open|closed|closes|opens", re.IGNORECASE)
+
+
+def iter_serp_items(serp_data: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the result items of a SERP file: DataForSEO task responses
+    (tasks -> result -> items), bare DataForSEO results ({"items": [...]})
+    and SerpAPI-style organic_results (mapped to DataForSEO field names).
+    """
+    if not isinstance(serp_data, dict):
+        return
+    for task in serp_data.get("tasks") or []:
+        for result in task.get("result") or []:
+            yield from result.get("items") or []
+    yield from serp_data.get("items") or []
+    for result in serp_data.get("organic_results") or []:
+        item = {"type": "organic", "title": result.get("title"), "url": result.get("link"),
+                "description": result.get("snippet")}
+        if isinstance(result.get("rich_snippet"), dict) and "top" in result["rich_snippet"]:
+            item["rich_data"] = result["rich_snippet"]["top"]
+        yield item
+
+
+def clean_text(text: Any) -> str:
+    """Collapse whitespace, including the narrow no-break spaces Google puts before AM/PM"""
+    return " ".join(str(text or "").split())
+
+
+def dance_styles(*texts: Any) -> Optional[str]:
+    """Comma-separated dance styles named in texts, in DANCE_STYLES order"""
+    haystack = " ".join(clean_text(text).lower() for text in texts)
+    found = []
+    for style in DANCE_STYLES:
+        if re.search(rf"\b{re.escape(style)}\b", haystack) and not any(style in other for other in found):
+            found.append(style)
+    return ", ".join(found) if found else None
+
+
+def experience_level(*texts: Any) -> Optional[str]:
+    match = LEVEL_RE.search(" ".join(clean_text(text) for text in texts))
+    return match.group(1).lower() if match else None
+
+
+def new_event(item_type: str, **fields) -> Dict[str, Any]:
+    """An event in the LLM output schema, tagged as rule-extracted"""
+    event = {
+        "event_name": None, "dance_style": None, "date_time": None, "location": None, "organizer": None,
+        "price": None, "experience_level": None, "url": None, "description": None,
+    }
+    event.update(fields)
+    event.update(extraction="rules", item_type=item_type)
+    return event
+
+
+def score(*parts: Tuple[bool, float]) -> float:
+    return round(min(1.0, sum(weight for present, weight in parts if present)), 2)
+
+
+def parse_event_snippet(snippet: str) -> Dict[str, Optional[str]]:
+    """Split an events_element snippet into date, time, location and price"""
+    snippet = clean_text(snippet)
+    match = EVENT_SNIPPET_RE.match(snippet)
+    if not match:
+        return {"date": None, "time": None, "location": snippet or None, "price": None}
+    rest = match.group("rest")
+    price_match = PRICE_RE.search(rest)
+    price = price_match.group("price") if price_match else None
+    if price_match:
+        rest = rest[:price_match.start()]
+    return {"date": match.group("date"), "time": match.group("time"), "location": rest.strip(" ,") or None,
+            "price": price}
+
+
+def extract_event_item(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """DataForSEO events endpoint item (see transform_event_raw.py)"""
+    title = clean_text(item.get("title"))
+    dates = item.get("event_dates") if isinstance(item.get("event_dates"), dict) else {}
+    location = item.get("location_info") if isinstance(item.get("location_info"), dict) else {}
+    venue = ", ".join(clean_text(location.get(key)) for key in ("name", "address") if location.get(key)) or None
+    start = dates.get("start_datetime")
+    description = clean_text(item.get("description")) or None
+    event = new_event(
+        "event_item", event_name=title or None, date_time=start, location=venue, url=item.get("url"),
+        description=description, dance_style=dance_styles(title, description),
+        experience_level=experience_level(title, description),
+    )
+    event["confidence"] = score((bool(title), 0.4), (bool(start), 0.4), (bool(venue), 0.15), (bool(item.get("url")), 0.05))
+    return [event]
+
+
+def extract_events_carousel(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Google events carousel: one event per events_element"""
+    events = []
+    for element in item.get("items") or []:
+        if not isinstance(element, dict):
+            continue
+        title = clean_text(element.get("title"))
+        parsed = parse_event_snippet(element.get("snippet"))
+        date_time = " ".join(part for part in (parsed["date"], parsed["time"]) if part) or None
+        event = new_event(
+            "events", event_name=title or None, date_time=date_time, location=parsed["location"],
+            price=parsed["price"], url=element.get("url"), dance_style=dance_styles(title),
+            experience_level=experience_level(title),
+        )
+        event["confidence"] = score(
+            (bool(title), 0.3), (bool(parsed["date"]), 0.3), (bool(parsed["time"]), 0.1),
+            (bool(parsed["date"] and parsed["location"]), 0.15), (bool(DANCE_KEYWORD_RE.search(title)), 0.15),
+        )
+        events.append(event)
+    return events
+
+
+def local_pack_address(description: str) -> Optional[str]:
+    """The address part of a local_pack description ("7+ years in business · 411 W 146th St · (646) ...")"""
+    first_line = str(description or "").strip().split("\n", 1)[0]
+    for part in first_line.split("·"):
+        part = clean_text(part)
+        if part and not PHONE_RE.match(part) and not NOT_ADDRESS_RE.search(part) and not part.startswith('"'):
+            return part
+    return None
+
+
+def new_venue(item_type: str, **fields) -> Dict[str, Any]:
+    """A place that may host classes or socials; not an event, since nothing dates it"""
+    venue = {"venue_name": None, "address": None, "dance_style": None, "experience_level": None, "url": None}
+    venue.update(fields)
+    venue.update(extraction="rules", item_type=item_type)
+    return venue
+
+
+def extract_place(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """local_pack / maps_search: a studio or venue that runs classes or socials"""
+    title = clean_text(item.get("title"))
+    if item.get("type") == "maps_search":
+        address = clean_text(item.get("address")) or None
+        categories = [item.get("category")] + list(item.get("additional_categories") or [])
+        context = " ".join(clean_text(category) for category in categories if category)
+    else:
+        address = local_pack_address(item.get("description"))
+        context = clean_text(item.get("description"))
+    is_dance = bool(DANCE_KEYWORD_RE.search(title) or DANCE_KEYWORD_RE.search(context))
+    venue = new_venue(
+        item.get("type"), venue_name=title or None, address=address, url=item.get("url"),
+        dance_style=dance_styles(title, context), experience_level=experience_level(title, context),
+    )
+    # Non-dance places fall below MIN_CONFIDENCE and go to the LLM
+    venue["confidence"] = score((bool(title), 0.3), (bool(address), 0.15), (is_dance, 0.3), (bool(item.get("url")), 0.05))
+    return [venue]
+
+
+EVENT_EXTRACTORS = {
+    "event_item": extract_event_item,
+    "events": extract_events_carousel,
+}
+VENUE_EXTRACTORS = {
+    "local_pack": extract_place,
+    "maps_search": extract_place,
+}
+
+
+def extract_item(item: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Rule-extracted events (each with a confidence) for one SERP item; [] for item types without event rules"""
+    extractor = EVENT_EXTRACTORS.get(item.get("type"))
+    return extractor(item) if extractor else []
+
+
+def route_serp_items(items, min_confidence: float = MIN_CONFIDENCE) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, int]]:
+    """
+    Split SERP items between the rules and the LLM.
+
+    Structured items whose events (or venue) all reach min_confidence are
+    answered by the rules; a structured item with anything below it goes to
+    the LLM whole, as do LLM_ITEM_TYPES items. Other item types are skipped.
+
+    Returns:
+        (rule events, venues, items for the LLM, counts)
+    """
+    rule_events, venues, llm_items = [], [], []
+    counts = {"items": 0, "rule_items": 0, "rule_events": 0, "venues": 0, "llm_items": 0, "skipped_items": 0}
+    for item in items:
+        counts["items"] += 1
+        extractor = VENUE_EXTRACTORS.get(item.get("type"))
+        found = extractor(item) if extractor else extract_item(item)
+        if found and all(record["confidence"] >= min_confidence for record in found):
+            (venues if extractor else rule_events).extend(found)
+            counts["rule_items"] += 1
+            counts["venues" if extractor else "rule_events"] += len(found)
+        elif item.get("type") in RULE_ITEM_TYPES or item.get("type") in LLM_ITEM_TYPES:
+            llm_items.append(item)
+            counts["llm_items"] += 1
+        else:
+            counts["skipped_items"] += 1
+    return rule_events, venues, llm_items, counts
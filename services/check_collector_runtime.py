@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+check_collector_runtime.py
+
+Runs collect_metro against a fake paged source (no HTTP, no database) and
+checks what it hands to the checkpoint and high-water mark hooks:
+- an incremental run that reaches every page advances the metro's mark;
+- an incremental run cut off at max_pages keeps the old mark, since the pages
+  it did not fetch may hold older changes;
+- a geo tile is skipped only when every one of its metros is fresh, resumes
+  only from a cursor all of its metros agree on, asks for changes since its
+  oldest mark, and checkpoints and marks every metro, not just the first.
+
+    python services/check_collector_runtime.py
+"""
+
+import sys
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import collector_runtime
+from collector_runtime import CheckpointHook, CollectorSource, RateLimiter, WatermarkHook, collect_metro
+from geo_tiling import MetroBox, QueryTile
+
+Metro = namedtuple("Metro", ["geonameid", "name", "latitude", "longitude"])
+OLD_MARK = "2025-01-01T00:00:00Z"
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    """Answers build_request's fake URLs: page n of a metro holds one event changed on day n + 1."""
+
+    def request(self, method, url, params=None, json=None, headers=None, timeout=None):
+        pages, page = params["pages"], params["page"]
+        events = [{"id": f"{params['metro']}-{page}", "changed": f"2025-02-{page + 1:02d}T00:00:00Z"}]
+        return FakeResponse({"events": events, "next": page + 1 if page + 1 < pages else None})
+
+
+class FakeSource(CollectorSource):
+    name = "fake"
+    rate_per_second = 1000
+    max_pages = 3
+    supports_since = True
+
+    def __init__(self, pages):
+        self.pages = pages  # geonameid -> pages the API has for it
+        self.requests = []  # (cursor, since) of every request built
+
+    def build_request(self, metro, cursor, since=None):
+        self.requests.append((cursor, since))
+        return {"url": "fake://events",
+                "params": {"metro": metro.geonameid, "pages": self.pages[metro.geonameid], "page": cursor or 0}}
+
+    def extract(self, data, metro):
+        return [(event["id"], event) for event in data["events"]], data["next"]
+
+    def item_watermark(self, payload):
+        return payload["changed"]
+
+
+class MemoryCheckpoints(CheckpointHook):
+    def __init__(self, saved=None):
+        self.saved = dict(saved or {})  # geonameid -> (cursor, page), or None when fresh
+        self.pages = {}
+        self.done = set()
+
+    def start_position(self, source_name, metro_id):
+        return self.saved.get(metro_id, (None, 0))
+
+    def page_done(self, source_name, metro_id, next_cursor, page):
+        self.pages[metro_id] = page
+
+    def metro_done(self, source_name, metro_id):
+        self.done.add(metro_id)
+
+
+class MemoryWatermarks(WatermarkHook):
+    def __init__(self, marks):
+        self.marks = dict(marks)
+
+    def since(self, source_name, metro_id):
+        return self.marks.get(metro_id)
+
+    def metro_done(self, source_name, metro_id, high_water, full_sweep):
+        self.marks[metro_id] = high_water
+
+
+def make_tile(*geonameids):
+    metros = tuple(MetroBox(geonameid, f"metro{geonameid}", 0.0, 0.0, -1.0, 1.0, -1.0, 1.0) for geonameid in geonameids)
+    return QueryTile(geonameids[0], f"metro{geonameids[0]} +{len(geonameids) - 1}", 0.0, 0.0, "tile", metros)
+
+
+def run(source, query, checkpoint, watermarks):
+    written = []
+    collector_runtime.write_page = lambda source, metro, items, db_pool, update_changed=False: \
+        written.extend(item[0] for item in items) or len(items)
+    with ThreadPoolExecutor(max_workers=2) as fetch_pool:
+        collect_metro(source, query, RateLimiter(source.rate_per_second), fetch_pool, None, checkpoint, watermarks)
+    return written
+
+
+def check(name, ok, detail):
+    print(f"{'ok' if ok else 'FAIL':4} {name}: {detail}")
+    return ok
+
+
+def main():
+    collector_runtime._get_session = FakeSession
+    results = []
+
+    metro = Metro(1, "Short", 0.0, 0.0)
+    checkpoint, watermarks = MemoryCheckpoints(), MemoryWatermarks({1: OLD_MARK})
+    written = run(FakeSource({1: 2}), metro, checkpoint, watermarks)
+    results.append(check("all pages fetched", watermarks.marks[1] == "2025-02-02T00:00:00Z" and 1 in checkpoint.done,
+                         f"{len(written)} events, mark {OLD_MARK} -> {watermarks.marks[1]}"))
+
+    metro = Metro(2, "Long", 0.0, 0.0)
+    checkpoint, watermarks = MemoryCheckpoints(), MemoryWatermarks({2: OLD_MARK})
+    written = run(FakeSource({2: 5}), metro, checkpoint, watermarks)
+    results.append(check("cut off at max_pages", watermarks.marks[2] == OLD_MARK and len(written) == 3,
+                         f"{len(written)} of 5 pages' events, mark {OLD_MARK} -> {watermarks.marks[2]}"))
+
+    # Metro 10 was completed recently by a non-tiled run; 11 and 12 were never collected
+    tile = make_tile(10, 11, 12)
+    checkpoint = MemoryCheckpoints({10: None})
+    written = run(FakeSource({10: 2}), tile, checkpoint, None)
+    results.append(check("tile with fresh first metro", len(written) == 2 and checkpoint.done == {10, 11, 12},
+                         f"{len(written)} events, checkpointed {sorted(checkpoint.done)}"))
+
+    checkpoint = MemoryCheckpoints({10: None, 11: None, 12: None})
+    written = run(FakeSource({10: 2}), tile, checkpoint, None)
+    results.append(check("tile with every metro fresh", not written and not checkpoint.done,
+                         f"{len(written)} events, skipped"))
+
+    # Only metro 10 has a saved cursor (the old per-tile checkpoint): the other metros need the first page
+    source = FakeSource({10: 2})
+    checkpoint = MemoryCheckpoints({10: (1, 1)})
+    run(source, tile, checkpoint, None)
+    results.append(check("tile resume without agreement", source.requests[0][0] is None,
+                         f"first request at cursor {source.requests[0][0]}"))
+
+    source = FakeSource({10: 2})
+    checkpoint = MemoryCheckpoints({10: (1, 1), 11: (1, 1), 12: (1, 1)})
+    run(source, tile, checkpoint, None)
+    results.append(check("tile resume with agreement", source.requests[0][0] == 1 and checkpoint.pages[12] == 2,
+                         f"first request at cursor {source.requests[0][0]}"))
+
+    source = FakeSource({10: 2})
+    watermarks = MemoryWatermarks({10: "2025-01-20T00:00:00Z", 11: OLD_MARK, 12: "2025-01-10T00:00:00Z"})
+    run(source, tile, MemoryCheckpoints(), watermarks)
+    new_marks = {watermarks.marks[metro_id] for metro_id in (10, 11, 12)}
+    results.append(check("tile marks", source.requests[0][1] == OLD_MARK and new_marks == {"2025-02-02T00:00:00Z"},
+                         f"since {source.requests[0][1]}, new marks {sorted(new_marks)}"))
+
+    source = FakeSource({10: 2})
+    watermarks = MemoryWatermarks({10: "2025-01-20T00:00:00Z"})
+    run(source, tile, MemoryCheckpoints(), watermarks)
+    results.append(check("tile with an unmarked metro", source.requests[0][1] is None and 12 in watermarks.marks,
+                         f"since {source.requests[0][1]} (full sweep)"))
+
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
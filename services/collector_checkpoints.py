@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+collector_checkpoints.py
+
+Postgres-backed per-metro checkpoints for the API collectors. Progress is
+buffered in memory and written in bulk, so a crashed sweep can resume at the
+metro and page where it stopped instead of re-paying every request. The same
+module keeps the per-metro high-water marks used by incremental runs.
+"""
+
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from collector_runtime import CheckpointHook, WatermarkHook, get_db_connection
+
+FLUSH_EVERY_UPDATES = 50
+FLUSH_EVERY_SECONDS = 30
+DEFAULT_RESUME_FRESH_HOURS = 24
+DEFAULT_FULL_SWEEP_HOURS = 168  # Weekly full reconciliation for incremental runs
+
+
+def setup_checkpoint_table(conn):
+    """Creates the collector_checkpoints table if it doesn't exist."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS collector_checkpoints (
+                    source TEXT NOT NULL,
+                    metro_id INTEGER NOT NULL,
+                    last_cursor TEXT,
+                    pages_done INTEGER NOT NULL DEFAULT 0,
+                    completed_at TIMESTAMPTZ,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (source, metro_id)
+                );
+            """)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"Error setting up collector_checkpoints table: {e}")
+        conn.rollback()
+        return False
+
+
+class PostgresCheckpointStore(CheckpointHook):
+    """
+    Checkpoint hook backed by collector_checkpoints.
+
+    Args:
+        database_url: Connection string; the store uses its own connection.
+        resume: Continue partially collected metros from their saved cursor.
+        fresh_hours: Skip metros completed within this many hours (0 = never skip).
+    """
+
+    def __init__(self, database_url, resume=False, fresh_hours=0):
+        self.conn = get_db_connection(database_url)
+        self.resume = resume
+        self.fresh_cutoff = datetime.now(timezone.utc) - timedelta(hours=fresh_hours) if fresh_hours else None
+        self.lock = threading.Lock()
+        self.pending = {}  # (source, metro_id) -> (last_cursor_json, pages_done, completed_at)
+        self.pages_done = {}  # (source, metro_id) -> pages written this run
+        self.last_flush = time.monotonic()
+        self.saved = {}
+        self.loaded_sources = set()
+        if self.conn:
+            setup_checkpoint_table(self.conn)
+
+    def _load(self, source_name):
+        """Reads every checkpoint for a source in one query."""
+        self.loaded_sources.add(source_name)
+        if not self.conn:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT metro_id, last_cursor, pages_done, completed_at FROM collector_checkpoints WHERE source = %s",
+                    (source_name,),
+                )
+                for metro_id, last_cursor, pages_done, completed_at in cur.fetchall():
+                    self.saved[(source_name, metro_id)] = (last_cursor, pages_done, completed_at)
+            self.conn.commit()
+            logging.info(f"Loaded {sum(1 for key in self.saved if key[0] == source_name)} checkpoint(s) for {source_name}.")
+        except psycopg2.Error as e:
+            logging.error(f"Error loading checkpoints for {source_name}: {e}")
+            self.conn.rollback()
+
+    def start_position(self, source_name, metro_id):
+        with self.lock:
+            if source_name not in self.loaded_sources:
+                self._load(source_name)
+            saved = self.saved.get((source_name, metro_id))
+        if not saved:
+            return (None, 0)
+        last_cursor, pages_done, completed_at = saved
+        if completed_at is not None:
+            if self.fresh_cutoff and completed_at >= self.fresh_cutoff:
+                return None
+            return (None, 0)
+        if self.resume and last_cursor is not None:
+            return (json.loads(last_cursor), pages_done)
+        return (None, 0)
+
+    def page_done(self, source_name, metro_id, next_cursor, page):
+        cursor_json = json.dumps(next_cursor) if next_cursor is not None else None
+        with self.lock:
+            self.pages_done[(source_name, metro_id)] = page
+        self._record(source_name, metro_id, (cursor_json, page, None))
+
+    def metro_done(self, source_name, metro_id):
+        with self.lock:
+            pages_done = self.pages_done.pop((source_name, metro_id), 0)
+        self._record(source_name, metro_id, (None, pages_done, datetime.now(timezone.utc)))
+
+    def _record(self, source_name, metro_id, state):
+        with self.lock:
+            self.pending[(source_name, metro_id)] = state
+            due = (len(self.pending) >= FLUSH_EVERY_UPDATES
+                   or time.monotonic() - self.last_flush >= FLUSH_EVERY_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered checkpoint updates in one upsert."""
+        with self.lock:
+            if not self.pending or not self.conn:
+                self.pending.clear()
+                return
+            rows = [(source, metro_id, cursor, pages, completed_at)
+                    for (source, metro_id), (cursor, pages, completed_at) in self.pending.items()]
+            self.pending.clear()
+            self.last_flush = time.monotonic()
+            try:
+                with self.conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO collector_checkpoints (source, metro_id, last_cursor, pages_done, completed_at, updated_at)
+                        VALUES %s
+                        ON CONFLICT (source, metro_id) DO UPDATE SET
+                            last_cursor = EXCLUDED.last_cursor,
+                            pages_done = EXCLUDED.pages_done,
+                            completed_at = EXCLUDED.completed_at,
+                            updated_at = NOW();
+                    """, rows, template="(%s, %s, %s, %s, %s, NOW())")
+                self.conn.commit()
+                logging.debug(f"Flushed {len(rows)} collector checkpoint(s).")
+            except psycopg2.Error as e:
+                logging.error(f"Error writing {len(rows)} collector checkpoint(s): {e}")
+                self.conn.rollback()
+
+    def close(self):
+        self.flush()
+        if self.conn:
+            self.conn.close()
+
+
+def setup_watermark_table(conn):
+    """Creates the collector_watermarks table if it doesn't exist."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS collector_watermarks (
+                    source TEXT NOT NULL,
+                    metro_id INTEGER NOT NULL,
+                    high_water TEXT,
+                    last_full_sweep_at TIMESTAMPTZ,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (source, metro_id)
+                );
+            """)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"Error setting up collector_watermarks table: {e}")
+        conn.rollback()
+        return False
+
+
+class PostgresWatermarkStore(WatermarkHook):
+    """
+    High-water marks backed by collector_watermarks. A metro is swept in full
+    when it has no mark yet or its last full sweep is older than
+    full_sweep_hours, so deletions and edits the changed-since filter cannot
+    see are reconciled at a lower cadence.
+    """
+
+    def __init__(self, database_url, full_sweep_hours=DEFAULT_FULL_SWEEP_HOURS):
+        self.conn = get_db_connection(database_url)
+        self.full_sweep_cutoff = datetime.now(timezone.utc) - timedelta(hours=full_sweep_hours)
+        self.lock = threading.Lock()
+        self.saved = {}  # (source, metro_id) -> (high_water, last_full_sweep_at)
+        self.pending = {}
+        self.loaded_sources = set()
+        if self.conn:
+            setup_watermark_table(self.conn)
+
+    def _load(self, source_name):
+        self.loaded_sources.add(source_name)
+        if not self.conn:
+            return
+        try:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "SELECT metro_id, high_water, last_full_sweep_at FROM collector_watermarks WHERE source = %s",
+                    (source_name,),
+                )
+                for metro_id, high_water, last_full_sweep_at in cur.fetchall():
+                    self.saved[(source_name, metro_id)] = (high_water, last_full_sweep_at)
+            self.conn.commit()
+        except psycopg2.Error as e:
+            logging.error(f"Error loading watermarks for {source_name}: {e}")
+            self.conn.rollback()
+
+    def since(self, source_name, metro_id):
+        with self.lock:
+            if source_name not in self.loaded_sources:
+                self._load(source_name)
+            high_water, last_full_sweep_at = self.saved.get((source_name, metro_id), (None, None))
+        if high_water is None or last_full_sweep_at is None or last_full_sweep_at < self.full_sweep_cutoff:
+            return None
+        return high_water
+
+    def metro_done(self, source_name, metro_id, high_water, full_sweep):
+        key = (source_name, metro_id)
+        with self.lock:
+            _, last_full_sweep_at = self.saved.get(key, (None, None))
+            if full_sweep:
+                last_full_sweep_at = datetime.now(timezone.utc)
+            self.saved[key] = self.pending[key] = (high_water, last_full_sweep_at)
+            due = len(self.pending) >= FLUSH_EVERY_UPDATES
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Writes all buffered marks in one upsert."""
+        with self.lock:
+            if not self.pending or not self.conn:
+                self.pending.clear()
+                return
+            rows = [(source, metro_id, high_water, last_full_sweep_at)
+                    for (source, metro_id), (high_water, last_full_sweep_at) in self.pending.items()]
+            self.pending.clear()
+            try:
+                with self.conn.cursor() as cur:
+                    execute_values(cur, """
+                        INSERT INTO collector_watermarks (source, metro_id, high_water, last_full_sweep_at, updated_at)
+                        VALUES %s
+                        ON CONFLICT (source, metro_id) DO UPDATE SET
+                            high_water = EXCLUDED.high_water,
+                            last_full_sweep_at = EXCLUDED.last_full_sweep_at,
+                            updated_at = NOW();
+                    """, rows, template="(%s, %s, %s, %s, NOW())")
+                self.conn.commit()
+            except psycopg2.Error as e:
+                logging.error(f"Error writing {len(rows)} collector watermark(s): {e}")
+                self.conn.rollback()
+
+    def close(self):
+        self.flush()
+        if self.conn:
+            self.conn.close()
+
+
+def parse_checkpoint_args(description):
+    """Command line flags shared by the collectors."""
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue partially collected metros from their saved cursor and skip "
+                             f"metros completed recently (default window {DEFAULT_RESUME_FRESH_HOURS}h)")
+    parser.add_argument("--fresh-hours", type=float, default=None,
+                        help="Skip metros completed within this many hours")
+    parser.add_argument("--geo-tiles", action="store_true",
+                        help="Collapse overlapping metro radius queries into shared query circles. "
+                             "Checkpoints and high-water marks are still kept for every metro of a tile")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only request events changed since each metro's high-water mark, where the API supports it")
+    parser.add_argument("--full-sweep-hours", type=float, default=DEFAULT_FULL_SWEEP_HOURS,
+                        help="With --incremental, sweep a metro in full when its last full sweep is older than this")
+    args = parser.parse_args()
+    if args.fresh_hours is None:
+        args.fresh_hours = DEFAULT_RESUME_FRESH_HOURS if args.resume else 0
+    return args
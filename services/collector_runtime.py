@@ -0,0 +1,552 @@
+#!/usr/bin/env python3
+"""
+collector_runtime.py
+
+Shared runtime for the per-source event collectors (Ticketmaster, Eventbrite,
+Meetup). A source only describes how to build the request for a metro/page
+and how to pull items and the next cursor out of a response. The runtime
+supplies pooled HTTP sessions, a per-source rate limiter, concurrent metros
+with next-page prefetch, one bulk insert per page, and checkpoint hooks.
+Sources that declare a search radius can optionally be swept over geo tiles
+(see geo_tiling.py) instead of one query per metro, and sources with a
+server-side "changed since" filter can run incrementally from a per-metro
+high-water mark.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import execute_values
+
+from metro_catalog import load_metro_catalog, iter_metros
+from geo_tiling import QueryTile, plan_query_tiles, assign_metro
+from event_dedup import dedup_key, setup_dedup_columns
+
+DB_TABLE = "event_raw"
+DEFAULT_METRO_CSV = "geonames_na_sa_eu_top1785.csv"
+CONTAINER_METRO_CSV = "/app/geonames_na_sa_eu_top1785.csv"
+METRO_COLUMNS = ['geonameid', 'name', 'latitude', 'longitude']
+REQUEST_TIMEOUT = 30
+
+
+class CollectorSource:
+    """
+    Base class for a collector source plugin.
+
+    Subclasses set name (the event_raw.source value) and the rate settings,
+    and implement build_request and extract. metro is a named tuple with
+    geonameid, name, latitude and longitude (a QueryTile in geo-tiled runs).
+    Sources that set search_radius_km and implement item_location can be
+    geo-tiled; sources that set supports_since and implement item_watermark
+    can be collected incrementally. Sources that batch several metros/tiles
+    into one query implement batch_members; those are checkpointed per member.
+    """
+
+    name = None
+    rate_per_second = 1.0
+    daily_quota = 0  # 0 = no daily cap
+    max_pages = 5
+    search_radius_km = None  # None = always query per metro
+    supports_since = False  # True when build_request can filter on a high-water mark
+
+    def build_request(self, metro, cursor, since=None):
+        """
+        Returns the request for one page as a dict with method, url and any of
+        params, json and headers. cursor is None for the first page. since is
+        the metro's high-water mark in incremental runs (None = full sweep).
+        """
+        raise NotImplementedError
+
+    def extract(self, data, metro):
+        """
+        Parses one decoded response. Returns (items, next_cursor) where items
+        is a list of (source_event_id, payload) and next_cursor is None when
+        there are no more pages. Sources that batch several metros into one
+        request return (source_event_id, payload, member) instead, where
+        member is the metro or tile the item was found for.
+        """
+        raise NotImplementedError
+
+    def group_queries(self, queries):
+        """Lets a source combine several metros/tiles into one batched query. Default: one per query."""
+        return queries
+
+    def batch_members(self, query):
+        """
+        The metros/tiles of a batched query from group_queries, or None for a
+        single metro/tile. For batches, the cursor passed to build_request and
+        returned by extract maps member index -> that member's cursor (None =
+        first page), and only the members in it are requested.
+        """
+        return None
+
+    def item_location(self, payload):
+        """Returns (latitude, longitude) of an extracted item, or (None, None) if unknown."""
+        return None, None
+
+    def item_watermark(self, payload):
+        """Returns the item's changed/created marker (ISO-8601 UTC string), or None."""
+        return None
+
+
+class RateLimiter:
+    """
+    Process-wide limiter shared by all threads of one source. Spaces requests
+    to stay under the per-second rate and refuses once the daily quota
+    (UTC day) is spent.
+    """
+
+    def __init__(self, per_second, daily_quota=0):
+        self.interval = 1.0 / per_second if per_second > 0 else 0.0
+        self.daily_quota = daily_quota
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.day = datetime.now(timezone.utc).date()
+        self.used_today = 0
+
+    def acquire(self):
+        """Blocks until a request may be sent. Returns False when the daily quota is exhausted."""
+        with self.lock:
+            today = datetime.now(timezone.utc).date()
+            if today != self.day:
+                self.day, self.used_today = today, 0
+            if self.daily_quota and self.used_today >= self.daily_quota:
+                return False
+            self.used_today += 1
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+        return True
+
+
+class CheckpointHook:
+    """
+    No-op checkpoint interface. The runtime asks where to start each metro and
+    reports progress after every written page and completed metro.
+    """
+
+    def start_position(self, source_name, metro_id):
+        """Returns (cursor, page) to resume from, or None to skip the metro entirely."""
+        return (None, 0)
+
+    def page_done(self, source_name, metro_id, next_cursor, page):
+        pass
+
+    def metro_done(self, source_name, metro_id):
+        pass
+
+    def flush(self):
+        pass
+
+
+class WatermarkHook:
+    """
+    No-op high-water mark interface for incremental runs. since returns None
+    when a metro needs a full sweep (no mark yet, or reconciliation is due).
+    """
+
+    def since(self, source_name, metro_id):
+        return None
+
+    def metro_done(self, source_name, metro_id, high_water, full_sweep):
+        pass
+
+    def flush(self):
+        pass
+
+
+# --- Database ---
+
+def get_db_connection(database_url=None):
+    """Establishes a connection to the PostgreSQL database."""
+    try:
+        conn = psycopg2.connect(database_url or os.getenv("DATABASE_URL"))
+        logging.info("Database connection established.")
+        return conn
+    except psycopg2.Error as e:
+        logging.error(f"Database connection error: {e}")
+        return None
+
+
+def bulk_insert_raw_events(conn, source, rows, update_changed=False):
+    """
+    Writes a page of events in one transaction.
+    rows: list of (source_id, event_data, metro_id). Returns the number of new
+    rows, or None when the write failed and was rolled back (the caller must
+    not checkpoint the page).
+    With update_changed, existing events whose payload differs are overwritten
+    and queued for re-parsing (incremental runs exist to pick up those edits).
+    """
+    if not rows:
+        return 0
+    values, seen_ids, seen_hashes = [], set(), set()
+    for source_id, event_data, metro_id in rows:
+        source_id = str(source_id)  # source_event_id is text; RETURNING gives it back as str
+        canonical_url, url_hash = dedup_key(event_data)
+        # Two rows for one ID or one URL in a single statement would trip the unique indexes
+        if source_id in seen_ids or (url_hash and url_hash in seen_hashes):
+            continue
+        seen_ids.add(source_id)
+        if url_hash:
+            seen_hashes.add(url_hash)
+        values.append((source, source_id, json.dumps(event_data), metro_id, canonical_url, url_hash))
+    try:
+        with conn.cursor() as cur:
+            # No conflict target: skips duplicates on either (source, source_event_id) or (source, url_hash)
+            inserted_ids = {source_id for (source_id,) in execute_values(cur, f"""
+                INSERT INTO {DB_TABLE} (source, source_event_id, raw_json, metro_id, canonical_url, url_hash, discovered_at)
+                VALUES %s
+                ON CONFLICT DO NOTHING
+                RETURNING source_event_id;
+                """, values, template="(%s, %s, %s, %s, %s, %s, NOW())", fetch=True)}
+            changed = [(source, source_id, raw_json, canonical_url, url_hash)
+                       for _, source_id, raw_json, _, canonical_url, url_hash in values if source_id not in inserted_ids]
+            updated = 0
+            if update_changed and changed:
+                # A changed event whose URL now belongs to another ID is a URL duplicate: left as is,
+                # since moving its url_hash would violate the (source, url_hash) index
+                updated = len(execute_values(cur, f"""
+                    UPDATE {DB_TABLE} AS r
+                    SET raw_json = v.raw_json::jsonb, canonical_url = v.canonical_url, url_hash = v.url_hash,
+                        parsed_at = NULL, normalization_status = 'pending'
+                    FROM (VALUES %s) AS v (source, source_event_id, raw_json, canonical_url, url_hash)
+                    WHERE r.source = v.source AND r.source_event_id = v.source_event_id
+                      AND r.raw_json IS DISTINCT FROM v.raw_json::jsonb
+                      AND NOT EXISTS (
+                          SELECT 1 FROM {DB_TABLE} AS o
+                          WHERE o.source = r.source AND o.url_hash = v.url_hash AND o.source_event_id <> r.source_event_id
+                      )
+                    RETURNING r.id;
+                    """, changed, fetch=True))
+        conn.commit()
+        if updated:
+            logging.info(f"Updated {updated} changed {source} events.")
+        return len(inserted_ids)
+    except psycopg2.Error as e:
+        logging.error(f"Bulk insert error for {len(rows)} {source} events: {e}")
+        conn.rollback()
+        return None
+
+
+# --- Metros ---
+
+def resolve_metro_csv_path(script_file, filename=DEFAULT_METRO_CSV):
+    """Finds the metro CSV in the working directory, next to services/, or at the container path."""
+    candidates = [
+        filename,
+        os.path.join(os.path.dirname(os.path.abspath(script_file)), '..', filename),
+        CONTAINER_METRO_CSV,
+    ]
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    logging.error(f"Cannot find metro data CSV at expected paths: {candidates}")
+    return None
+
+
+def load_collector_metros(csv_path):
+    """Loads the metro catalog and checks the columns every collector needs."""
+    metros_df = load_metro_catalog(csv_path)
+    if metros_df.empty or not set(METRO_COLUMNS).issubset(metros_df.columns):
+        logging.error(f"Could not load metros with required columns from '{csv_path}'.")
+        return None
+    logging.info(f"Loaded {len(metros_df)} metros from {csv_path}")
+    return metros_df
+
+
+# --- HTTP ---
+
+_thread_local = threading.local()
+
+
+def _get_session():
+    """One pooled requests.Session per thread."""
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def fetch_page(source, metro, cursor, page, rate_limiter, since=None):
+    """
+    Fetches and extracts one page. Returns (items, next_cursor), or None when
+    the request failed or the daily quota is exhausted.
+    """
+    if not rate_limiter.acquire():
+        logging.warning(f"{source.name} daily quota of {rate_limiter.daily_quota} reached. "
+                        f"Skipping page {page} for metro {metro.geonameid}.")
+        return None
+    request = source.build_request(metro, cursor, since)
+    try:
+        response = _get_session().request(
+            request.get("method", "GET"),
+            request["url"],
+            params=request.get("params"),
+            json=request.get("json"),
+            headers=request.get("headers"),
+            timeout=REQUEST_TIMEOUT,
+        )
+        if response.status_code == 429:
+            logging.warning(f"{source.name} rate limited (429) on page {page} for metro {metro.geonameid}.")
+            return None
+        response.raise_for_status()
+        return source.extract(response.json(), metro)
+    except requests.exceptions.RequestException as e:
+        logging.error(f"{source.name} API request failed (page {page}, metro {metro.geonameid}): {e}")
+        if getattr(e, 'response', None) is not None:
+            logging.error(f"Response status: {e.response.status_code}, Response text: {e.response.text[:200]}")
+        return None
+    except ValueError as e:
+        logging.error(f"Error processing {source.name} response (page {page}, metro {metro.geonameid}): {e}")
+        return None
+
+
+# --- Collection ---
+
+def _metro_id_for(source, metro, payload):
+    """Tile results go to the metro whose bbox holds the event; per-metro results keep their metro."""
+    if isinstance(metro, QueryTile):
+        return assign_metro(metro, *source.item_location(payload))
+    return metro.geonameid
+
+
+def write_page(source, metro, items, db_pool, update_changed=False):
+    """Inserts one page of extracted items. Returns the number of new rows, or None when the write failed."""
+    rows = [(item[0], item[1], _metro_id_for(source, item[2] if len(item) > 2 else metro, item[1]))
+            for item in items if item[0]]
+    if len(rows) < len(items):
+        logging.warning(f"Skipped {len(items) - len(rows)} {source.name} events without ID for metro {metro.geonameid}.")
+    if not rows:
+        return 0
+    conn = db_pool.getconn()
+    try:
+        return bulk_insert_raw_events(conn, source.name, rows, update_changed=update_changed)
+    finally:
+        db_pool.putconn(conn)
+
+
+def query_metro_ids(query):
+    """Metros whose checkpoints and high-water marks a query keeps: every metro of a geo tile, else its own."""
+    if isinstance(query, QueryTile):
+        return [box.geonameid for box in query.metros]
+    return [query.geonameid]
+
+
+def query_start_position(checkpoint, source_name, query):
+    """
+    Where to start a query from its metros' checkpoints: None when every metro
+    is fresh, the saved (cursor, page) when the metros still due agree on it
+    (they were last collected by the same tile), else the first page.
+    """
+    positions = [checkpoint.start_position(source_name, metro_id) for metro_id in query_metro_ids(query)]
+    due = [position for position in positions if position is not None]
+    if not due:
+        return None
+    return due[0] if all(position == due[0] for position in due) else (None, 0)
+
+
+def query_since(watermarks, source_name, query):
+    """Oldest high-water mark of the query's metros, or None (full sweep) when any of them needs one."""
+    marks = [watermarks.since(source_name, metro_id) for metro_id in query_metro_ids(query)]
+    return None if None in marks else min(marks)
+
+
+def collect_batch(source, batch, members, rate_limiter, fetch_pool, db_pool, checkpoint):
+    """
+    Collects a batched query. Checkpoints are kept per member (per metro for
+    geo tiles), so each member resumes from its own cursor or is skipped when
+    fresh no matter which batch it lands in; a member is done once it has no
+    next page or reaches max_pages, and later requests only carry the members
+    still paging. Batches run as full sweeps.
+    Returns (events_processed, events_inserted).
+    """
+    cursors, pages = {}, {}
+    for index, member in enumerate(members):
+        start = query_start_position(checkpoint, source.name, member)
+        if start is None:
+            logging.info(f"Skipping {source.name} metro {member.name} ({member.geonameid}): checkpoint is fresh.")
+            continue
+        cursor, page = start
+        if isinstance(cursor, dict):
+            # Checkpoint from when batches were checkpointed as a whole on their first member: start over
+            cursor, page = None, 0
+        cursors[index], pages[index] = cursor, page
+    if not cursors:
+        return 0, 0
+    processed = inserted = 0
+    pending = fetch_pool.submit(fetch_page, source, batch, cursors, min(pages.values()), rate_limiter)
+
+    while pending is not None:
+        result = pending.result()
+        if result is None:
+            # Failed page: leave every member's checkpoint where it was so a resume retries it
+            return processed, inserted
+        items, next_cursors = result
+        next_cursors = next_cursors or {}
+        following = {index: next_cursors[index] for index in cursors
+                     if next_cursors.get(index) is not None and pages[index] + 1 < source.max_pages}
+        pending = None
+        if items and following:
+            pending = fetch_pool.submit(fetch_page, source, batch, following,
+                                        min(pages[index] for index in following) + 1, rate_limiter)
+
+        written = write_page(source, batch, items, db_pool)
+        if written is None:
+            # Unwritten page: no member is checkpointed past it
+            return processed, inserted
+        inserted += written
+        processed += len(items)
+        logging.info(f"Fetched {len(items)} {source.name} events for {len(cursors)} members of {batch.name}.")
+        for index in cursors:
+            pages[index] += 1
+            for metro_id in query_metro_ids(members[index]):
+                checkpoint.page_done(source.name, metro_id, following.get(index), pages[index])
+                if index not in following or pending is None:
+                    checkpoint.metro_done(source.name, metro_id)
+        cursors = following if pending is not None else {}
+    return processed, inserted
+
+
+def collect_metro(source, metro, rate_limiter, fetch_pool, db_pool, checkpoint, watermarks=None):
+    """
+    Collects all pages for one metro. The next page is fetched on fetch_pool
+    while the current page is being written, and each page is one bulk insert.
+    With watermarks, only items changed since the metro's high-water mark are
+    requested and the mark advances once every page has been written; a run
+    cut off at max_pages keeps the old mark, since the pages it did not fetch
+    may hold older changes. A geo tile reads and writes the checkpoint and
+    mark of each of its metros, and asks for changes since the oldest mark.
+    Batched queries are handed to collect_batch.
+    Returns (events_processed, events_inserted).
+    """
+    members = source.batch_members(metro)
+    if members is not None:
+        return collect_batch(source, metro, members, rate_limiter, fetch_pool, db_pool, checkpoint)
+    metro_ids = query_metro_ids(metro)
+    start = query_start_position(checkpoint, source.name, metro)
+    if start is None:
+        logging.info(f"Skipping {source.name} metro {metro.name} ({metro.geonameid}): checkpoint is fresh.")
+        return 0, 0
+    cursor, page = start
+    incremental = watermarks is not None and source.supports_since
+    since = query_since(watermarks, source.name, metro) if incremental else None
+    high_water = since
+    processed = inserted = 0
+    truncated = False
+    pending = fetch_pool.submit(fetch_page, source, metro, cursor, page, rate_limiter, since)
+
+    while pending is not None:
+        result = pending.result()
+        if result is None:
+            # Failed page: leave the checkpoint where it was so a resume retries it
+            return processed, inserted
+        items, next_cursor = result
+        pending = None
+        if items and next_cursor is not None:
+            if page + 1 < source.max_pages:
+                pending = fetch_pool.submit(fetch_page, source, metro, next_cursor, page + 1, rate_limiter, since)
+            else:
+                truncated = True
+
+        written = write_page(source, metro, items, db_pool, update_changed=incremental)
+        if written is None:
+            # Unwritten page: no checkpoint and no high-water mark, so a rerun fetches it again
+            return processed, inserted
+        inserted += written
+        processed += len(items)
+        for item in items:
+            mark = source.item_watermark(item[1])
+            if mark and (high_water is None or mark > high_water):
+                high_water = mark
+        logging.info(f"Fetched {len(items)} {source.name} events from page {page} for {metro.name} ({metro.geonameid}).")
+        for metro_id in metro_ids:
+            checkpoint.page_done(source.name, metro_id, next_cursor, page + 1)
+        page += 1
+
+    for metro_id in metro_ids:
+        checkpoint.metro_done(source.name, metro_id)
+    if incremental and truncated:
+        logging.warning(f"{source.name} metro {metro.name} ({metro.geonameid}) has more than {source.max_pages} pages; "
+                        f"keeping its high-water mark.")
+    elif incremental:
+        for metro_id in metro_ids:
+            watermarks.metro_done(source.name, metro_id, high_water, full_sweep=since is None)
+    return processed, inserted
+
+
+def plan_queries(source, metros_df, geo_tiles=False):
+    """One query per metro, or the geo-tiling plan when requested and the source supports it."""
+    metros = iter_metros(metros_df, METRO_COLUMNS)
+    if not geo_tiles:
+        return list(metros)
+    if not source.search_radius_km:
+        logging.warning(f"{source.name} does not declare a search radius; querying per metro.")
+        return list(metros)
+    return plan_query_tiles(metros, source.search_radius_km)
+
+
+def run_collector(source, metros_df, concurrency=4, database_url=None, checkpoint=None, geo_tiles=False,
+                  watermarks=None):
+    """
+    Runs one source over all metros, concurrency metros at a time, under a
+    single shared rate limiter. With geo_tiles, overlapping metros share one
+    query circle and results are assigned back by point-in-bbox. Passing a
+    WatermarkHook enables incremental collection for sources that support it.
+    Returns (events_processed, events_inserted).
+    """
+    checkpoint = checkpoint or CheckpointHook()
+    concurrency = max(1, concurrency)
+    rate_limiter = RateLimiter(source.rate_per_second, source.daily_quota)
+    db_pool = ThreadedConnectionPool(1, concurrency, database_url or os.getenv("DATABASE_URL"))
+    conn = db_pool.getconn()
+    try:
+        setup_dedup_columns(conn)
+    finally:
+        db_pool.putconn(conn)
+    total_events_processed = 0
+    total_events_inserted = 0
+    completed = 0
+    queries = source.group_queries(plan_queries(source, metros_df, geo_tiles))
+    if watermarks and not source.supports_since:
+        logging.warning(f"{source.name} has no changed-since filter; running a full sweep.")
+
+    logging.info(f"Collecting {source.name} for {len(metros_df)} metros in {len(queries)} queries with {concurrency} workers "
+                 f"({source.rate_per_second}/s, daily quota {source.daily_quota or 'none'}).")
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{source.name}-metro") as metro_pool, \
+             ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix=f"{source.name}-fetch") as fetch_pool:
+            futures = {
+                metro_pool.submit(collect_metro, source, metro, rate_limiter, fetch_pool, db_pool, checkpoint, watermarks): metro
+                for metro in queries
+            }
+            for future in as_completed(futures):
+                metro = futures[future]
+                completed += 1
+                try:
+                    processed, inserted = future.result()
+                except Exception as e:
+                    logging.error(f"Error collecting {source.name} metro {metro.name} ({metro.geonameid}): {e}")
+                    continue
+                total_events_processed += processed
+                total_events_inserted += inserted
+                logging.info(f"Finished {source.name} metro {metro.name} ({metro.geonameid}) ({completed}/{len(futures)}): "
+                             f"{processed} events, {inserted} new. Requests used today: {rate_limiter.used_today}")
+    finally:
+        checkpoint.flush()
+        if watermarks:
+            watermarks.flush()
+        db_pool.closeall()
+
+    logging.info(f"{source.name} collection completed.")
+    logging.info(f"Total events processed: {total_events_processed}")
+    logging.info(f"Total unique events inserted: {total_events_inserted}")
+    return total_events_processed, total_events_inserted
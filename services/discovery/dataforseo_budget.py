@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+dataforseo_budget.py
+
+Credit budget planning and cost accounting for DataForSEO task submissions.
+Projects the spend of a batch before it is posted, trims the batch to fit a
+credit or dollar ceiling, and records the cost DataForSEO actually charged
+for every task in a ledger table.
+"""
+
+import os
+import json
+import math
+import logging
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger(__name__)
+
+# Price per billed SERP page (10 results) in USD, standard queue.
+# Override with DATAFORSEO_PRICES_JSON='{"events/task_post": 0.0006, ...}'
+DEFAULT_ENDPOINT_PRICES_USD = {
+    "events/task_post": 0.0006,
+    "organic/task_post": 0.0006,
+    "events/live/advanced": 0.002,
+    "organic/live/advanced": 0.002,
+}
+RESULTS_PER_BILLED_PAGE = 10
+
+# Ceilings; 0 means no limit
+BUDGET_USD = float(os.getenv("DATAFORSEO_BUDGET_USD", 0))
+BUDGET_CREDITS = int(os.getenv("DATAFORSEO_BUDGET_CREDITS", 0))
+# "trim" drops the lowest-priority tasks to fit, "refuse" submits nothing when over budget
+BUDGET_MODE = os.getenv("DATAFORSEO_BUDGET_MODE", "trim").lower()
+# Smallest depth the planner may fall back to before dropping tasks
+MIN_TASK_DEPTH = int(os.getenv("DATAFORSEO_MIN_DEPTH", 10))
+
+
+def load_endpoint_prices():
+    """Returns the per-endpoint price table, applying any JSON override from the environment."""
+    prices = dict(DEFAULT_ENDPOINT_PRICES_USD)
+    override = os.getenv("DATAFORSEO_PRICES_JSON")
+    if override:
+        try:
+            prices.update({k: float(v) for k, v in json.loads(override).items()})
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.error(f"Ignoring invalid DATAFORSEO_PRICES_JSON ({e}). Using default prices.")
+    return prices
+
+
+def billed_pages_for_depth(depth):
+    """DataForSEO bills each block of 10 results as one SERP page (one credit)."""
+    return max(1, math.ceil(int(depth or RESULTS_PER_BILLED_PAGE) / RESULTS_PER_BILLED_PAGE))
+
+
+class CreditBudget:
+    """
+    Tracks projected and actual DataForSEO spend for one discovery run.
+
+    A credit is one billed SERP page. Either ceiling (credits or USD) may be 0
+    to disable it; a task set must satisfy both.
+    """
+
+    def __init__(self, limit_usd=BUDGET_USD, limit_credits=BUDGET_CREDITS, mode=BUDGET_MODE,
+                 min_depth=MIN_TASK_DEPTH, prices=None):
+        self.limit_usd = limit_usd
+        self.limit_credits = limit_credits
+        self.mode = mode
+        self.min_depth = min_depth
+        self.prices = prices or load_endpoint_prices()
+        self.committed_usd = 0.0
+        self.committed_credits = 0
+        self.actual_usd = 0.0
+        self.plans = []  # One summary dict per planned endpoint batch, used by the report
+
+    def estimate(self, endpoint_key, depth):
+        """Returns (credits, usd) for a single task."""
+        credits = billed_pages_for_depth(depth)
+        price = self.prices.get(endpoint_key)
+        if price is None:
+            logger.warning(f"No price configured for endpoint '{endpoint_key}'. Assuming 0.")
+            price = 0.0
+        return credits, credits * price
+
+    def _fits(self, credits, usd):
+        if self.limit_credits and self.committed_credits + credits > self.limit_credits:
+            return False
+        if self.limit_usd and self.committed_usd + usd > self.limit_usd + 1e-9:
+            return False
+        return True
+
+    def _total(self, endpoint_key, payloads, depth=None):
+        credits, usd = 0, 0.0
+        for payload in payloads:
+            c, u = self.estimate(endpoint_key, depth if depth is not None else payload.get("depth"))
+            credits += c
+            usd += u
+        return credits, usd
+
+    def plan(self, payloads, endpoint_key):
+        """
+        Picks the task set to submit for one endpoint.
+
+        payloads must be ordered by priority; the batch_* builders emit them city
+        by city in metro CSV order (largest population first), then by term. The planner keeps every task
+        at the requested depth if it fits, otherwise lowers depth in steps of 10
+        down to min_depth, and only then drops tasks from the tail. In "refuse"
+        mode nothing is submitted when the full set does not fit.
+
+        Returns the accepted payloads (depth may be rewritten) and reserves their
+        projected cost against the budget.
+        """
+        requested_credits, requested_usd = self._total(endpoint_key, payloads)
+        summary = {
+            "endpoint": endpoint_key,
+            "requested_tasks": len(payloads),
+            "requested_credits": requested_credits,
+            "requested_usd": requested_usd,
+            "depth": None,
+        }
+
+        accepted = list(payloads)
+        if not self._fits(requested_credits, requested_usd):
+            if self.mode == "refuse":
+                logger.error(f"Budget exceeded for {endpoint_key}: {len(payloads)} tasks would cost "
+                             f"{requested_credits} credits / ${requested_usd:.4f}. Refusing to submit.")
+                accepted = []
+            else:
+                accepted = self._trim(payloads, endpoint_key)
+
+        credits, usd = self._total(endpoint_key, accepted)
+        self.committed_credits += credits
+        self.committed_usd += usd
+        summary.update({
+            "accepted_tasks": len(accepted),
+            "accepted_credits": credits,
+            "accepted_usd": usd,
+            "depth": accepted[0].get("depth") if accepted else None,
+        })
+        self.plans.append(summary)
+
+        if len(accepted) < len(payloads):
+            logger.warning(f"Budget planner kept {len(accepted)}/{len(payloads)} {endpoint_key} tasks "
+                           f"({credits} credits / ${usd:.4f}).")
+        return accepted
+
+    def _trim(self, payloads, endpoint_key):
+        requested_depth = max(int(p.get("depth") or RESULTS_PER_BILLED_PAGE) for p in payloads)
+        depth = requested_depth - RESULTS_PER_BILLED_PAGE
+        while depth >= self.min_depth:
+            if self._fits(*self._total(endpoint_key, payloads, depth)):
+                logger.info(f"Lowering {endpoint_key} depth from {requested_depth} to {depth} to fit budget.")
+                return [dict(p, depth=min(int(p.get("depth") or depth), depth)) for p in payloads]
+            depth -= RESULTS_PER_BILLED_PAGE
+
+        # Depth alone is not enough: keep the highest-priority tasks at minimum depth
+        depth = min(self.min_depth, requested_depth)
+        accepted = []
+        credits, usd = 0, 0.0
+        for payload in payloads:
+            task_depth = min(int(payload.get("depth") or depth), depth)
+            c, u = self.estimate(endpoint_key, task_depth)
+            if not self._fits(credits + c, usd + u):
+                break
+            credits += c
+            usd += u
+            accepted.append(dict(payload, depth=task_depth))
+        return accepted
+
+    def record_actual(self, cost):
+        """Adds the cost DataForSEO reported for a submitted task."""
+        if cost:
+            self.actual_usd += float(cost)
+
+    def report(self):
+        """Returns a human-readable projected-spend report for the run."""
+        lines = ["DataForSEO projected spend:"]
+        for plan in self.plans:
+            lines.append(
+                f"  {plan['endpoint']}: {plan['accepted_tasks']}/{plan['requested_tasks']} tasks, "
+                f"depth {plan['depth']}, {plan['accepted_credits']} credits, ${plan['accepted_usd']:.4f} "
+                f"(requested {plan['requested_credits']} credits, ${plan['requested_usd']:.4f})"
+            )
+        limit_usd = f"${self.limit_usd:.4f}" if self.limit_usd else "none"
+        limit_credits = self.limit_credits if self.limit_credits else "none"
+        lines.append(f"  Total: {self.committed_credits} credits, ${self.committed_usd:.4f} "
+                     f"(limits: {limit_credits} credits, {limit_usd}; mode: {self.mode})")
+        if self.actual_usd:
+            lines.append(f"  Actual charged so far: ${self.actual_usd:.4f}")
+        return "\n".join(lines)
+
+
+# --- Ledger ---
+
+def create_task_ledger_table_if_not_exists(db_conn):
+    """Creates the dataforseo_task_ledger table used to reconcile projected and actual spend."""
+    try:
+        with db_conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS dataforseo_task_ledger (
+                    task_id TEXT PRIMARY KEY,
+                    endpoint TEXT NOT NULL,
+                    tag TEXT,
+                    metro_id INTEGER,
+                    term TEXT,
+                    depth INTEGER,
+                    estimated_credits INTEGER,
+                    estimated_cost NUMERIC(12, 6),
+                    actual_cost NUMERIC(12, 6),
+                    submitted_at TIMESTAMP(3) NOT NULL DEFAULT CURRENT_TIMESTAMP(3)
+                );
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_dataforseo_task_ledger_submitted_at
+                ON dataforseo_task_ledger(submitted_at);
+            """)
+        db_conn.commit()
+        return True
+    except Exception as e:
+        logger.error(f"Error creating dataforseo_task_ledger table: {e}")
+        db_conn.rollback()
+        return False
+
+
+def record_task_ledger_entries(db_conn, task_metadata):
+    """
+    Writes one ledger row per submitted task in a single round trip.
+    task_metadata: dict mapping task_id to metadata containing endpoint_key,
+    original_tag, metro_id, dance_style, depth, estimated_credits,
+    estimated_cost and actual_cost.
+    """
+    if not task_metadata:
+        return 0
+    now = datetime.now(timezone.utc)
+    rows = [
+        (
+            task_id,
+            meta.get("endpoint_key"),
+            meta.get("original_tag"),
+            meta.get("metro_id"),
+            meta.get("dance_style"),
+            meta.get("depth"),
+            meta.get("estimated_credits"),
+            meta.get("estimated_cost"),
+            meta.get("actual_cost"),
+            now,
+        )
+        for task_id, meta in task_metadata.items()
+    ]
+    try:
+        with db_conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO dataforseo_task_ledger
+                    (task_id, endpoint, tag, metro_id, term, depth,
+                     estimated_credits, estimated_cost, actual_cost, submitted_at)
+                VALUES %s
+                ON CONFLICT (task_id) DO UPDATE
+                SET actual_cost = COALESCE(EXCLUDED.actual_cost, dataforseo_task_ledger.actual_cost);
+            """, rows)
+        db_conn.commit()
+        logger.info(f"Recorded {len(rows)} task(s) in dataforseo_task_ledger.")
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Error recording DataForSEO task ledger entries: {e}")
+        db_conn.rollback()
+        return 0
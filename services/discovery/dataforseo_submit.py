@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+dataforseo_submit.py
+
+Concurrent task_post submission for DataForSEO. Packs tasks into the largest
+POST arrays the API accepts, sends independent arrays in parallel under a
+calls-per-minute limit, and maps each returned task back to the metadata of
+the payload that created it by tag (falling back to array position).
+"""
+
+import os
+import time
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# DataForSEO accepts at most 100 tasks in a single task_post array
+MAX_TASKS_PER_POST = int(os.getenv("DATAFORSEO_MAX_TASKS_PER_POST", 100))
+# Independent POST arrays sent at the same time
+POST_CONCURRENCY = int(os.getenv("DATAFORSEO_POST_CONCURRENCY", 4))
+# Account-wide API limit is 2000 calls per minute; stay well under it by default
+MAX_POSTS_PER_MINUTE = int(os.getenv("DATAFORSEO_MAX_POSTS_PER_MINUTE", 600))
+POST_TIMEOUT_SECONDS = 60
+
+
+class RateLimiter:
+    """Thread-safe limiter that spaces calls at least 60/calls_per_minute seconds apart."""
+
+    def __init__(self, calls_per_minute):
+        self.interval = 60.0 / calls_per_minute if calls_per_minute > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def chunk_tasks(tasks, size=MAX_TASKS_PER_POST):
+    """Splits tasks into POST arrays of at most size tasks."""
+    size = max(1, min(size, MAX_TASKS_PER_POST))
+    return [tasks[i:i + size] for i in range(0, len(tasks), size)]
+
+
+def _post_chunk(session, endpoint, headers, chunk, rate_limiter):
+    rate_limiter.wait()
+    response = session.post(endpoint, json=chunk, headers=headers, timeout=POST_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json()
+
+
+def submit_tasks(endpoint, tasks, headers, label="", concurrency=POST_CONCURRENCY,
+                 rate_limiter=None):
+    """
+    Submits tasks to a DataForSEO task_post endpoint.
+
+    Args:
+        endpoint: Full task_post URL.
+        tasks: List of (payload, metadata) tuples. Each payload should carry a
+               unique "tag"; metadata is whatever the caller wants back.
+        headers: Request headers including Authorization.
+        label: Prefix for log lines (e.g. "EVENT", "ORGANIC").
+
+    Returns:
+        List of (task_id, task_info, metadata) for every task the API
+        returned an ID for, where task_info is the per-task response item.
+    """
+    if not tasks:
+        return []
+
+    rate_limiter = rate_limiter or RateLimiter(MAX_POSTS_PER_MINUTE)
+    chunks = chunk_tasks(tasks)
+    submitted = []
+    prefix = f"{label} " if label else ""
+
+    logger.info(f"Submitting {len(tasks)} {prefix}tasks to {endpoint} in {len(chunks)} POST array(s), "
+                f"up to {concurrency} at a time...")
+
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {
+            executor.submit(_post_chunk, session, endpoint, headers, [payload for payload, _ in chunk], rate_limiter): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                result = future.result()
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Request exception during {prefix}batch task submission of {len(chunk)} tasks: {e}")
+                continue
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON decode error during {prefix}batch task submission of {len(chunk)} tasks: {e}")
+                continue
+
+            if result.get("status_code") != 20000 or not result.get("tasks_count"):
+                logger.error(f"{prefix}batch task submission failed. Status: {result.get('status_code')}, "
+                             f"Message: {result.get('status_message')}")
+                continue
+
+            logger.info(f"Successfully submitted a chunk of {len(chunk)} {prefix}tasks. "
+                        f"API tasks_count: {result.get('tasks_count')}.")
+            metadata_by_tag = {payload.get("tag"): metadata for payload, metadata in chunk}
+            for position, task_info in enumerate(result.get("tasks", [])):
+                task_id = task_info.get("id")
+                if not task_id:
+                    logger.error(f"{prefix}task submission issue: No ID returned for a task item. Full item: {task_info}")
+                    continue
+                tag = (task_info.get("data") or {}).get("tag")
+                if tag in metadata_by_tag:
+                    metadata = metadata_by_tag[tag]
+                elif position < len(chunk):
+                    metadata = chunk[position][1]
+                else:
+                    metadata = None
+                submitted.append((task_id, task_info, metadata))
+
+    return submitted
@@ -17,6 +17,19 @@ import psycopg2
 from psycopg2.extras import Json
 import hashlib
 import re
+import sys
+from dataforseo_submit import submit_tasks
+from dataforseo_budget import (
+    CreditBudget,
+    billed_pages_for_depth,
+    create_task_ledger_table_if_not_exists,
+    record_task_ledger_entries,
+)
+
+# Shared service modules (metro_catalog, event_dedup) live one directory up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from metro_catalog import load_metro_catalog, filter_metros, iter_metros
+from event_dedup import dedup_key, setup_dedup_columns
 
 # Setup basic logging
 logging.basicConfig(
@@ -64,8 +77,12 @@ METRO_CSV_PATH = DOCKER_METRO_CSV_PATH if os.path.exists(DOCKER_METRO_CSV_PATH)
 REQUEST_DELAY = float(os.getenv("REQUEST_DELAY", 2.0))
 RESULTS_PER_PAGE = 100
 MAX_PAGES_PER_QUERY = int(os.getenv("MAX_PAGES_PER_QUERY", 1))
+LIVE_EVENTS_DEPTH = min(MAX_PAGES_PER_QUERY, 7)  # DataForSEO has higher limit of 1-7 for events
 MAX_CITIES = int(os.getenv("MAX_CITIES", 0))  # Default to 0 (no limit) for cities
 DATA_RAW_DIR = os.getenv("DATA_RAW_DIR", "./data_raw")
+# Metrics exposition: scrape endpoint while running and/or push when the run finishes
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL")
 
 # Ensure data_raw directory exists
 Path(DATA_RAW_DIR).mkdir(parents=True, exist_ok=True)
@@ -82,6 +99,8 @@ urls_discovered = Counter('urls_discovered', 'Number of URLs discovered', ['city
 unique_urls_added = Counter('unique_urls_added', 'Number of unique URLs added to queue', ['city'], registry=registry)
 api_latency = Histogram('api_latency_seconds', 'API request latency in seconds', ['city', 'dance_style'], registry=registry)
 dance_style_url_count = Gauge('dance_style_url_count', 'Number of URLs found for each dance style', ['city', 'dance_style'], registry=registry)
+serp_credits_total = Counter('serp_credits_total', 'Total number of SERP credits used', ['endpoint'], registry=registry)
+serp_cost_usd_total = Counter('serp_cost_usd_total', 'DataForSEO cost charged in USD', ['endpoint'], registry=registry)
 
 # Updated list of 14 dance styles
 TARGET_DANCE_STYLES_FOR_DISCOVERY = [
@@ -220,7 +239,7 @@ def get_dataforseo_results_for_dance_style(city_info, dance_style, dataforseo_lo
         "keyword": query,
         "location_code": int(city_info['location_code']) if pd.notna(city_info.get('location_code')) else None,
         "language_name": "English",
-        "depth": min(MAX_PAGES_PER_QUERY, 7),  # DataForSEO has higher limit of 1-7 for events
+        "depth": LIVE_EVENTS_DEPTH,
         "date_range": "next_week",  # Get events for the next week
         "se_domain": "google.com",
         "se_results_count": 100
@@ -363,66 +382,15 @@ def load_metros_from_csv(csv_path):
             test_df[default_slug_column] = test_df['name'].apply(lambda x: str(x).lower().replace(" ", "_").replace("-", "_"))
         return test_df
     
-    try:
-        df = pd.read_csv(csv_path, encoding='utf-8')
-        logger.info(f"Loaded {len(df)} rows from {csv_path}")
-
-        # Ensure 'slug' column exists, create it if not
-        if default_slug_column not in df.columns:
-            if 'name' in df.columns:
-                logger.warning(f"'{default_slug_column}' column not found in {csv_path}. Creating from 'name' column.")
-                df[default_slug_column] = df['name'].apply(lambda x: str(x).lower().replace(" ", "_").replace("-", "_"))
-            elif 'asciiname' in df.columns: # Fallback to asciiname for slug creation
-                logger.warning(f"'{default_slug_column}' and 'name' columns not found. Creating from 'asciiname' column.")
-                df[default_slug_column] = df['asciiname'].apply(lambda x: str(x).lower().replace(" ", "_").replace("-", "_"))
-            else:
-                logger.error(f"Cannot create '{default_slug_column}' as neither 'name' nor 'asciiname' columns are present in {csv_path}.")
-                # Return an empty DataFrame or raise an error if slug is absolutely critical
-                return pd.DataFrame()
-        
-        # Ensure other critical columns have fallbacks or are handled if missing
-        if 'asciiname' not in df.columns:
-            if 'name' in df.columns:
-                logger.warning("'asciiname' column not found. Using 'name' column as fallback for API calls.")
-                df['asciiname'] = df['name'] # Use name if asciiname is missing
-            else:
-                logger.error("Neither 'asciiname' nor 'name' columns found. API calls for city names will likely fail.")
-                return pd.DataFrame() # Or handle error appropriately
-        
-        if 'country_code' not in df.columns:
-            logger.warning("'country_code' column not found. Location specificity for API calls might be reduced.")
-            df['country_code'] = "" # Add empty string if missing
-
-        if 'admin1_code' not in df.columns:
-            logger.warning("'admin1_code' column not found. US state-level specificity for API calls will be unavailable.")
-            df['admin1_code'] = "" # Add empty string if missing
-
-        # Ensure 'language_code' column exists, default to 'en' if not
-        if 'language_code' not in df.columns:
-            logger.warning("'language_code' column not found in CSV. Defaulting to 'en' (English) for all metros. Add this column for better local language targeting.")
-            df['language_code'] = 'en'
-        else:
-            # Fill any missing language_code values with 'en' as a fallback
-            df['language_code'] = df['language_code'].fillna('en')
-            logger.info("'language_code' column loaded. Ensure it contains valid 2-letter ISO language codes (e.g., 'es', 'fr').")
-
-        # Filter by population if the column exists, otherwise log warning and proceed
-        if 'population' in df.columns:
-            # Attempt to convert population to numeric, coercing errors to NaN
-            df['population'] = pd.to_numeric(df['population'], errors='coerce')
-            df = df[df['population'] > 10000]
-            logger.info(f"{len(df)} metros remaining after population filter (> 10000).")
-        else:
-            logger.warning("'population' column not found. Cannot filter by population.")
-            
-        return df
-
-    except FileNotFoundError: # This case should be caught by os.path.exists now, but good to keep
-        logger.error(f"Metro CSV file not found at {csv_path}. This shouldn't happen if os.path.exists check passed.")
-        return load_metros_from_csv(None) # Recurse to create test data
-    except Exception as e:
-        logger.error(f"Error loading or processing CSV from {csv_path}: {e}. Attempting to use test data.")
-        return load_metros_from_csv(None) # Recurse to create test data
+    # Typed, cached load shared with the collectors (see services/metro_catalog.py)
+    df = load_metro_catalog(csv_path)
+    if df.empty:
+        logger.error(f"Error loading or processing CSV from {csv_path}. Attempting to use test data.")
+        return load_metros_from_csv("") # Recurse to create test data
+
+    df = filter_metros(df, min_population=10000)
+    logger.info(f"{len(df)} metros remaining after population filter (> 10000).")
+    return df
     
 # --- Database Helper Functions ---
 def get_db_connection():
@@ -469,7 +437,8 @@ def create_event_raw_table_if_not_exists(db_conn):
             cur.execute(create_table_sql)
             db_conn.commit()
             logger.info("Ensured 'event_raw' table exists (or was created to match specified schema if missing).")
-        return True
+        # canonical_url/url_hash dedup key; added separately so existing tables pick it up too
+        return setup_dedup_columns(db_conn)
     except psycopg2.Error as e:
         logger.error(f"Error creating/checking 'event_raw' table: {e}")
         db_conn.rollback()
@@ -494,19 +463,20 @@ def insert_into_event_raw(conn, source, source_event_id, metro_id, raw_data_payl
     # Make a copy to avoid modifying the original dict if it's reused
     final_raw_json = dict(raw_data_payload)
     final_raw_json["_script_discovery_metadata"] = script_metadata
+    canonical_url, url_hash = dedup_key(raw_data_payload)
     
     sql_insert = """
-        INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, discovered_at)
-        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP(3))
-        ON CONFLICT (source, source_event_id) DO NOTHING;
+        INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, canonical_url, url_hash, discovered_at)
+        VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP(3))
+        ON CONFLICT DO NOTHING;
     """
-    # We use DO NOTHING. If an update is needed, the conflict target and SET clause would change.
+    # We use DO NOTHING without a target so both (source, source_event_id) and (source, url_hash) dedupe.
     # For DO NOTHING to work effectively, source_event_id should be reliably unique for a given source.
     # If source_event_id is NULL, ON CONFLICT might not behave as expected for multiple NULLs.
 
     try:
         with conn.cursor() as cur:
-            cur.execute(sql_insert, (source, source_event_id, metro_id, Json(final_raw_json)))
+            cur.execute(sql_insert, (source, source_event_id, metro_id, Json(final_raw_json), canonical_url, url_hash))
             conn.commit()
             if cur.rowcount > 0:
                 logger.info(f"Successfully inserted into event_raw: source_id={source_event_id}, source={source}.")
@@ -685,17 +655,43 @@ def enrich_metros_with_location_codes(metros_df, dataforseo_login, dataforseo_pa
     
     return metros_df.copy()
 
-def batch_api_tasks(cities_df, broad_search_terms, dataforseo_login, dataforseo_password):
+def record_submitted_task_cost(task_id, task_info, endpoint_key, budget=None):
+    """
+    Adds projected and charged cost to a submitted task's metadata entry and
+    updates the credit/cost counters. task_info is the per-task item of a
+    task_post response, which carries the charged 'cost'.
+    """
+    depth = task_info.get("data", {}).get("depth")
+    if budget:
+        estimated_credits, estimated_cost = budget.estimate(endpoint_key, depth)
+        budget.record_actual(task_info.get("cost"))
+    else:
+        estimated_credits, estimated_cost = billed_pages_for_depth(depth), None
+
+    task_metadata_map[task_id].update({
+        "endpoint_key": endpoint_key,
+        "depth": depth,
+        "estimated_credits": estimated_credits,
+        "estimated_cost": estimated_cost,
+        "actual_cost": task_info.get("cost"),
+    })
+    serp_credits_total.labels(endpoint=endpoint_key).inc(estimated_credits)
+    if task_info.get("cost"):
+        serp_cost_usd_total.labels(endpoint=endpoint_key).inc(float(task_info["cost"]))
+
+def batch_api_tasks(cities_df, broad_search_terms, dataforseo_login, dataforseo_password, budget=None, dry_run=False):
     """
     Submits batch tasks to DataForSEO API for Google Events using broad search terms.
     broad_search_terms: A list of terms like ["dance", "dancing"] to be used with "in [city]".
+    budget: optional CreditBudget; the task set is trimmed to fit it before submission.
+    dry_run: plan against the budget but do not submit anything.
     """
     global task_metadata_map
     
     logger.info(f"Preparing to submit BROAD Google Events tasks for {len(cities_df)} cities using terms: {broad_search_terms}.")
     post_data_array = []
-    # Initialize task IDs list to return
-    all_task_ids_from_submission = []
+    # Metadata for each payload, keyed by its unique tag, so returned task IDs map back without DataFrame lookups
+    metadata_by_tag = {}
 
     auth_header = base64.b64encode(
         f"{dataforseo_login}:{dataforseo_password}".encode()
@@ -704,113 +700,72 @@ def batch_api_tasks(cities_df, broad_search_terms, dataforseo_login, dataforseo_
     
     endpoint = "https://api.dataforseo.com/v3/serp/google/events/task_post"
 
-    for index, city_info in cities_df.iterrows():
-        if pd.isna(city_info.get("location_code")):
-            logger.warning(f"Skipping city {city_info['name']} for BROAD EVENTS task due to missing location_code.")
+    for city_info in iter_metros(cities_df):
+        if pd.isna(getattr(city_info, "location_code", None)):
+            logger.warning(f"Skipping city {city_info.name} for BROAD EVENTS task due to missing location_code.")
             continue
         
-        city_lang_code = city_info.get('language_code', 'en') # Default to 'en' if somehow still missing
+        city_lang_code = getattr(city_info, 'language_code', 'en') # Default to 'en' if somehow still missing
 
         for term in broad_search_terms:
-            query = f"{term} in {city_info['name']}"
+            query = f"{term} in {city_info.name}"
             # Note: Consider if broad terms like "dance" need special quoting like "coast swing" did.
             # For now, assuming simple concatenation is fine for single broad terms.
 
-            tag_content = f"city_{city_info['geonameid']}_term_{term.replace(' ', '_')}_lang_{city_lang_code}_run_{int(time.time())}"
+            tag_content = f"city_{city_info.geonameid}_term_{term.replace(' ', '_')}_lang_{city_lang_code}_run_{int(time.time())}"
 
             task_payload = {
                 "keyword": query,
-                "location_code": int(city_info["location_code"]),
+                "location_code": int(city_info.location_code),
                 "language_code": city_lang_code, # Use dynamic language code
                 "depth": RESULTS_PER_PAGE, # Max 100 for events
-                "se_domain": city_info.get("country_code", "").lower() + ".google.com" if city_info.get("country_code") else "google.com", # Target local Google domain
+                "se_domain": city_info.country_code.lower() + ".google.com" if city_info.country_code else "google.com", # Target local Google domain
                 "tag": tag_content 
             }
             post_data_array.append(task_payload)
+            metadata_by_tag[tag_content] = {
+                "metro_id": int(city_info.geonameid),
+                "city_name": city_info.name,
+                "dance_style": term.replace(' ', '_'), # Storing the broad term as dance_style for map consistency
+                "search_type": "event",
+            }
     
     if not post_data_array:
         logger.warning("No tasks to submit after filtering for location_codes.")
         return []
 
-    submitted_task_ids = []
-    logger.info(f"Submitting {len(post_data_array)} tasks to {endpoint}...")
-    
-    # DataForSEO batch limit is 100 tasks per array in POST.
-    # If post_data_array is larger, it needs to be chunked.
-    # For now, assuming len(post_data_array) <= 100. Add chunking if necessary.
-    # Max 1000 tasks per POST request, each array in POST can have up to 100 tasks.
-    # So, if we have 250 tasks, we'd send [{"POST_ARRAY_1"}, {"POST_ARRAY_2"}, {"POST_ARRAY_3_len_50"}]
-    # The structure for multi-array POST is a list of these arrays:
-    # [ [{"keyword":..}, {"keyword":..}], [{"keyword":..}] ]
-    # But our current structure for post_data_array is already a list of task_payloads.
-    # The API expects a direct list of up to 100 task objects if sending a single array.
-    # If sending multiple arrays (up to 1000 total tasks), it's a list of lists.
-    # Let's stick to single array of up to 100 tasks for simplicity first.
-
-    MAX_TASKS_PER_POST_ARRAY = 100
-    all_task_ids_from_submission = []
+    if budget:
+        post_data_array = budget.plan(post_data_array, "events/task_post")
+    if dry_run or not post_data_array:
+        logger.info(f"Not submitting EVENT tasks ({'dry run' if dry_run else 'nothing left after budget planning'}).")
+        return []
 
-    for i in range(0, len(post_data_array), MAX_TASKS_PER_POST_ARRAY):
-        chunk = post_data_array[i:i + MAX_TASKS_PER_POST_ARRAY]
-        try:
-            response = requests.post(endpoint, json=chunk, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+    tasks = [(payload, metadata_by_tag[payload["tag"]]) for payload in post_data_array]
+    all_task_ids_from_submission = []
 
-            if result.get("status_code") == 20000 and result.get("tasks_count") > 0:
-                logger.info(f"Successfully submitted a chunk of {len(chunk)} tasks. API tasks_count: {result.get('tasks_count')}.")
-                for task_info in result.get("tasks", []):
-                    task_id = task_info.get("id")
-                    if task_id: # If an ID is present, we consider it a task to track
-                        original_payload_tag = task_info.get("data", {}).get("tag", "no_tag_in_response")
-                        all_task_ids_from_submission.append(task_id)
-                        
-                        task_item_status_code = task_info.get("status_code")
-                        task_item_status_message = task_info.get("status_message", "No status message")
-
-                        if task_item_status_code == 20100: # Standard "Task Created."
-                            logger.info(f"Task {task_id} created successfully. Tag: {original_payload_tag}. Status: {task_item_status_code} ({task_item_status_message})")
-                        elif task_item_status_code == 20000: # Should ideally be 20100 for creation
-                             logger.info(f"Task {task_id} reported with status 20000 (Ok) at creation. Tag: {original_payload_tag}. Status: {task_item_status_code} ({task_item_status_message})")
-                        else: # Log other statuses for individual tasks if they are not the expected "Task Created"
-                            logger.warning(f"Task {task_id} created but with unexpected status. Tag: {original_payload_tag}. Status: {task_item_status_code} ({task_item_status_message}). Payload: {task_info.get('data')}")
-
-                        # Reconstruct metadata from tag if possible
-                        try:
-                            parts = original_payload_tag.split('_')
-                            metro_id_from_tag = int(parts[1])
-                            # Tag: city_METROID_term_TERM_lang_LANG_run_TIMESTAMP
-                            term_idx_start = parts.index("term") + 1
-                            lang_idx_start = parts.index("lang")
-                            term_from_tag = "_".join(parts[term_idx_start:lang_idx_start])
-
-                            city_name_from_tag = cities_df[cities_df['geonameid'] == metro_id_from_tag]['name'].iloc[0] \
-                                               if metro_id_from_tag in cities_df['geonameid'].values else "UnknownCity"
-
-                            task_metadata_map[task_id] = {
-                                "metro_id": metro_id_from_tag,
-                                "city_name": city_name_from_tag,
-                                "dance_style": term_from_tag, # Storing the broad term as dance_style for map consistency
-                                "search_type": "event", 
-                                "original_tag": original_payload_tag
-                            }
-                        except (ValueError, IndexError, KeyError) as e_tag_parse: # Combined exceptions
-                            logger.error(f"Could not parse tag for EVENT task {task_id} ('{original_payload_tag}'): {e_tag_parse}")
-                            task_metadata_map[task_id] = {
-                                "metro_id": None, "city_name": "UnknownFromTagParse", 
-                                "dance_style": "UnknownTermFromTagParse", "search_type": "event", 
-                                "original_tag": original_payload_tag
-                            }
-                        # No change to debug log, it's fine as is
-                        logger.debug(f"Task {task_id} submitted. Tag: {original_payload_tag}. Mapped metadata: {task_metadata_map[task_id]}")
-                    else: # No task_id in the task_info item
-                        logger.error(f"Task submission issue: No ID returned for a task item. Full item: {task_info}")
-            else:
-                logger.error(f"Batch task submission failed. Status: {result.get('status_code')}, Message: {result.get('status_message')}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request exception during batch task submission: {e}")
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error during batch task submission: {e}. Response text: {response.text if 'response' in locals() else 'N/A'}")
+    for task_id, task_info, metadata in submit_tasks(endpoint, tasks, headers, label="EVENT"):
+        original_payload_tag = task_info.get("data", {}).get("tag", "no_tag_in_response")
+        all_task_ids_from_submission.append(task_id)
+
+        task_item_status_code = task_info.get("status_code")
+        task_item_status_message = task_info.get("status_message", "No status message")
+
+        if task_item_status_code == 20100: # Standard "Task Created."
+            logger.info(f"Task {task_id} created successfully. Tag: {original_payload_tag}. Status: {task_item_status_code} ({task_item_status_message})")
+        elif task_item_status_code == 20000: # Should ideally be 20100 for creation
+            logger.info(f"Task {task_id} reported with status 20000 (Ok) at creation. Tag: {original_payload_tag}. Status: {task_item_status_code} ({task_item_status_message})")
+        else: # Log other statuses for individual tasks if they are not the expected "Task Created"
+            logger.warning(f"Task {task_id} created but with unexpected status. Tag: {original_payload_tag}. Status: {task_item_status_code} ({task_item_status_message}). Payload: {task_info.get('data')}")
+
+        if metadata is None:
+            logger.error(f"Could not map EVENT task {task_id} ('{original_payload_tag}') back to its payload.")
+            metadata = {
+                "metro_id": None, "city_name": "UnknownFromTagParse",
+                "dance_style": "UnknownTermFromTagParse", "search_type": "event",
+            }
+        task_metadata_map[task_id] = dict(metadata, original_tag=original_payload_tag)
+        record_submitted_task_cost(task_id, task_info, "events/task_post", budget)
+        logger.debug(f"Task {task_id} submitted. Tag: {original_payload_tag}. Mapped metadata: {task_metadata_map[task_id]}")
     
     if all_task_ids_from_submission:
         logger.info(f"Total tasks submitted across all chunks: {len(all_task_ids_from_submission)}. Task IDs: {all_task_ids_from_submission}")
@@ -820,17 +775,18 @@ def batch_api_tasks(cities_df, broad_search_terms, dataforseo_login, dataforseo_
     return all_task_ids_from_submission
 
 
-def batch_organic_style_tasks(cities_df, specific_dance_styles, dataforseo_login, dataforseo_password):
+def batch_organic_style_tasks(cities_df, specific_dance_styles, dataforseo_login, dataforseo_password, budget=None, dry_run=False):
     """
     Submits batch tasks to DataForSEO API for Google Organic Search for specific dance styles.
     specific_dance_styles: A list of styles like ["salsa", "bachata"].
+    budget / dry_run: see batch_api_tasks.
     """
     global task_metadata_map
     
     logger.info(f"Preparing to submit SPECIFIC ORGANIC tasks for {len(cities_df)} cities and {len(specific_dance_styles)} dance styles.")
     post_data_array = []
-    # Initialize task IDs list to return
-    all_task_ids_from_submission = []
+    # Metadata for each payload, keyed by its unique tag, so returned task IDs map back without DataFrame lookups
+    metadata_by_tag = {}
 
     auth_header = base64.b64encode(
         f"{dataforseo_login}:{dataforseo_password}".encode()
@@ -840,16 +796,16 @@ def batch_organic_style_tasks(cities_df, specific_dance_styles, dataforseo_login
     # Endpoint for Google Organic Search tasks
     endpoint = "https://api.dataforseo.com/v3/serp/google/organic/task_post"
 
-    for index, city_info in cities_df.iterrows():
+    for city_info in iter_metros(cities_df):
         # For Organic, location_name is generally used. location_code might not be supported or behave differently.
         # We will use asciiname which should be robust. If not available, fallback to name.
-        location_name_for_api = city_info.get('asciiname', city_info.get('name'))
+        location_name_for_api = getattr(city_info, 'asciiname', city_info.name)
         if pd.isna(location_name_for_api):
-            logger.warning(f"Skipping city {city_info.get('name', 'N/A')} for ORGANIC tasks due to missing location name.")
+            logger.warning(f"Skipping city {city_info.name} for ORGANIC tasks due to missing location name.")
             continue
         
-        city_lang_code = city_info.get('language_code', 'en')
-        country_code = city_info.get("country_code", "")
+        city_lang_code = getattr(city_info, 'language_code', 'en')
+        country_code = getattr(city_info, "country_code", "")
         se_domain_for_api = country_code.lower() + ".google.com" if country_code else "google.com"
         if country_code.lower() == "us": # For US, use google.com
              se_domain_for_api = "google.com"
@@ -859,7 +815,7 @@ def batch_organic_style_tasks(cities_df, specific_dance_styles, dataforseo_login
             if style == "coast swing": # Ensure quotes for multi-word style
                 query = f'"coast swing" in {location_name_for_api}'
 
-            tag_content = f"city_{city_info['geonameid']}_style_{style.replace(' ', '_')}_organic_lang_{city_lang_code}_run_{int(time.time())}"
+            tag_content = f"city_{city_info.geonameid}_style_{style.replace(' ', '_')}_organic_lang_{city_lang_code}_run_{int(time.time())}"
 
             task_payload = {
                 "keyword": query,
@@ -871,71 +827,47 @@ def batch_organic_style_tasks(cities_df, specific_dance_styles, dataforseo_login
                 "tag": tag_content 
             }
             post_data_array.append(task_payload)
+            metadata_by_tag[tag_content] = {
+                "metro_id": int(city_info.geonameid),
+                "city_name": city_info.name,
+                "dance_style": style.replace(' ', '_'), # Storing the specific style
+                "search_type": "organic", # Differentiate from event searches
+            }
     
     if not post_data_array:
         logger.warning("No ORGANIC tasks to submit.")
         return []
 
-    # Submission logic (chunking and requests) is similar to batch_api_tasks
-    # This part can be refactored into a common helper if it grows more complex
-    MAX_TASKS_PER_POST_ARRAY = 100
+    if budget:
+        post_data_array = budget.plan(post_data_array, "organic/task_post")
+    if dry_run or not post_data_array:
+        logger.info(f"Not submitting ORGANIC tasks ({'dry run' if dry_run else 'nothing left after budget planning'}).")
+        return []
+
+    tasks = [(payload, metadata_by_tag[payload["tag"]]) for payload in post_data_array]
     all_task_ids_from_submission = []
 
-    for i in range(0, len(post_data_array), MAX_TASKS_PER_POST_ARRAY):
-        chunk = post_data_array[i:i + MAX_TASKS_PER_POST_ARRAY]
-        logger.info(f"Submitting {len(chunk)} ORGANIC tasks to {endpoint} (chunk {i // MAX_TASKS_PER_POST_ARRAY + 1})...")
-        try:
-            response = requests.post(endpoint, json=chunk, headers=headers)
-            response.raise_for_status()
-            result = response.json()
+    for task_id, task_info, metadata in submit_tasks(endpoint, tasks, headers, label="ORGANIC"):
+        original_payload_tag = task_info.get("data", {}).get("tag", "no_tag_in_response")
+        all_task_ids_from_submission.append(task_id)
 
-            if result.get("status_code") == 20000 and result.get("tasks_count", 0) > 0:
-                logger.info(f"Successfully submitted a chunk of {len(chunk)} ORGANIC tasks. API tasks_count: {result.get('tasks_count')}.")
-                for task_info in result.get("tasks", []):
-                    task_id = task_info.get("id")
-                    if task_id:
-                        original_payload_tag = task_info.get("data", {}).get("tag", "no_tag_in_response")
-                        all_task_ids_from_submission.append(task_id)
-                        
-                        task_item_status_code = task_info.get("status_code")
-                        task_item_status_message = task_info.get("status_message", "No status message")
+        task_item_status_code = task_info.get("status_code")
+        task_item_status_message = task_info.get("status_message", "No status message")
 
-                        if task_item_status_code == 20100: # Standard "Task Created."
-                            logger.info(f"ORGANIC Task {task_id} created successfully. Tag: {original_payload_tag}.")
-                        else: 
-                            logger.warning(f"ORGANIC Task {task_id} created with status {task_item_status_code} ({task_item_status_message}). Tag: {original_payload_tag}.")
-
-                        try:
-                            parts = original_payload_tag.split('_')
-                            metro_id_from_tag = int(parts[1])
-                            style_idx = parts.index("style") + 1
-                            organic_idx = parts.index("organic")
-                            style_from_tag = "_".join(parts[style_idx:organic_idx])
-                            city_name_from_tag = cities_df[cities_df['geonameid'] == metro_id_from_tag]['name'].iloc[0] \
-                                               if metro_id_from_tag in cities_df['geonameid'].values else "UnknownCity"
-
-                            task_metadata_map[task_id] = {
-                                "metro_id": metro_id_from_tag,
-                                "city_name": city_name_from_tag,
-                                "dance_style": style_from_tag, # Storing the specific style
-                                "search_type": "organic", # Differentiate from event searches
-                                "original_tag": original_payload_tag
-                            }
-                        except (ValueError, IndexError, KeyError) as e_tag_parse:
-                            logger.error(f"Could not parse tag for ORGANIC task {task_id} ('{original_payload_tag}'): {e_tag_parse}")
-                            task_metadata_map[task_id] = {
-                                "metro_id": None, "city_name": "UnknownFromTagParse", 
-                                "dance_style": "UnknownFromTagParse", "search_type": "organic", 
-                                "original_tag": original_payload_tag }
-                        logger.debug(f"ORGANIC Task {task_id} submitted. Tag: {original_payload_tag}. Mapped metadata: {task_metadata_map.get(task_id)}")
-                    else:
-                        logger.error(f"ORGANIC Task submission issue: No ID returned. Item: {task_info}")
-            else:
-                logger.error(f"ORGANIC batch task submission failed. Status: {result.get('status_code')}, Message: {result.get('status_message')}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Request exception during ORGANIC batch task submission: {e}")
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error during ORGANIC batch task submission: {e}. Response: {response.text if 'response' in locals() else 'N/A'}")
+        if task_item_status_code == 20100: # Standard "Task Created."
+            logger.info(f"ORGANIC Task {task_id} created successfully. Tag: {original_payload_tag}.")
+        else: 
+            logger.warning(f"ORGANIC Task {task_id} created with status {task_item_status_code} ({task_item_status_message}). Tag: {original_payload_tag}.")
+
+        if metadata is None:
+            logger.error(f"Could not map ORGANIC task {task_id} ('{original_payload_tag}') back to its payload.")
+            metadata = {
+                "metro_id": None, "city_name": "UnknownFromTagParse",
+                "dance_style": "UnknownFromTagParse", "search_type": "organic",
+            }
+        task_metadata_map[task_id] = dict(metadata, original_tag=original_payload_tag)
+        record_submitted_task_cost(task_id, task_info, "organic/task_post", budget)
+        logger.debug(f"ORGANIC Task {task_id} submitted. Tag: {original_payload_tag}. Mapped metadata: {task_metadata_map.get(task_id)}")
     
     if all_task_ids_from_submission:
         logger.info(f"Total ORGANIC tasks submitted: {len(all_task_ids_from_submission)}.")
@@ -1307,9 +1239,12 @@ def main():
     logger.info("Starting enhanced discovery service...")
     time.sleep(1) # Small delay
 
+    if METRICS_PORT:
+        prometheus_client.start_http_server(METRICS_PORT, registry=registry)
+        logger.info(f"Serving Prometheus metrics on :{METRICS_PORT}/metrics")
+
     # Create Prometheus metrics for event metrics
     events_found_total = Counter('events_found_total', 'Total number of events found', ['city', 'dance_style'], registry=registry)
-    serp_credits_total = Counter('serp_credits_total', 'Total number of SERP credits used', ['endpoint'], registry=registry)
 
     # Critical check for DataForSEO credentials early
     if not DATAFORSEO_LOGIN or not DATAFORSEO_PASSWORD:
@@ -1386,17 +1321,22 @@ def main():
         INCLUDE_ORGANIC_SEARCH = os.getenv("INCLUDE_ORGANIC_SEARCH", "true").lower() == "true"
         # Track if we want to use batch processing
         USE_BATCH_PROCESSING = os.getenv("USE_BATCH_PROCESSING", "true").lower() == "true"
+        # Plan against the credit budget and print projected spend without submitting
+        BUDGET_DRY_RUN = os.getenv("DATAFORSEO_BUDGET_DRY_RUN", "false").lower() == "true"
+        # Projects and caps spend for this run (limits from DATAFORSEO_BUDGET_USD / DATAFORSEO_BUDGET_CREDITS)
+        budget = CreditBudget()
+        # Clear the global task_metadata_map for fresh use
+        task_metadata_map.clear()
         
         if USE_BATCH_PROCESSING:
-            # Clear the global task_metadata_map for fresh use
-            task_metadata_map.clear()
-            
             # Submit tasks for broad event search
             event_task_ids = batch_api_tasks(
                 cities_for_tasks, 
                 broad_event_search_terms, 
                 DATAFORSEO_LOGIN, 
-                DATAFORSEO_PASSWORD
+                DATAFORSEO_PASSWORD,
+                budget=budget,
+                dry_run=BUDGET_DRY_RUN
             )
             all_task_ids = event_task_ids
             
@@ -1406,9 +1346,15 @@ def main():
                     cities_for_tasks,
                     specific_organic_search_styles,
                     DATAFORSEO_LOGIN,
-                    DATAFORSEO_PASSWORD
+                    DATAFORSEO_PASSWORD,
+                    budget=budget,
+                    dry_run=BUDGET_DRY_RUN
                 )
                 all_task_ids.extend(organic_task_ids)
+
+            logger.info(budget.report())
+            if task_metadata_map and create_task_ledger_table_if_not_exists(db_conn):
+                record_task_ledger_entries(db_conn, task_metadata_map)
             
             # 3. Poll for results of all tasks
             if all_task_ids:
@@ -1419,35 +1365,48 @@ def main():
         else:
             # Sequential processing without batching
             logger.info("Using sequential processing mode (no batching).")
-            for index, city_info in cities_for_tasks.iterrows():
+            # Every call goes to events/live/advanced (styles included), city by city in metro CSV order
+            live_terms = broad_event_search_terms + (specific_organic_search_styles if INCLUDE_ORGANIC_SEARCH else [])
+            live_tasks = [(city_info, term) for _, city_info in cities_for_tasks.iterrows() for term in live_terms]
+            accepted = budget.plan([{"depth": LIVE_EVENTS_DEPTH, "task_index": i} for i in range(len(live_tasks))],
+                                   "events/live/advanced")
+            if BUDGET_DRY_RUN:
+                logger.info("Not calling events/live/advanced (dry run).")
+                accepted = []
+            for payload in accepted:
+                city_info, term = live_tasks[payload["task_index"]]
                 city_name = city_info['name']
-                metro_id = city_info['geonameid']
-                
-                for term in broad_event_search_terms:
-                    all_urls, raw_api_response = get_dataforseo_results_for_dance_style(
-                        city_info, term, DATAFORSEO_LOGIN, DATAFORSEO_PASSWORD, 
-                        redis_client, db_conn, redis_available
-                    )
-                    logger.info(f"Found {len(all_urls)} URLs for '{term}' in {city_name}")
-                    
-                    # Update metrics
-                    events_found_total.labels(city=city_name, dance_style=term).inc(len(all_urls))
-                    serp_credits_total.labels(endpoint="events/live/advanced").inc(1)
+                all_urls, raw_api_response = get_dataforseo_results_for_dance_style(
+                    city_info, term, DATAFORSEO_LOGIN, DATAFORSEO_PASSWORD, 
+                    redis_client, db_conn, redis_available
+                )
+                logger.info(f"Found {len(all_urls)} URLs for '{term}' in {city_name}")
                 
-                if INCLUDE_ORGANIC_SEARCH:
-                    for style in specific_organic_search_styles:
-                        all_urls, raw_api_response = get_dataforseo_results_for_dance_style(
-                            city_info, style, DATAFORSEO_LOGIN, DATAFORSEO_PASSWORD, 
-                            redis_client, db_conn, redis_available
-                        )
-                        logger.info(f"Found {len(all_urls)} URLs for '{style}' in {city_name}")
-                        
-                        # Update metrics
-                        events_found_total.labels(city=city_name, dance_style=style).inc(len(all_urls))
-                        serp_credits_total.labels(endpoint="organic/live/advanced").inc(1)
+                # Update metrics
+                events_found_total.labels(city=city_name, dance_style=term).inc(len(all_urls))
+                # Charged cost per call, from the live response's task item
+                for task_info in (raw_api_response or {}).get("tasks") or []:
+                    if task_info.get("id"):
+                        task_metadata_map[task_info["id"]] = {
+                            "metro_id": int(city_info['geonameid']) if pd.notna(city_info.get('geonameid')) else None,
+                            "city_name": city_name,
+                            "dance_style": term, "search_type": "event_live", "original_tag": None,
+                        }
+                        record_submitted_task_cost(task_info["id"], task_info, "events/live/advanced", budget)
+
+            logger.info(budget.report())
+            if task_metadata_map and create_task_ledger_table_if_not_exists(db_conn):
+                record_task_ledger_entries(db_conn, task_metadata_map)
     
     logger.info("--- DataForSEO API Discovery Workflow Finished ---")
 
+    if PUSHGATEWAY_URL:
+        try:
+            prometheus_client.push_to_gateway(PUSHGATEWAY_URL, job="discovery_enhanced", registry=registry)
+            logger.info(f"Pushed discovery metrics to {PUSHGATEWAY_URL}.")
+        except Exception as e:
+            logger.error(f"Failed to push metrics to {PUSHGATEWAY_URL}: {e}")
+
     if db_conn:
         db_conn.close()
         logger.info("Database connection closed.")
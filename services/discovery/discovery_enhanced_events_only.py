@@ -19,6 +19,11 @@ import hashlib
 import re
 import sys  # Added for command line arguments
 
+# Shared service modules (metro_catalog, event_dedup) live one directory up
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from metro_catalog import load_metro_catalog, filter_metros
+from event_dedup import dedup_key, setup_dedup_columns
+
 # Setup basic logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -363,66 +368,15 @@ def load_metros_from_csv(csv_path):
             test_df[default_slug_column] = test_df['name'].apply(lambda x: str(x).lower().replace(" ", "_").replace("-", "_"))
         return test_df
     
-    try:
-        df = pd.read_csv(csv_path, encoding='utf-8')
-        logger.info(f"Loaded {len(df)} rows from {csv_path}")
-
-        # Ensure 'slug' column exists, create it if not
-        if default_slug_column not in df.columns:
-            if 'name' in df.columns:
-                logger.warning(f"'{default_slug_column}' column not found in {csv_path}. Creating from 'name' column.")
-                df[default_slug_column] = df['name'].apply(lambda x: str(x).lower().replace(" ", "_").replace("-", "_"))
-            elif 'asciiname' in df.columns: # Fallback to asciiname for slug creation
-                logger.warning(f"'{default_slug_column}' and 'name' columns not found. Creating from 'asciiname' column.")
-                df[default_slug_column] = df['asciiname'].apply(lambda x: str(x).lower().replace(" ", "_").replace("-", "_"))
-            else:
-                logger.error(f"Cannot create '{default_slug_column}' as neither 'name' nor 'asciiname' columns are present in {csv_path}.")
-                # Return an empty DataFrame or raise an error if slug is absolutely critical
-                return pd.DataFrame()
-        
-        # Ensure other critical columns have fallbacks or are handled if missing
-        if 'asciiname' not in df.columns:
-            if 'name' in df.columns:
-                logger.warning("'asciiname' column not found. Using 'name' column as fallback for API calls.")
-                df['asciiname'] = df['name'] # Use name if asciiname is missing
-            else:
-                logger.error("Neither 'asciiname' nor 'name' columns found. API calls for city names will likely fail.")
-                return pd.DataFrame() # Or handle error appropriately
-        
-        if 'country_code' not in df.columns:
-            logger.warning("'country_code' column not found. Location specificity for API calls might be reduced.")
-            df['country_code'] = "" # Add empty string if missing
-
-        if 'admin1_code' not in df.columns:
-            logger.warning("'admin1_code' column not found. US state-level specificity for API calls will be unavailable.")
-            df['admin1_code'] = "" # Add empty string if missing
-
-        # Ensure 'language_code' column exists, default to 'en' if not
-        if 'language_code' not in df.columns:
-            logger.warning("'language_code' column not found in CSV. Defaulting to 'en' (English) for all metros. Add this column for better local language targeting.")
-            df['language_code'] = 'en'
-        else:
-            # Fill any missing language_code values with 'en' as a fallback
-            df['language_code'] = df['language_code'].fillna('en')
-            logger.info("'language_code' column loaded. Ensure it contains valid 2-letter ISO language codes (e.g., 'es', 'fr').")
-
-        # Filter by population if the column exists, otherwise log warning and proceed
-        if 'population' in df.columns:
-            # Attempt to convert population to numeric, coercing errors to NaN
-            df['population'] = pd.to_numeric(df['population'], errors='coerce')
-            df = df[df['population'] > 10000]
-            logger.info(f"{len(df)} metros remaining after population filter (> 10000).")
-        else:
-            logger.warning("'population' column not found. Cannot filter by population.")
-            
-        return df
-
-    except FileNotFoundError: # This case should be caught by os.path.exists now, but good to keep
-        logger.error(f"Metro CSV file not found at {csv_path}. This shouldn't happen if os.path.exists check passed.")
-        return load_metros_from_csv(None) # Recurse to create test data
-    except Exception as e:
-        logger.error(f"Error loading or processing CSV from {csv_path}: {e}. Attempting to use test data.")
-        return load_metros_from_csv(None) # Recurse to create test data
+    # Typed, cached load shared with the collectors (see services/metro_catalog.py)
+    df = load_metro_catalog(csv_path)
+    if df.empty:
+        logger.error(f"Error loading or processing CSV from {csv_path}. Attempting to use test data.")
+        return load_metros_from_csv("") # Recurse to create test data
+
+    df = filter_metros(df, min_population=10000)
+    logger.info(f"{len(df)} metros remaining after population filter (> 10000).")
+    return df
     
 # --- Database Helper Functions ---
 def get_db_connection():
@@ -469,7 +423,8 @@ def create_event_raw_table_if_not_exists(db_conn):
             cur.execute(create_table_sql)
             db_conn.commit()
             logger.info("Ensured 'event_raw' table exists (or was created to match specified schema if missing).")
-        return True
+        # canonical_url/url_hash dedup key; added separately so existing tables pick it up too
+        return setup_dedup_columns(db_conn)
     except psycopg2.Error as e:
         logger.error(f"Error creating/checking 'event_raw' table: {e}")
         db_conn.rollback()
@@ -494,19 +449,20 @@ def insert_into_event_raw(conn, source, source_event_id, metro_id, raw_data_payl
     # Make a copy to avoid modifying the original dict if it's reused
     final_raw_json = dict(raw_data_payload)
     final_raw_json["_script_discovery_metadata"] = script_metadata
+    canonical_url, url_hash = dedup_key(raw_data_payload)
     
     sql_insert = """
-        INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, discovered_at)
-        VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP(3))
-        ON CONFLICT (source, source_event_id) DO NOTHING;
+        INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, canonical_url, url_hash, discovered_at)
+        VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP(3))
+        ON CONFLICT DO NOTHING;
     """
-    # We use DO NOTHING. If an update is needed, the conflict target and SET clause would change.
+    # We use DO NOTHING without a target so both (source, source_event_id) and (source, url_hash) dedupe.
     # For DO NOTHING to work effectively, source_event_id should be reliably unique for a given source.
     # If source_event_id is NULL, ON CONFLICT might not behave as expected for multiple NULLs.
 
     try:
         with conn.cursor() as cur:
-            cur.execute(sql_insert, (source, source_event_id, metro_id, Json(final_raw_json)))
+            cur.execute(sql_insert, (source, source_event_id, metro_id, Json(final_raw_json), canonical_url, url_hash))
             conn.commit()
             if cur.rowcount > 0:
                 logger.info(f"Successfully inserted into event_raw: source_id={source_event_id}, source={source}.")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+enrichment_cache.py
+
+Content-hash memoization for LLM enrichment. Recurring weekly classes and
+events scraped from several sources send the same text to the model over and
+over; results are keyed on a hash of the normalized title and description,
+the requested fields and the prompt/model version, and kept in an in-process
+LRU backed by the enrichment_cache table. Bumping the version string changes
+every key, so old results are never served for a new prompt or model.
+"""
+
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+DEFAULT_LRU_SIZE = 10000
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Lowercases and collapses whitespace so formatting-only differences share a key."""
+    if not text:
+        return ""
+    return _WHITESPACE_RE.sub(" ", str(text)).strip().lower()
+
+
+def enrichment_cache_key(title, description, fields, version):
+    """
+    SHA-256 key for one enrichment request.
+
+    Args:
+        title: Event title (may be empty).
+        description: Text sent to the model.
+        fields: Requested output fields; order does not matter.
+        version: Prompt/model version string, e.g. "event-enrichment-qwen:v1".
+    """
+    material = json.dumps(
+        [normalize_text(title), normalize_text(description), sorted(fields or []), version],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def setup_enrichment_cache_table(conn):
+    """Creates the enrichment_cache table if it doesn't exist."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS enrichment_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    namespace TEXT NOT NULL,
+                    result JSONB NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0,
+                    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                    last_hit_at TIMESTAMPTZ
+                );
+            """)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"Error setting up enrichment_cache table: {e}")
+        conn.rollback()
+        return False
+
+
+class EnrichmentCache:
+    """
+    In-process LRU in front of the enrichment_cache table. Methods take the
+    caller's connection (or None for LRU only) so the cache can be shared by
+    stages that each own a connection. Database errors are logged and treated
+    as misses; a cache problem never fails enrichment.
+    """
+
+    def __init__(self, max_entries=DEFAULT_LRU_SIZE):
+        self.max_entries = max_entries
+        self.lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key, result):
+        self.lru[key] = result
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.max_entries:
+            self.lru.popitem(last=False)
+
+    def get_many(self, conn, keys):
+        """Returns {key: result} for every key found in the LRU or the table."""
+        found, missing = {}, []
+        with self.lock:
+            for key in set(keys):
+                if key in self.lru:
+                    self.lru.move_to_end(key)
+                    found[key] = self.lru[key]
+                else:
+                    missing.append(key)
+        if missing and conn is not None:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        UPDATE enrichment_cache
+                        SET hit_count = hit_count + 1, last_hit_at = NOW()
+                        WHERE cache_key = ANY(%s)
+                        RETURNING cache_key, result
+                    """, (missing,))
+                    rows = cur.fetchall()
+                conn.commit()
+                with self.lock:
+                    for key, result in rows:
+                        self._remember(key, result)
+                        found[key] = result
+            except psycopg2.Error as e:
+                logging.warning(f"Enrichment cache lookup failed: {e}")
+                conn.rollback()
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def get(self, conn, key):
+        return self.get_many(conn, [key]).get(key)
+
+    def put_many(self, conn, namespace, entries):
+        """Stores {key: result}; empty results are not cached so failures get retried."""
+        entries = {key: result for key, result in entries.items() if result}
+        if not entries:
+            return
+        with self.lock:
+            for key, result in entries.items():
+                self._remember(key, result)
+        if conn is None:
+            return
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, """
+                    INSERT INTO enrichment_cache (cache_key, namespace, result)
+                    VALUES %s
+                    ON CONFLICT (cache_key) DO UPDATE SET result = EXCLUDED.result, created_at = NOW()
+                """, [(key, namespace, Json(result)) for key, result in entries.items()])
+            conn.commit()
+        except psycopg2.Error as e:
+            logging.warning(f"Enrichment cache write of {len(entries)} result(s) failed: {e}")
+            conn.rollback()
+
+    def put(self, conn, namespace, key, result):
+        self.put_many(conn, namespace, {key: result})
+
+    def summary(self):
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return f"enrichment cache: {self.hits} hit(s), {self.misses} miss(es) ({rate:.0f}% hit rate)"
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+event_dedup.py
+
+First-class URL dedup key for event_raw. Every ingestion path stores
+canonical_url and its SHA-1 (url_hash) next to the payload; a unique index on
+(source, url_hash) lets inserts skip duplicates with ON CONFLICT DO NOTHING
+instead of scanning raw_json->>'url', so ingest cost stays flat as the table
+grows.
+
+Run directly to add the columns/index and backfill existing rows:
+    python services/event_dedup.py
+"""
+
+import os
+import hashlib
+import logging
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import psycopg2
+from psycopg2.extras import Json, execute_values
+
+# Query parameters that only identify the referrer/campaign, never the event
+TRACKING_PARAMS = {
+    "fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid",
+    "ref", "ref_src", "referrer", "aff", "affiliate_id", "_ga", "_gl", "aff_id",
+}
+TRACKING_PREFIXES = ("utm_",)
+URL_FIELDS = ("url", "eventUrl", "event_url")
+BACKFILL_BATCH_SIZE = 5000
+
+
+def canonicalize_url(url):
+    """
+    Normalizes an event URL so trivially different links to the same page
+    collide: lowercase scheme/host, no 'www.', default ports, fragment,
+    tracking parameters or trailing slash, and sorted query parameters.
+    Returns None for anything that is not an http(s) URL.
+    """
+    if not isinstance(url, str):
+        return None
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in ("http", "https") or not parts.hostname:
+        return None
+    host = parts.hostname.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+    path = parts.path.rstrip("/") or "/"
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)
+    )
+    # http and https variants of a page are the same event
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+
+def url_hash(canonical_url):
+    return hashlib.sha1(canonical_url.encode("utf-8")).hexdigest() if canonical_url else None
+
+
+def extract_event_url(payload):
+    """The event's own URL from a raw payload (DataForSEO/TM/Eventbrite 'url', Meetup 'eventUrl')."""
+    if not isinstance(payload, dict):
+        return None
+    for field in URL_FIELDS:
+        if isinstance(payload.get(field), str) and payload[field]:
+            return payload[field]
+    return None
+
+
+def dedup_key(payload_or_url):
+    """Returns (canonical_url, url_hash) for a payload dict or URL string; (None, None) when there is no URL."""
+    url = payload_or_url if isinstance(payload_or_url, str) else extract_event_url(payload_or_url)
+    canonical = canonicalize_url(url)
+    return canonical, url_hash(canonical)
+
+
+def setup_dedup_columns(conn):
+    """Adds canonical_url/url_hash to event_raw with a unique (source, url_hash) index. Idempotent; mirrors drizzle/0007."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("ALTER TABLE event_raw ADD COLUMN IF NOT EXISTS canonical_url TEXT")
+            cur.execute("ALTER TABLE event_raw ADD COLUMN IF NOT EXISTS url_hash TEXT")
+            # NULL hashes (payloads without an event URL, e.g. whole SERP pages) never conflict
+            cur.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS event_raw_source_url_hash_idx
+                ON event_raw (source, url_hash)
+            """)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"Error setting up event_raw dedup columns: {e}")
+        conn.rollback()
+        return False
+
+
+def insert_raw_events(conn, rows):
+    """
+    Inserts event_raw rows in one statement, skipping URL or source-ID duplicates.
+
+    Args:
+        rows: list of (source, source_event_id, metro_id, payload dict)
+
+    Returns:
+        Number of rows inserted. Raises psycopg2.Error for the caller to roll back.
+    """
+    values, seen = [], set()
+    for source, source_event_id, metro_id, payload in rows:
+        canonical_url, key = dedup_key(payload)
+        if key:
+            if (source, key) in seen:
+                continue
+            seen.add((source, key))
+        values.append((source, source_event_id, metro_id, Json(payload), canonical_url, key))
+    if not values:
+        return 0
+    with conn.cursor() as cur:
+        inserted = execute_values(cur, """
+            INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, canonical_url, url_hash)
+            VALUES %s
+            ON CONFLICT DO NOTHING
+            RETURNING id
+        """, values, fetch=True)
+    return len(inserted)
+
+
+def backfill_dedup_columns(conn, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Fills canonical_url/url_hash for existing rows in id order. Rows that
+    duplicate an already keyed row keep a NULL hash so the unique index holds.
+    Returns the number of rows keyed.
+    """
+    keyed = 0
+    last_id = 0
+    while True:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, source, raw_json->>'url', raw_json->>'eventUrl', raw_json->>'event_url'
+                FROM event_raw
+                WHERE id > %s AND url_hash IS NULL
+                ORDER BY id
+                LIMIT %s
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        updates, seen = [], set()
+        for row_id, source, *urls in rows:
+            canonical = canonicalize_url(next((u for u in urls if u), None))
+            if not canonical:
+                continue
+            key = (source, url_hash(canonical))
+            if key in seen:
+                continue
+            seen.add(key)
+            updates.append((row_id, canonical, key[1]))
+        if updates:
+            try:
+                with conn.cursor() as cur:
+                    execute_values(cur, """
+                        UPDATE event_raw AS e
+                        SET canonical_url = v.canonical_url, url_hash = v.url_hash
+                        FROM (VALUES %s) AS v(id, canonical_url, url_hash)
+                        WHERE e.id = v.id
+                        AND NOT EXISTS (
+                            SELECT 1 FROM event_raw d WHERE d.source = e.source AND d.url_hash = v.url_hash
+                        )
+                    """, updates, template="(%s::integer, %s, %s)")
+                    keyed += cur.rowcount
+                conn.commit()
+            except psycopg2.Error as e:
+                logging.error(f"Error backfilling dedup keys after id {last_id}: {e}")
+                conn.rollback()
+                break
+        logging.info(f"Backfilled dedup keys up to event_raw.id {last_id} ({keyed} keyed so far).")
+    return keyed
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    database_url = os.getenv("DATABASE_URL")
+    if not database_url:
+        logging.error("DATABASE_URL environment variable not set. Exiting.")
+        return
+    conn = psycopg2.connect(database_url)
+    try:
+        if setup_dedup_columns(conn):
+            keyed = backfill_dedup_columns(conn)
+            logging.info(f"Dedup backfill complete: {keyed} rows keyed.")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
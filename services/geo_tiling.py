@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+geo_tiling.py
+
+Plans a near-minimal set of radius queries that still covers every metro.
+Neighbouring metros (suburbs within a few km of each other) used to get their
+own 50 km query each, so dense regions fetched the same events many times.
+The planner runs a greedy set cover over geohash cell centres: a candidate
+centre covers a metro when the metro's whole 25 km bbox fits inside the query
+circle. Events returned for a tile are assigned back to metros by
+point-in-bbox.
+"""
+
+import math
+import heapq
+import logging
+from collections import defaultdict, namedtuple
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE_LAT = 111.0
+KM_PER_DEGREE_LON_EQUATOR = 111.32
+METRO_BUFFER_KM = 25.0  # Same buffer enrich_geonames uses for bbox_wkt
+DEFAULT_GEOHASH_PRECISION = 5  # ~4.9 km x 4.9 km cells
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+MetroBox = namedtuple("MetroBox", ["geonameid", "name", "latitude", "longitude",
+                                   "min_lat", "max_lat", "min_lon", "max_lon"])
+
+# geonameid/name/latitude/longitude mirror the collector's Metro tuple so a
+# tile can be passed wherever a metro is expected. geonameid is the tile's
+# primary (first listed) metro; checkpoints and high-water marks are kept for
+# every metro in metros (see query_metro_ids in collector_runtime.py).
+QueryTile = namedtuple("QueryTile", ["geonameid", "name", "latitude", "longitude", "tile_id", "metros"])
+
+
+def geohash_encode(latitude, longitude, precision=DEFAULT_GEOHASH_PRECISION):
+    """Standard base32 geohash of a point."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash):
+    """Returns (min_lat, max_lat, min_lon, max_lon) of a geohash cell."""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if (value >> shift) & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def geohash_center(geohash):
+    min_lat, max_lat, min_lon, max_lon = geohash_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _lon_degrees(km, latitude):
+    denominator = KM_PER_DEGREE_LON_EQUATOR * abs(math.cos(math.radians(latitude)))
+    return km / denominator if denominator else 180.0
+
+
+def metro_box(metro, buffer_km=METRO_BUFFER_KM):
+    """The metro's bbox, computed the same way as enrich_geonames.get_bbox_wkt."""
+    lat, lon = float(metro.latitude), float(metro.longitude)
+    lat_buffer = buffer_km / KM_PER_DEGREE_LAT
+    lon_buffer = _lon_degrees(buffer_km, lat)
+    return MetroBox(metro.geonameid, metro.name, lat, lon,
+                    lat - lat_buffer, lat + lat_buffer, lon - lon_buffer, lon + lon_buffer)
+
+
+def _candidate_cells(box, reach_km, precision):
+    """Geohash cells whose centre is within reach_km of the metro (sampled at cell spacing)."""
+    min_lat, max_lat, min_lon, max_lon = geohash_bounds(geohash_encode(box.latitude, box.longitude, precision))
+    lat_step = max_lat - min_lat
+    lon_step = max_lon - min_lon
+    lat_reach = reach_km / KM_PER_DEGREE_LAT
+    lon_reach = _lon_degrees(reach_km, box.latitude)
+    cells = set()
+    lat = box.latitude - lat_reach
+    while lat <= box.latitude + lat_reach:
+        lon = box.longitude - lon_reach
+        while lon <= box.longitude + lon_reach:
+            if -90 <= lat <= 90 and -180 <= lon < 180:
+                cells.add(geohash_encode(lat, lon, precision))
+            lon += lon_step
+        lat += lat_step
+    return cells
+
+
+def _bucket(latitude, longitude):
+    # 0.5 deg lat x 1 deg lon buckets are wider than any reach we use below ~75 deg N
+    return int(math.floor(latitude * 2)), int(math.floor(longitude))
+
+
+def plan_query_tiles(metros, radius_km, buffer_km=METRO_BUFFER_KM, precision=DEFAULT_GEOHASH_PRECISION):
+    """
+    Greedy set cover of metros by query circles of radius_km.
+
+    Args:
+        metros: Iterable of tuples with geonameid, name, latitude and longitude.
+        radius_km: The source's search radius.
+        buffer_km: Metro bbox half-width; a metro is covered when its bbox fits in the circle.
+        precision: Geohash precision of the candidate centre grid.
+
+    Returns:
+        List of QueryTile. Every metro with coordinates appears in exactly one
+        tile; metros without coordinates are logged and left out.
+    """
+    boxes = []
+    for metro in metros:
+        try:
+            box = metro_box(metro, buffer_km)
+        except (TypeError, ValueError):
+            box = None
+        if box is not None and not (math.isnan(box.latitude) or math.isnan(box.longitude)):
+            boxes.append(box)
+        else:
+            logging.warning(f"Metro {metro.geonameid} has no usable coordinates; it will not be tiled.")
+    # Circle containing the whole bbox: centre within radius - half-diagonal of the bbox
+    reach_km = radius_km - buffer_km * math.sqrt(2)
+    if reach_km <= 0 or not boxes:
+        return [QueryTile(box.geonameid, box.name, box.latitude, box.longitude,
+                          geohash_encode(box.latitude, box.longitude, precision), (box,)) for box in boxes]
+
+    buckets = defaultdict(list)
+    for index, box in enumerate(boxes):
+        buckets[_bucket(box.latitude, box.longitude)].append(index)
+
+    # Candidate centres: each metro's own position (always covers itself) plus grid cell centres nearby
+    candidates = {}
+    for index, box in enumerate(boxes):
+        candidates[f"m{box.geonameid}"] = (box.latitude, box.longitude)
+        for cell in _candidate_cells(box, reach_km, precision):
+            if cell not in candidates:
+                candidates[cell] = geohash_center(cell)
+
+    coverage = {}
+    for key, (lat, lon) in candidates.items():
+        lat_bucket, lon_bucket = _bucket(lat, lon)
+        covered = set()
+        for d_lat in (-1, 0, 1):
+            for d_lon in (-1, 0, 1):
+                for index in buckets.get((lat_bucket + d_lat, lon_bucket + d_lon), ()):
+                    box = boxes[index]
+                    if haversine_km(lat, lon, box.latitude, box.longitude) <= reach_km:
+                        covered.add(index)
+        if covered:
+            coverage[key] = covered
+
+    # Lazy greedy: heap keyed on the (possibly stale) number of still-uncovered metros
+    uncovered = set(range(len(boxes)))
+    heap = [(-len(covered), key) for key, covered in coverage.items()]
+    heapq.heapify(heap)
+    tiles = []
+    while uncovered and heap:
+        stale_count, key = heapq.heappop(heap)
+        gain = coverage[key] & uncovered
+        if not gain:
+            continue
+        if len(gain) < -stale_count:
+            heapq.heappush(heap, (-len(gain), key))
+            continue
+        uncovered -= gain
+        lat, lon = candidates[key]
+        # Keep catalog order inside the tile so the primary metro is the first listed
+        member_indexes = sorted(gain)
+        members = tuple(boxes[index] for index in member_indexes)
+        primary = members[0]
+        tile_id = key[1:] if key.startswith("m") else key
+        name = primary.name if len(members) == 1 else f"{primary.name} +{len(members) - 1}"
+        tiles.append((member_indexes[0], QueryTile(primary.geonameid, name, lat, lon, tile_id, members)))
+
+    # Query tiles in catalog order of their primary metro, like the untiled sweep
+    tiles = [tile for _, tile in sorted(tiles, key=lambda entry: entry[0])]
+    logging.info(f"Geo-tiling planned {len(tiles)} query circles of {radius_km} km for {len(boxes)} metros "
+                 f"({len(boxes) - len(tiles)} queries saved).")
+    return tiles
+
+
+def assign_metro(tile, latitude, longitude):
+    """
+    Picks the metro for an event returned by a tile query: the metro whose
+    bbox contains the point (nearest centre if several do), else the nearest
+    metro in the tile, else the tile's primary metro when the event has no
+    coordinates.
+    """
+    if latitude is None or longitude is None or len(tile.metros) == 1:
+        return tile.geonameid
+    try:
+        lat, lon = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return tile.geonameid
+    inside = [box for box in tile.metros
+              if box.min_lat <= lat <= box.max_lat and box.min_lon <= lon <= box.max_lon]
+    pool = inside or tile.metros
+    return min(pool, key=lambda box: haversine_km(lat, lon, box.latitude, box.longitude)).geonameid
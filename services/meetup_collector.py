@@ -1,21 +1,24 @@
 import os
-import requests
-import psycopg2
-import json
-import time
 import logging
-import pandas as pd
+from functools import lru_cache
+from collections import namedtuple
 from dotenv import load_dotenv
+from collector_checkpoints import PostgresCheckpointStore, PostgresWatermarkStore, parse_checkpoint_args
+from collector_runtime import (
+    CollectorSource, resolve_metro_csv_path, load_collector_metros, run_collector,
+)
 
 # --- Configuration ---
 load_dotenv()
 
 MEETUP_API_KEY = os.getenv("MEETUP_OAUTH_TOKEN") # Assuming OAuth2 Token, rename if using API Key
 DATABASE_URL = os.getenv("DATABASE_URL")
-METRO_CSV_PATH = "geonames_na_sa_eu_top1785.csv" # Updated base path
-REQUEST_DELAY = 1.5 # Delay between Meetup API calls
+MEETUP_RATE_PER_SECOND = float(os.getenv("MEETUP_RATE_PER_SECOND", 1 / 1.5)) # Was a fixed 1.5s delay between calls
+MEETUP_CONCURRENCY = int(os.getenv("MEETUP_CONCURRENCY", 4))
+MEETUP_MAX_PAGES = 3 # Limit pagination per metro
+MEETUP_SEARCH_RADIUS_MILES = 30
+MEETUP_BATCH_SIZE = int(os.getenv("MEETUP_BATCH_SIZE", 5)) # Aliased searches per GraphQL request; 1 disables batching
 MEETUP_GRAPHQL_URL = "https://api.meetup.com/gql"
-DB_TABLE = "event_raw"
 SOURCE_NAME = "meetup"
 
 # Define dance style keywords for text search (might need adjustment for Meetup)
@@ -28,49 +31,10 @@ DANCE_KEYWORDS = [
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# --- Database Functions (Reusing from eventbrite collector logic) ---
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(DATABASE_URL)
-        logging.info("Database connection established.")
-        return conn
-    except psycopg2.Error as e:
-        logging.error(f"Database connection error: {e}")
-        return None
-
-def insert_raw_event(conn, source, source_id, event_data, metro_id=None):
-    sql = f"""
-        INSERT INTO {DB_TABLE} (source, source_event_id, raw_json, metro_id, discovered_at)
-        VALUES (%s, %s, %s, %s, NOW())
-        ON CONFLICT (source, source_event_id) DO NOTHING;
-        """
-    try:
-        with conn.cursor() as cur:
-            raw_json_str = json.dumps(event_data)
-            cur.execute(sql, (source, source_id, raw_json_str, metro_id))
-        conn.commit()
-        return True
-    except psycopg2.Error as e:
-        logging.error(f"Database insert error for source_id {source_id}: {e}")
-        conn.rollback()
-        return False
-    except Exception as e:
-        logging.error(f"Error converting event data to JSON for source_id {source_id}: {e}")
-        conn.rollback()
-        return False
-
 # --- Meetup GraphQL API Functions ---
 
-def build_meetup_query(keywords, lat, lon, radius_miles=30, first=50, after_cursor=None):
-    """Constructs the GraphQL query string for Meetup event search."""
-    # Combine keywords into a search string suitable for Meetup
-    topic_string = " OR ".join(keywords)
-    
-    # Basic query structure - Needs refinement based on Meetup Schema exploration!
-    # This is a conceptual example.
-    query = """
-    query($lat: Float!, $lon: Float!, $radius: Int!, $topic: String!, $first: Int!, $after: String) {
-      keywordSearch(filter: { query: $topic, lat: $lat, lon: $lon, radius: $radius, source: EVENTS }, first: $first, after: $after) {
+# Fields selected for every aliased keywordSearch. Needs refinement based on Meetup Schema exploration!
+EVENT_SEARCH_SELECTION = """{
         count
         pageInfo {
           endCursor
@@ -79,6 +43,7 @@ def build_meetup_query(keywords, lat, lon, radius_miles=30, first=50, after_curs
         edges {
           node {
             result {
+              __typename
               ... on Event {
                 id
                 title
@@ -101,46 +66,118 @@ def build_meetup_query(keywords, lat, lon, radius_miles=30, first=50, after_curs
                   id
                   name
                   urlname
-                  # Add other group fields if needed
                 }
-                # Add other event fields like timezone, hosts, fees, etc. as needed
               }
             }
           }
         }
-      }
-    }
+      }"""
+
+MetroBatch = namedtuple("MetroBatch", ["geonameid", "name", "latitude", "longitude", "members"])
+
+
+@lru_cache(maxsize=None)
+def build_batched_search_document(member_indexes):
     """
-    variables = {
-        "lat": lat,
-        "lon": lon,
-        "radius": radius_miles,
-        "topic": topic_string, 
-        "first": first
-    }
-    if after_cursor:
-        variables["after"] = after_cursor
-        
-    return query, variables
-
-def fetch_meetup_events(api_key, graphql_url, variables, query):
-    """Fetches events from Meetup GraphQL API."""
-    headers = {"Authorization": f"Bearer {api_key}"}
-    try:
-        response = requests.post(graphql_url, json={'query': query, 'variables': variables}, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Meetup API request failed: {e}")
-        if hasattr(e, 'response') and e.response is not None:
-            logging.error(f"Response status: {e.response.status_code}, Response text: {e.response.text[:200]}")
-        return None
-    except Exception as e:
-        logging.error(f"Error processing Meetup response: {e}")
-        return None
+    GraphQL document with one aliased keywordSearch (m<index>) per batch
+    member. Documents are built once per member set and reused, so each call
+    only sends new variables.
+    """
+    variable_defs = ["$topic: String!", "$radius: Int!", "$first: Int!"]
+    searches = []
+    for index in member_indexes:
+        variable_defs += [f"$lat{index}: Float!", f"$lon{index}: Float!", f"$after{index}: String"]
+        searches.append(
+            f"m{index}: keywordSearch(filter: {{ query: $topic, lat: $lat{index}, lon: $lon{index}, "
+            f"radius: $radius, source: EVENTS }}, first: $first, after: $after{index}) {EVENT_SEARCH_SELECTION}"
+        )
+    return "query(" + ", ".join(variable_defs) + ") {\n      " + "\n      ".join(searches) + "\n    }"
+
+
+def build_batched_search_variables(batch, cursors, keywords, radius_miles=MEETUP_SEARCH_RADIUS_MILES, first=50):
+    """Variables for the members still being paged. cursors maps member index -> endCursor (None = first page)."""
+    variables = {"topic": " OR ".join(keywords), "radius": radius_miles, "first": first}
+    for index, after_cursor in cursors.items():
+        member = batch.members[index]
+        variables[f"lat{index}"] = member.latitude
+        variables[f"lon{index}"] = member.longitude
+        variables[f"after{index}"] = after_cursor
+    return variables
+
+
+def make_batches(queries, batch_size):
+    """
+    Groups metros/tiles into batches that share one request document. The
+    batch's geonameid and name (its first member) only label it in logs; the
+    runtime checkpoints every member under its own geonameid.
+    """
+    batches = []
+    for start in range(0, len(queries), batch_size):
+        members = tuple(queries[start:start + batch_size])
+        first = members[0]
+        name = first.name if len(members) == 1 else f"{first.name} +{len(members) - 1}"
+        batches.append(MetroBatch(first.geonameid, name, first.latitude, first.longitude, members))
+    return batches
+
+# --- Meetup Source ---
+class MeetupSource(CollectorSource):
+    """
+    Meetup GraphQL keywordSearch. Up to MEETUP_BATCH_SIZE metros share one
+    request as aliased searches; the cursor maps each member still paging
+    to its endCursor, and pages of different batches run concurrently.
+    Checkpoints are kept per member (see collect_batch in collector_runtime).
+    """
+
+    name = SOURCE_NAME
+    rate_per_second = MEETUP_RATE_PER_SECOND
+    max_pages = MEETUP_MAX_PAGES
+    search_radius_km = MEETUP_SEARCH_RADIUS_MILES * 1.609
+
+    def __init__(self, api_key, batch_size=MEETUP_BATCH_SIZE):
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.batch_size = max(1, batch_size)
+
+    def group_queries(self, queries):
+        return make_batches(list(queries), self.batch_size)
+
+    def batch_members(self, query):
+        return query.members
+
+    def build_request(self, batch, cursor, since=None):
+        cursors = cursor or dict.fromkeys(range(len(batch.members)))
+        document = build_batched_search_document(tuple(sorted(cursors)))
+        variables = build_batched_search_variables(batch, cursors, DANCE_KEYWORDS)
+        return {"method": "POST", "url": MEETUP_GRAPHQL_URL,
+                "json": {'query': document, 'variables': variables}, "headers": self.headers}
+
+    def extract(self, data, batch):
+        if not data or "errors" in data:
+            # Raising marks the page as failed so the runtime does not checkpoint it as complete
+            raise ValueError(f"GraphQL query failed. Response: {str(data)[:500]}")
+        items = []
+        next_cursors = {}
+        for alias, search_results in (data.get("data") or {}).items():
+            index = int(alias[1:])
+            member = batch.members[index]
+            if not search_results:
+                logging.warning(f"No 'keywordSearch' results for metro {member.geonameid}.")
+                continue
+            for edge in search_results.get("edges", []):
+                event_node = (edge.get("node") or {}).get("result") or {}
+                if event_node.get("__typename") != "Event":
+                    continue
+                items.append((event_node.get('id'), event_node, member))
+            page_info = search_results.get("pageInfo", {})
+            if page_info.get("hasNextPage", False) and page_info.get("endCursor"):
+                next_cursors[index] = page_info["endCursor"]
+        return items, next_cursors or None
+
+    def item_location(self, payload):
+        venue = payload.get("venue") or {}
+        return venue.get("lat"), venue.get("lon")
 
 # --- Main Logic ---
-def main():
+def main(args):
     if not MEETUP_API_KEY:
         logging.error("MEETUP_OAUTH_TOKEN environment variable not set. Exiting.")
         return
@@ -148,103 +185,22 @@ def main():
         logging.error("DATABASE_URL environment variable not set. Exiting.")
         return
 
-    conn = get_db_connection()
-    if not conn:
-        return
-
-    # Load metro data
-    try:
-        metros_df = pd.read_csv(METRO_CSV_PATH)
-        if 'geonameid' not in metros_df.columns or 'latitude' not in metros_df.columns or 'longitude' not in metros_df.columns:
-            logging.error(f"CSV file '{METRO_CSV_PATH}' missing required columns. Exiting.")
-            return
-        logging.info(f"Loaded {len(metros_df)} metros from {METRO_CSV_PATH}")
-    except FileNotFoundError:
-        logging.error(f"Metro CSV file not found at '{METRO_CSV_PATH}'. Exiting.")
+    metro_csv_path = resolve_metro_csv_path(__file__)
+    if not metro_csv_path:
         return
-    except Exception as e:
-        logging.error(f"Error reading metro CSV file: {e}. Exiting.")
+    metros_df = load_collector_metros(metro_csv_path)
+    if metros_df is None:
         return
 
-    total_events_processed = 0
-    total_events_inserted = 0
-
-    # Iterate through metros
-    for index, metro in metros_df.iterrows():
-        metro_id = metro['geonameid']
-        latitude = metro['latitude']
-        longitude = metro['longitude']
-        metro_name = metro['name']
-        logging.info(f"Processing metro: {metro_name} ({metro_id}) ({index + 1}/{len(metros_df)})")
-
-        # --- Meetup API Call for this metro --- 
-        after_cursor = None
-        has_next_page = True
-        pages_fetched = 0
-        max_pages = 3 # Limit pagination per metro
-
-        while has_next_page and pages_fetched < max_pages:
-            pages_fetched += 1
-            query, variables = build_meetup_query(DANCE_KEYWORDS, latitude, longitude, after_cursor=after_cursor)
-            data = fetch_meetup_events(MEETUP_API_KEY, MEETUP_GRAPHQL_URL, variables, query)
-            
-            if not data or "errors" in data:
-                logging.error(f"GraphQL query failed for metro {metro_id}. Response: {data}")
-                break # Stop processing this metro
-
-            search_results = data.get("data", {}).get("keywordSearch", {})
-            if not search_results:
-                logging.warning(f"No 'keywordSearch' results in response for metro {metro_id}. Response: {data}")
-                break
-
-            events = search_results.get("edges", [])
-            total_events_processed += len(events)
-
-            for edge in events:
-                event_node = edge.get("node", {}).get("result", {})
-                if not event_node or event_node.get("__typename") != "Event":
-                    continue
-
-                source_id = event_node.get('id')
-                if not source_id:
-                    logging.warning("Found Meetup event without ID, skipping.")
-                    continue
-                    
-                if insert_raw_event(conn, SOURCE_NAME, source_id, event_node, metro_id):
-                    total_events_inserted += 1
-                else:
-                    logging.warning(f"Failed to insert Meetup event {source_id} for metro {metro_id}")
-            
-            # Pagination
-            page_info = search_results.get("pageInfo", {})
-            has_next_page = page_info.get("hasNextPage", False)
-            after_cursor = page_info.get("endCursor")
-
-            if not has_next_page:
-                 logging.debug(f"No more pages for Meetup query on metro {metro_id}.")
-            
-            time.sleep(REQUEST_DELAY) # Delay between pages/requests
-        # --- End Meetup API Call for this metro --- 
-
-    logging.info("Meetup collection completed.")
-    logging.info(f"Total events processed: {total_events_processed}")
-    logging.info(f"Total unique events inserted/updated: {total_events_inserted}")
-
-    conn.close()
-    logging.info("Database connection closed.")
+    checkpoint = PostgresCheckpointStore(DATABASE_URL, resume=args.resume, fresh_hours=args.fresh_hours)
+    watermarks = PostgresWatermarkStore(DATABASE_URL, args.full_sweep_hours) if args.incremental else None
+    try:
+        run_collector(MeetupSource(MEETUP_API_KEY), metros_df, MEETUP_CONCURRENCY, DATABASE_URL,
+                      checkpoint=checkpoint, geo_tiles=args.geo_tiles, watermarks=watermarks)
+    finally:
+        checkpoint.close()
+        if watermarks:
+            watermarks.close()
 
 if __name__ == "__main__":
-    # Make sure the CSV path is accessible (similar check as eventbrite collector)
-    if not os.path.exists(METRO_CSV_PATH):
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        alt_path = os.path.join(script_dir, '..', METRO_CSV_PATH) # This will use the updated filename
-        container_path = "/app/geonames_na_sa_eu_top1785.csv"   # Updated container path filename
-        if os.path.exists(alt_path):
-            METRO_CSV_PATH = alt_path
-        elif os.path.exists(container_path):
-            METRO_CSV_PATH = container_path
-        else:
-            logging.error(f"Cannot find metro data CSV at expected paths. Exiting.")
-            exit()
-    
-    main() 
\ No newline at end of file
+    main(parse_checkpoint_args("Meetup event collector"))
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+metro_catalog.py
+
+Shared loader for the GeoNames metro CSV used by the discovery scripts and the
+Ticketmaster / Eventbrite / Meetup collectors. The CSV is parsed once into a
+typed, column-oriented DataFrame and cached on disk keyed on the file's mtime,
+so later runs skip CSV parsing entirely. Filters are vectorized and iteration
+yields lightweight named tuples instead of per-row Series.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION = 1
+CACHE_DIR = os.getenv("METRO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "metro_catalog_cache"))
+DEFAULT_MIN_POPULATION = 10000
+
+# Columns kept in the catalog and their dtypes. alternatenames and the other
+# unused GeoNames fields are dropped at read time; they dominate the file size.
+CATALOG_DTYPES = {
+    "geonameid": "int64",
+    "name": "string",
+    "asciiname": "string",
+    "latitude": "float64",
+    "longitude": "float64",
+    "country_code": "string",
+    "admin1_code": "string",
+    "population": "float64",
+    "timezone": "string",
+    "tz_offset_min": "float64",
+    "metro_tier": "float64",
+    "slug": "string",
+    "language_code": "string",
+    "location_code": "float64",
+}
+
+# Process-wide memo so several callers in one process share a single load
+_loaded_catalogs = {}
+
+try:
+    import pyarrow  # noqa: F401
+    CACHE_FORMAT = "parquet"
+except ImportError:
+    CACHE_FORMAT = "pickle"
+
+
+def _cache_path(csv_path, stat):
+    path_hash = hashlib.md5(os.path.abspath(csv_path).encode()).hexdigest()[:12]
+    extension = "parquet" if CACHE_FORMAT == "parquet" else "pkl"
+    return os.path.join(
+        CACHE_DIR,
+        f"metros_{path_hash}_{stat.st_mtime_ns}_{stat.st_size}_v{CATALOG_VERSION}.{extension}",
+    )
+
+
+def _read_cache(cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        if CACHE_FORMAT == "parquet":
+            return pd.read_parquet(cache_path)
+        return pd.read_pickle(cache_path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable metro catalog cache {cache_path}: {e}")
+        return None
+
+
+def _write_cache(df, cache_path):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Remove stale caches for the same CSV so the directory does not grow per edit
+        prefix = os.path.basename(cache_path).split("_")[1]
+        for existing in os.listdir(CACHE_DIR):
+            if existing.startswith(f"metros_{prefix}_"):
+                os.remove(os.path.join(CACHE_DIR, existing))
+        tmp_path = f"{cache_path}.tmp"
+        if CACHE_FORMAT == "parquet":
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.to_pickle(tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write metro catalog cache {cache_path}: {e}")
+
+
+def make_slugs(names):
+    """Vectorized slug creation matching the old row-wise lambda (lowercase, spaces/hyphens to underscores)."""
+    return names.astype("string").str.lower().str.replace(" ", "_", regex=False).str.replace("-", "_", regex=False)
+
+
+def _normalize(df, csv_path):
+    """Adds fallbacks for missing columns and applies the catalog dtypes."""
+    if "slug" not in df.columns:
+        if "name" in df.columns:
+            logger.warning(f"'slug' column not found in {csv_path}. Creating from 'name' column.")
+            df["slug"] = make_slugs(df["name"])
+        elif "asciiname" in df.columns:
+            logger.warning("'slug' and 'name' columns not found. Creating from 'asciiname' column.")
+            df["slug"] = make_slugs(df["asciiname"])
+        else:
+            logger.error(f"Cannot create 'slug' as neither 'name' nor 'asciiname' columns are present in {csv_path}.")
+            return pd.DataFrame()
+
+    if "asciiname" not in df.columns:
+        if "name" not in df.columns:
+            logger.error("Neither 'asciiname' nor 'name' columns found. API calls for city names will likely fail.")
+            return pd.DataFrame()
+        logger.warning("'asciiname' column not found. Using 'name' column as fallback for API calls.")
+        df["asciiname"] = df["name"]
+    if "name" not in df.columns:
+        df["name"] = df["asciiname"]
+
+    for column in ("country_code", "admin1_code"):
+        if column not in df.columns:
+            logger.warning(f"'{column}' column not found. Location specificity for API calls might be reduced.")
+            df[column] = ""
+        df[column] = df[column].fillna("")
+
+    if "language_code" not in df.columns:
+        logger.warning("'language_code' column not found in CSV. Defaulting to 'en' (English) for all metros.")
+        df["language_code"] = "en"
+    else:
+        df["language_code"] = df["language_code"].fillna("en")
+
+    if "population" in df.columns:
+        df["population"] = pd.to_numeric(df["population"], errors="coerce")
+
+    for column, dtype in CATALOG_DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    return df.reset_index(drop=True)
+
+
+def load_metro_catalog(csv_path, use_cache=True):
+    """
+    Loads the metro CSV into a typed DataFrame with only the catalog columns.
+
+    Args:
+        csv_path: Path to the GeoNames metro CSV.
+        use_cache: Reuse the on-disk cache when the CSV's mtime and size are unchanged.
+
+    Returns:
+        DataFrame (empty on error). Callers must not mutate it in place; use
+        filter_metros or .copy() to derive working sets.
+    """
+    try:
+        stat = os.stat(csv_path)
+    except OSError as e:
+        logger.error(f"Metro CSV file not found at {csv_path}: {e}")
+        return pd.DataFrame()
+
+    cache_path = _cache_path(csv_path, stat)
+    if cache_path in _loaded_catalogs:
+        return _loaded_catalogs[cache_path]
+
+    df = _read_cache(cache_path) if use_cache else None
+    if df is not None:
+        logger.info(f"Loaded {len(df)} metros from catalog cache for {csv_path}")
+    else:
+        try:
+            df = pd.read_csv(
+                csv_path,
+                encoding="utf-8",
+                usecols=lambda column: column in CATALOG_DTYPES,
+                dtype={"admin1_code": "string", "country_code": "string", "language_code": "string"},
+                keep_default_na=False,
+                na_values={"population": [""], "latitude": [""], "longitude": [""], "location_code": [""],
+                           "tz_offset_min": [""], "metro_tier": [""]},
+            )
+        except Exception as e:
+            logger.error(f"Error loading or processing CSV from {csv_path}: {e}")
+            return pd.DataFrame()
+        logger.info(f"Loaded {len(df)} rows from {csv_path}")
+        df = _normalize(df, csv_path)
+        if use_cache and not df.empty:
+            _write_cache(df, cache_path)
+
+    _loaded_catalogs[cache_path] = df
+    return df
+
+
+def filter_metros(df, min_population=None, countries=None, has_location_code=None, limit=None):
+    """
+    Vectorized metro selection.
+
+    Args:
+        min_population: Keep metros with population strictly greater than this.
+        countries: Iterable of ISO country codes to keep.
+        has_location_code: True/False to keep only metros with/without a DataForSEO location_code.
+        limit: Keep at most this many metros (in catalog order) after filtering.
+    """
+    mask = pd.Series(True, index=df.index)
+    if min_population is not None and "population" in df.columns:
+        mask &= df["population"] > min_population
+    if countries:
+        mask &= df["country_code"].str.upper().isin({c.upper() for c in countries})
+    if has_location_code is not None:
+        if "location_code" in df.columns:
+            mask &= df["location_code"].notna() if has_location_code else df["location_code"].isna()
+        elif has_location_code:
+            mask &= False
+    result = df[mask]
+    if limit:
+        result = result.head(limit)
+    return result.copy()
+
+
+def iter_metros(df, columns=None):
+    """
+    Yields one named tuple per metro (fields = column names), which is far
+    cheaper than iterrows(). Pass columns to restrict the tuple to the fields
+    a caller needs.
+    """
+    frame = df[list(columns)] if columns else df
+    return frame.itertuples(index=False, name="Metro")
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+"""
+semantic_dedup.py
+
+Embedding-based duplicate detection for event_clean. The same event reaches
+event_clean from several sources with different URLs and wording, so URL
+keys (event_dedup.py) miss it, and asking the LLM /dedupe endpoint about
+every pair is quadratic in the number of events per metro.
+
+Per metro, events are embedded through the inference service's /embed
+endpoint and bucketed into date windows. Each window is indexed in a FAISS
+index together with the following window (so events either side of a window
+boundary still meet), and every event queries its window's index for its
+nearest neighbours. Neighbours at least AUTO_MERGE_SIMILARITY apart are
+duplicates outright; those between CANDIDATE_SIMILARITY and
+AUTO_MERGE_SIMILARITY are borderline and escalate to /dedupe. Each event
+costs one insertion into at most two indexes and one k-NN query, so the
+stage grows roughly linearly with the number of events.
+
+Verdicts are grouped into clusters and stored in event_duplicate, pointing
+each duplicate at its cluster's lowest event_clean id. LLM verdicts are
+memoized in enrichment_cache, so reruns do not ask about the same pair again.
+
+Run directly for every metro (or --metro-id for one):
+    python services/semantic_dedup.py
+"""
+
+import os
+import time
+import logging
+import argparse
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+import psycopg2
+from psycopg2.extras import execute_values
+
+from enrichment_cache import EnrichmentCache, enrichment_cache_key, setup_enrichment_cache_table
+
+CANDIDATE_SIMILARITY = 0.85  # Cosine similarity at which a pair is worth a look
+AUTO_MERGE_SIMILARITY = 0.95  # At or above this the pair is a duplicate without asking the LLM
+WINDOW_DAYS = 3
+MAX_DAY_GAP = 1  # Weekly classes share their text; only events this close in date can be duplicates
+NEIGHBORS = 10
+HNSW_MIN_SIZE = 2000  # Smaller windows use an exact flat index, which is faster at that size
+EMBED_REQUEST_SIZE = 256  # Texts per /embed call
+DESCRIPTION_CHARS = 300
+REQUEST_TIMEOUT = 120
+MAX_RETRIES = 3
+LLM_VERDICT_VERSION = "dedupe-v1"
+LLM_VERDICT_NAMESPACE = "llm-dedupe"
+
+
+class InferenceClient:
+    """Minimal client for the Qwen inference service's /embed and /dedupe endpoints."""
+
+    def __init__(self, base_url, bearer_token, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["x-token"] = f"Bearer {bearer_token}"
+        self.timeout = timeout
+
+    def _post(self, path, payload):
+        for attempt in range(MAX_RETRIES):
+            response = self.session.post(f"{self.base_url}{path}", json={"request": payload}, timeout=self.timeout)
+            if response.status_code == 429 and attempt < MAX_RETRIES - 1:
+                # Admission control is shedding load; wait as long as it asks
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    def embed(self, texts):
+        """Unit-length embeddings for texts as a float32 array, EMBED_REQUEST_SIZE texts per call."""
+        vectors = []
+        for start in range(0, len(texts), EMBED_REQUEST_SIZE):
+            vectors.extend(self._post("/embed", {"texts": texts[start:start + EMBED_REQUEST_SIZE]})["embeddings"])
+        return np.asarray(vectors, dtype="float32").reshape(len(texts), -1)
+
+    def same_event(self, text_1, text_2):
+        return bool(self._post("/dedupe", {"event_text_1": text_1, "event_text_2": text_2})["is_same_event"])
+
+
+def event_text(json_data):
+    """The text embedded and shown to the LLM for one event: title, date, venue and the start of the description."""
+    location = json_data.get("location") if isinstance(json_data.get("location"), dict) else {}
+    parts = [
+        json_data.get("name"),
+        json_data.get("startDate"),
+        location.get("name"),
+        location.get("address") if isinstance(location.get("address"), str) else None,
+        (json_data.get("description") or "")[:DESCRIPTION_CHARS],
+    ]
+    return " | ".join(str(part).strip() for part in parts if part)
+
+
+def event_date(json_data):
+    """Start date of an event, or None when startDate is missing or not ISO formatted."""
+    start = json_data.get("startDate")
+    if not isinstance(start, str):
+        return None
+    try:
+        return datetime.date.fromisoformat(start.strip()[:10])
+    except ValueError:
+        return None
+
+
+def date_windows(dates, window_days=WINDOW_DAYS):
+    """Window number per event (ordinal day // window_days); undated events share window None."""
+    return [date.toordinal() // window_days if date else None for date in dates]
+
+
+def build_index(vectors):
+    """Inner-product FAISS index over unit vectors (inner product = cosine similarity)."""
+    import faiss
+
+    dimensions = vectors.shape[1]
+    if len(vectors) >= HNSW_MIN_SIZE:
+        index = faiss.IndexHNSWFlat(dimensions, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efSearch = max(64, 2 * NEIGHBORS)
+    else:
+        index = faiss.IndexFlatIP(dimensions)
+    index.add(vectors)
+    return index
+
+
+def candidate_pairs(vectors, windows, dates, threshold=CANDIDATE_SIMILARITY, neighbors=NEIGHBORS,
+                    max_day_gap=MAX_DAY_GAP):
+    """
+    Pairs of event positions (i < j) whose embeddings are at least threshold
+    similar and whose dates are at most max_day_gap apart.
+
+    Returns:
+        dict of (i, j) -> similarity
+    """
+    members = {}
+    for position, window in enumerate(windows):
+        members.setdefault(window, []).append(position)
+
+    pairs = {}
+    for window, positions in members.items():
+        # Undated events only meet each other; dated windows also see the next window
+        indexed = positions + (members.get(window + 1, []) if window is not None else [])
+        if len(indexed) < 2:
+            continue
+        index = build_index(vectors[indexed])
+        similarities, neighbor_rows = index.search(vectors[positions], min(neighbors + 1, len(indexed)))
+        for position, row_similarities, row_neighbors in zip(positions, similarities, neighbor_rows):
+            for similarity, row in zip(row_similarities, row_neighbors):
+                if row < 0 or similarity < threshold:
+                    continue
+                other = indexed[row]
+                if other == position:
+                    continue
+                if dates[position] and dates[other] and abs((dates[position] - dates[other]).days) > max_day_gap:
+                    continue
+                pair = (min(position, other), max(position, other))
+                pairs[pair] = max(pairs.get(pair, 0.0), float(similarity))
+    return pairs
+
+
+class UnionFind:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, item):
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a, b):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def setup_event_duplicate_table(conn):
+    """Creates the event_duplicate table if it doesn't exist (same DDL as drizzle/0007)."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS event_duplicate (
+                    event_id INTEGER PRIMARY KEY,
+                    canonical_event_id INTEGER NOT NULL,
+                    metro_id INTEGER,
+                    similarity REAL,
+                    method TEXT NOT NULL,
+                    detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                );
+            """)
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS event_duplicate_canonical_idx
+                ON event_duplicate (canonical_event_id)
+            """)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logging.error(f"Error setting up event_duplicate table: {e}")
+        conn.rollback()
+        return False
+
+
+def get_metro_events(conn, metro_id):
+    """(id, json_data) of every titled event_clean row in a metro."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT id, json_data
+            FROM event_clean
+            WHERE metro_id = %s AND json_data->>'name' IS NOT NULL
+            ORDER BY id
+        """, (metro_id,))
+        return cur.fetchall()
+
+
+def get_metro_ids(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT metro_id FROM event_clean WHERE metro_id IS NOT NULL ORDER BY metro_id")
+        return [row[0] for row in cur.fetchall()]
+
+
+def verdict_key(text_1, text_2):
+    # Pair order does not matter to the verdict
+    first, second = sorted((text_1, text_2))
+    return enrichment_cache_key(first, second, ["same_event"], LLM_VERDICT_VERSION)
+
+
+def confirm_borderline_pairs(conn, client, texts, pairs, cache, workers=4):
+    """
+    Asks /dedupe about each borderline pair, memoizing verdicts.
+
+    Returns:
+        (set of confirmed pairs, number of LLM calls made)
+    """
+    keys = {pair: verdict_key(texts[pair[0]], texts[pair[1]]) for pair in pairs}
+    cached = cache.get_many(conn, list(set(keys.values())))
+    confirmed = {pair for pair, key in keys.items() if key in cached and cached[key].get("same_event")}
+    to_ask = [pair for pair, key in keys.items() if key not in cached]
+
+    def ask(pair):
+        try:
+            return client.same_event(texts[pair[0]], texts[pair[1]])
+        except requests.RequestException as e:
+            logging.warning(f"/dedupe failed for a candidate pair: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        verdicts = list(pool.map(ask, to_ask))
+    entries = {}
+    for pair, same_event in zip(to_ask, verdicts):
+        if same_event is None:
+            continue
+        entries[keys[pair]] = {"same_event": same_event}
+        if same_event:
+            confirmed.add(pair)
+    cache.put_many(conn, LLM_VERDICT_NAMESPACE, entries)
+    return confirmed, len(to_ask)
+
+
+def store_duplicates(conn, metro_id, event_ids, parents, edges):
+    """
+    Replaces the metro's event_duplicate rows with the current clusters.
+
+    Args:
+        parents: UnionFind over event positions.
+        edges: dict of (i, j) -> (similarity, method) for the merged pairs.
+    """
+    best = {}
+    for (i, j), (similarity, method) in edges.items():
+        for position in (i, j):
+            if similarity > best.get(position, (-1.0, None))[0]:
+                best[position] = (similarity, method)
+    rows = []
+    for position, event_id in enumerate(event_ids):
+        root = parents.find(position)
+        if root != position:
+            similarity, method = best[position]
+            rows.append((event_id, event_ids[root], metro_id, similarity, method))
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM event_duplicate WHERE metro_id = %s", (metro_id,))
+        if rows:
+            execute_values(cur, """
+                INSERT INTO event_duplicate (event_id, canonical_event_id, metro_id, similarity, method)
+                VALUES %s
+                ON CONFLICT (event_id) DO UPDATE SET
+                    canonical_event_id = EXCLUDED.canonical_event_id,
+                    metro_id = EXCLUDED.metro_id,
+                    similarity = EXCLUDED.similarity,
+                    method = EXCLUDED.method,
+                    detected_at = NOW()
+            """, rows)
+    conn.commit()
+    return len(rows)
+
+
+def dedupe_metro(conn, client, metro_id, cache, workers=4):
+    """
+    Finds and stores duplicate event_clean rows for one metro.
+
+    Returns:
+        dict of counts: events, candidates, auto_merged, escalated, llm_calls, llm_confirmed, duplicates
+    """
+    started = time.time()
+    events = get_metro_events(conn, metro_id)
+    stats = {"events": len(events), "candidates": 0, "auto_merged": 0, "escalated": 0,
+             "llm_calls": 0, "llm_confirmed": 0, "duplicates": 0}
+    if len(events) < 2:
+        return stats
+
+    event_ids = [event_id for event_id, _ in events]
+    texts = [event_text(json_data) for _, json_data in events]
+    dates = [event_date(json_data) for _, json_data in events]
+    vectors = client.embed(texts)
+    pairs = candidate_pairs(vectors, date_windows(dates), dates)
+
+    auto = {pair: similarity for pair, similarity in pairs.items() if similarity >= AUTO_MERGE_SIMILARITY}
+    borderline = [pair for pair, similarity in pairs.items() if similarity < AUTO_MERGE_SIMILARITY]
+    confirmed, llm_calls = confirm_borderline_pairs(conn, client, texts, borderline, cache, workers)
+
+    parents = UnionFind(len(events))
+    edges = {}
+    for pair, similarity in auto.items():
+        parents.union(*pair)
+        edges[pair] = (similarity, "embedding")
+    for pair in confirmed:
+        parents.union(*pair)
+        edges[pair] = (pairs[pair], "llm")
+
+    stats.update(candidates=len(pairs), auto_merged=len(auto), escalated=len(borderline),
+                 llm_calls=llm_calls, llm_confirmed=len(confirmed))
+    stats["duplicates"] = store_duplicates(conn, metro_id, event_ids, parents, edges)
+    logging.info(f"Metro {metro_id}: {stats['events']} events, {stats['candidates']} candidate pairs "
+                 f"({stats['auto_merged']} auto, {stats['escalated']} to LLM, {stats['llm_calls']} LLM calls), "
+                 f"{stats['duplicates']} duplicates in {time.time() - started:.1f}s")
+    return stats
+
+
+def run_semantic_dedup(conn, client, metro_ids=None, workers=4):
+    """Dedupes every metro in metro_ids (default: all metros in event_clean). Returns summed counts."""
+    setup_event_duplicate_table(conn)
+    setup_enrichment_cache_table(conn)
+    cache = EnrichmentCache()
+    totals = {}
+    for metro_id in metro_ids or get_metro_ids(conn):
+        try:
+            stats = dedupe_metro(conn, client, metro_id, cache, workers)
+        except (psycopg2.Error, requests.RequestException) as e:
+            logging.error(f"Semantic dedup failed for metro {metro_id}: {e}")
+            conn.rollback()
+            continue
+        for name, value in stats.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Embedding-based duplicate detection for event_clean")
+    parser.add_argument("--metro-id", type=int, action="append", help="Metro to dedupe (repeatable; default all)")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent /dedupe calls for borderline pairs")
+    args = parser.parse_args()
+
+    database_url = os.getenv("DATABASE_URL")
+    inference_url = os.getenv("QWEN_INFERENCE_URL")
+    if not database_url or not inference_url:
+        logging.error("DATABASE_URL and QWEN_INFERENCE_URL environment variables must be set. Exiting.")
+        return
+    client = InferenceClient(inference_url, os.getenv("API_BEARER_TOKEN", ""))
+    conn = psycopg2.connect(database_url)
+    try:
+        totals = run_semantic_dedup(conn, client, args.metro_id, args.workers)
+        logging.info(f"Semantic dedup complete: {totals}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
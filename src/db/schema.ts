@@ -1,4 +1,4 @@
-import { pgTable, serial, integer, text, char, doublePrecision, timestamp, customType, boolean, uuid, jsonb, primaryKey, uniqueIndex, numeric } from 'drizzle-orm/pg-core';
+import { pgTable, serial, integer, text, char, doublePrecision, timestamp, customType, boolean, uuid, jsonb, primaryKey, uniqueIndex, index, numeric, real } from 'drizzle-orm/pg-core';
 import type { InferSelectModel, InferInsertModel } from 'drizzle-orm';
 import { relations, sql } from 'drizzle-orm';
 import { pgGeography } from './utils'; // Try explicit .js import for module resolution
@@ -54,8 +54,12 @@ export const eventRaw = pgTable("event_raw", {
 	parsedAt: timestamp("parsed_at", { precision: 3, mode: 'string' }),
 	normalizedAt: timestamp("normalized_at", { precision: 3, mode: 'string' }), 
 	normalizationStatus: text("normalization_status"), 
+	// Canonical event URL and its hash (services/event_dedup.py); NULL for payloads without an event URL
+	canonicalUrl: text("canonical_url"),
+	urlHash: text("url_hash"),
 }, (table) => ({
     sourceEventIdx: uniqueIndex("source_event_idx").on(table.source, table.sourceEventId),
+    sourceUrlHashIdx: uniqueIndex("event_raw_source_url_hash_idx").on(table.source, table.urlHash),
 }));
 
 export const eventClean = pgTable("event_clean", {
@@ -82,6 +86,18 @@ export const eventClean = pgTable("event_clean", {
     eventDupIdx: uniqueIndex("event_dup_idx").on(table.metroId, table.fingerprint),
 }));
 
+// Semantic duplicates of event_clean rows (services/semantic_dedup.py), each pointing at its cluster's lowest id
+export const eventDuplicate = pgTable("event_duplicate", {
+	eventId: integer("event_id").primaryKey(),
+	canonicalEventId: integer("canonical_event_id").notNull(),
+	metroId: integer("metro_id"),
+	similarity: real("similarity"),
+	method: text("method").notNull(),
+	detectedAt: timestamp("detected_at", { withTimezone: true, mode: 'date' }).defaultNow().notNull(),
+}, (table) => ({
+    canonicalIdx: index("event_duplicate_canonical_idx").on(table.canonicalEventId),
+}));
+
 // Relations
 export const metroRelations = relations(metro, ({many}) => ({
   eventsClean: many(eventClean, {
@@ -121,4 +137,6 @@ export type InsertMetro = InferInsertModel<typeof metro>;
 export type SelectEventRaw = InferSelectModel<typeof eventRaw>;
 export type InsertEventRaw = InferInsertModel<typeof eventRaw>;
 export type SelectEventClean = InferSelectModel<typeof eventClean>;
-export type InsertEventClean = InferInsertModel<typeof eventClean>; 
\ No newline at end of file
+export type InsertEventClean = InferInsertModel<typeof eventClean>;
+export type SelectEventDuplicate = InferSelectModel<typeof eventDuplicate>;
+export type InsertEventDuplicate = InferInsertModel<typeof eventDuplicate>; 
\ No newline at end of file
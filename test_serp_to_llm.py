@@ -13,7 +13,6 @@ import argparse
 import logging
 import json
 import glob
-import time
 import subprocess
 from pathlib import Path
 from typing import List, Dict, Any
@@ -33,6 +32,7 @@ logger = logging.getLogger(__name__)
 DATA_RAW_DIR = os.getenv("DATA_RAW_DIR", "./data_raw")
 DATA_PARSED_DIR = os.getenv("DATA_PARSED_DIR", "./data_parsed")
 MAX_FILES_TO_PROCESS = 10  # Limit files to process for testing
+PARSED_EVENTS_FILE = "parsed_events.jsonl"
 
 def parse_arguments():
     """Parse command line arguments"""
@@ -82,7 +82,7 @@ def run_serp_collection():
         return False
 
 def run_llm_parsing(model_name: str, max_files: int):
-    """Run the LLM parsing on raw SERP data"""
+    """Run the LLM parser in batch mode over the raw SERP data (one model load for all files)"""
     logger.info(f"Starting LLM parsing with model {model_name}...")
     
     # Find raw SERP files
@@ -92,60 +92,62 @@ def run_llm_parsing(model_name: str, max_files: int):
         return False
     
     logger.info(f"Found {len(serp_files)} SERP data files, processing up to {max_files}")
-    files_to_process = serp_files[:max_files]
+    output_path = os.path.join(DATA_PARSED_DIR, PARSED_EVENTS_FILE)
+    
+    # Batch mode chunks every file within the token budget and batches chunks across files
+    cmd = [
+        "python", "llm_serp_parser_qwen.py",
+        "--input-dir", DATA_RAW_DIR,
+        "--pattern", "*.json",
+        "--max-files", str(max_files),
+        "--output", output_path,
+        "--model", model_name
+    ]
     
-    successful_parses = 0
-    failed_parses = 0
+    try:
+        result = subprocess.run(
+            cmd,
+            check=True,
+            capture_output=True,
+            text=True
+        )
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error running LLM parser in batch mode: {e}")
+        logger.error(f"Process stderr: {e.stderr}")
+        return False
     
-    for file_path in files_to_process:
-        try:
-            file_name = os.path.basename(file_path)
-            output_path = os.path.join(DATA_PARSED_DIR, f"parsed_{file_name}")
-            
-            logger.info(f"Processing {file_name} with LLM parser...")
-            
-            # Build command for LLM parser
-            cmd = [
-                "python", "llm_serp_parser_qwen.py",
-                "--input", file_path,
-                "--output", output_path,
-                "--model", model_name
-            ]
-            
-            # Run LLM parser
-            result = subprocess.run(
-                cmd,
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            
-            if "Error" in result.stdout or "error" in result.stdout.lower():
-                logger.warning(f"Possible error in LLM parsing for {file_name}: {result.stdout}")
-                failed_parses += 1
-            else:
-                logger.info(f"Successfully parsed {file_name}")
-                successful_parses += 1
-                
-            # Add some delay to avoid overwhelming GPU
-            time.sleep(1)
-            
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error running LLM parser on {file_path}: {e}")
-            logger.error(f"Process stderr: {e.stderr}")
-            failed_parses += 1
-        except Exception as e:
-            logger.error(f"Unexpected error processing {file_path}: {e}")
-            failed_parses += 1
+    # The parser logs to stderr; its last lines carry the batch totals
+    for line in result.stderr.strip().splitlines()[-2:]:
+        logger.info(line)
     
-    logger.info(f"LLM parsing complete. Successful: {successful_parses}, Failed: {failed_parses}")
-    return successful_parses > 0
+    logger.info(f"LLM parsing complete. Events written to {output_path}")
+    return os.path.exists(output_path)
+
+def load_parsed_events(file_path: str) -> Dict[str, List[Dict[str, Any]]]:
+    """Events per source file name, from a batch-mode JSONL file or a single-file parser output"""
+    if file_path.endswith(".jsonl"):
+        events_by_file = {}
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    event = json.loads(line)
+                    events_by_file.setdefault(event.pop("source_file", "unknown"), []).append(event)
+        return events_by_file
+    with open(file_path, 'r', encoding='utf-8') as f:
+        events = json.load(f)
+    file_name = os.path.basename(file_path)
+    if file_name.startswith("parsed_"):
+        file_name = file_name[len("parsed_"):]
+    return {file_name: events}
 
 def analyze_results():
     """Analyze the extracted event data"""
     logger.info("Analyzing parsed event data...")
     
-    parsed_files = glob.glob(os.path.join(DATA_PARSED_DIR, "*.json"))
+    parsed_files = [
+        path for path in glob.glob(os.path.join(DATA_PARSED_DIR, "*.json")) + glob.glob(os.path.join(DATA_PARSED_DIR, "*.jsonl"))
+        if not path.endswith(("_stats.jsonl", "_venues.jsonl", "_venues.json"))
+    ]
     if not parsed_files:
         logger.warning("No parsed data files found.")
         return
@@ -158,32 +160,28 @@ def analyze_results():
     
     for file_path in parsed_files:
         try:
-            with open(file_path, 'r') as f:
-                events = json.load(f)
-            
-            if not isinstance(events, list):
-                logger.warning(f"Unexpected format in {file_path}, expected a list of events")
-                continue
-            
-            # Extract city name from filename
-            file_name = os.path.basename(file_path)
-            if file_name.startswith("parsed_"):
-                city_part = file_name.split('_')[1]
+            for file_name, events in load_parsed_events(file_path).items():
+                if not isinstance(events, list):
+                    logger.warning(f"Unexpected format for {file_name}, expected a list of events")
+                    continue
+                
+                # Extract city name from the SERP file name
+                city_part = os.path.basename(file_name).split('_')[0]
                 
                 if city_part not in events_by_city:
                     events_by_city[city_part] = 0
                 
                 events_by_city[city_part] += len(events)
-            
-            # Count events and gather statistics
-            for event in events:
-                total_events += 1
                 
-                # Track dance styles
-                if event.get('dance_style'):
-                    dance_styles.add(event.get('dance_style').lower())
-            
-            logger.info(f"File {file_name}: {len(events)} events extracted")
+                # Count events and gather statistics
+                for event in events:
+                    total_events += 1
+                    
+                    # Track dance styles
+                    if event.get('dance_style'):
+                        dance_styles.add(event.get('dance_style').lower())
+                
+                logger.info(f"File {file_name}: {len(events)} events extracted")
             
         except json.JSONDecodeError:
             logger.error(f"Error decoding JSON in {file_path}")
@@ -7,6 +7,7 @@ Complete end-to-end pipeline for event discovery and processing:
 2. Normalization of raw data into event_clean
 3. Enrichment of events with Qwen 3
 4. Geocoding fixes with Google Places API
+5. Embedding-based duplicate detection over event_clean
 
 Usage:
   python unified_event_pipeline.py --full-run    # Run the complete pipeline
@@ -24,11 +25,18 @@ import requests
 import psycopg2
 import random
 import base64
-from psycopg2.extras import DictCursor, Json
+from psycopg2.extras import DictCursor, Json, execute_values
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor
 import boto3
 
+from pipeline_stages import Stage, run_bounded, run_stage_graph
+
+# Shared service modules (event_dedup) live in services/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services'))
+from event_dedup import insert_raw_events, setup_dedup_columns
+from enrichment_cache import EnrichmentCache, enrichment_cache_key, setup_enrichment_cache_table
+from semantic_dedup import InferenceClient, run_semantic_dedup
+
 # Import Places API helper functions
 from places_api_helper import (
     resolve_venue_address,
@@ -44,6 +52,7 @@ DATAFORSEO_API_LOGIN = os.environ.get('DATAFORSEO_API_LOGIN')
 DATAFORSEO_API_PASSWORD = os.environ.get('DATAFORSEO_API_PASSWORD')
 if not DATAFORSEO_API_LOGIN or not DATAFORSEO_API_PASSWORD:
     print("Warning: DataForSEO API credentials not set in environment variables")
+DATAFORSEO_LIVE_TIMEOUT = 120  # live/advanced can take tens of seconds at depth 2
 
 # Database connection
 def initialize_db():
@@ -168,6 +177,12 @@ def setup_progress_tracking(conn):
                     error_message TEXT
                 )
             """)
+            # claimed_at lets concurrent runners hand back tasks a crashed run left in 'running'
+            cur.execute("ALTER TABLE dataforseo_query_progress ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMP")
+            cur.execute("""
+                CREATE INDEX IF NOT EXISTS idx_dataforseo_query_progress_pending
+                ON dataforseo_query_progress (id) WHERE status = 'pending'
+            """)
             conn.commit()
             print("Progress tracking table set up")
     except psycopg2.Error as e:
@@ -199,49 +214,77 @@ def create_dataforseo_tasks(cities, query_types, conn):
         conn.rollback()
         print(f"Error creating DataForSEO tasks: {e}")
 
-def get_pending_tasks(conn, limit=10):
-    """Get pending DataForSEO query tasks."""
+def claim_pending_tasks(conn, limit=10):
+    """
+    Atomically claim pending DataForSEO query tasks for this runner.
+    
+    FOR UPDATE SKIP LOCKED lets several runners claim from the same table
+    without handing out a task twice or waiting on each other's locks.
+    """
     try:
         with conn.cursor() as cur:
             cur.execute("""
-                SELECT id, city_id, query_type 
-                FROM dataforseo_query_progress 
-                WHERE status = 'pending' 
-                ORDER BY id 
-                LIMIT %s
+                UPDATE dataforseo_query_progress
+                SET status = 'running', claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM dataforseo_query_progress
+                    WHERE status = 'pending'
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, city_id, query_type
             """, (limit,))
-            return cur.fetchall()
+            tasks = cur.fetchall()
+        conn.commit()
+        return sorted(tasks, key=lambda task: task[0])
     except psycopg2.Error as e:
-        print(f"Error getting pending tasks: {e}")
+        conn.rollback()
+        print(f"Error claiming pending tasks: {e}")
         return []
 
-def update_task_status(conn, task_id, status, error_message=None):
-    """Update the status of a DataForSEO query task."""
+def release_stale_claims(conn, stale_minutes=30):
+    """Return tasks stuck in 'running' (runner crashed mid-batch) to the pending pool."""
     try:
         with conn.cursor() as cur:
-            if status == 'completed':
-                cur.execute("""
-                    UPDATE dataforseo_query_progress 
-                    SET status = %s, completed_at = CURRENT_TIMESTAMP 
-                    WHERE id = %s
-                """, (status, task_id))
-            elif status == 'error':
-                cur.execute("""
-                    UPDATE dataforseo_query_progress 
-                    SET status = %s, error_message = %s 
-                    WHERE id = %s
-                """, (status, error_message, task_id))
-            else:
-                cur.execute("""
-                    UPDATE dataforseo_query_progress 
-                    SET status = %s 
-                    WHERE id = %s
-                """, (status, task_id))
-            
-            conn.commit()
+            cur.execute("""
+                UPDATE dataforseo_query_progress
+                SET status = 'pending', claimed_at = NULL
+                WHERE status = 'running'
+                AND claimed_at < CURRENT_TIMESTAMP - make_interval(mins => %s)
+            """, (stale_minutes,))
+            released = cur.rowcount
+        conn.commit()
+        if released:
+            print(f"Released {released} stale task claims")
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error releasing stale task claims: {e}")
+
+def update_task_statuses(conn, updates):
+    """
+    Update many DataForSEO query tasks in one statement.
+    
+    Args:
+        conn: Database connection
+        updates: List of (task_id, status, error_message)
+    """
+    if not updates:
+        return
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                UPDATE dataforseo_query_progress AS p
+                SET status = v.status,
+                    error_message = COALESCE(v.error_message, p.error_message),
+                    completed_at = CASE WHEN v.status = 'completed' THEN CURRENT_TIMESTAMP ELSE p.completed_at END
+                FROM (VALUES %s) AS v(id, status, error_message)
+                WHERE p.id = v.id
+            """, updates, template="(%s::integer, %s, %s::text)")
+        conn.commit()
     except psycopg2.Error as e:
         conn.rollback()
-        print(f"Error updating task status: {e}")
+        print(f"Error updating {len(updates)} task statuses: {e}")
 
 def make_dataforseo_query(city, query_type):
     """
@@ -289,7 +332,7 @@ def make_dataforseo_query(city, query_type):
     }
     
     try:
-        response = requests.post(endpoint, headers=headers, json=[data])
+        response = requests.post(endpoint, headers=headers, json=[data], timeout=DATAFORSEO_LIVE_TIMEOUT)
         if response.status_code == 200:
             return response.json()
         else:
@@ -354,29 +397,12 @@ def process_dataforseo_response(response, city_id, query_type, conn):
                     
                     events.append(raw_event)
     
-    # Insert events into event_raw
+    # Insert events into event_raw in one batch; the (source, url_hash) index skips known URLs
     inserted_count = 0
     
     try:
-        with conn.cursor() as cur:
-            for event in events:
-                # Check if event already exists (by URL)
-                if event.get('url'):
-                    cur.execute("""
-                        SELECT id FROM event_raw 
-                        WHERE raw_json->>'url' = %s
-                    """, (event['url'],))
-                    if cur.fetchone():
-                        continue
-                
-                cur.execute("""
-                    INSERT INTO event_raw 
-                    (raw_json, metro_id, created_at) 
-                    VALUES (%s, %s, CURRENT_TIMESTAMP)
-                """, (Json(event), city_id))
-                inserted_count += 1
-            
-            conn.commit()
+        inserted_count = insert_raw_events(conn, [(event['source'], None, city_id, event) for event in events])
+        conn.commit()
     except psycopg2.Error as e:
         conn.rollback()
         print(f"Error inserting events: {e}")
@@ -399,8 +425,9 @@ def run_data_collection(args, conn):
         'shows', 'performances', 'workshops', 'sporting_events', 'meetups'
     ]
     
-    # Setup progress tracking
+    # Setup progress tracking and the event_raw URL dedup key
     setup_progress_tracking(conn)
+    setup_dedup_columns(conn)
     create_dataforseo_tasks(cities, query_types, conn)
     
     # Get progress
@@ -411,55 +438,60 @@ def run_data_collection(args, conn):
     elif total:
         print(f"Progress: {completed}/{total} queries completed")
     
-    # Calculate batch size and delay
-    batch_size = min(args.batch_size, 10)  # Don't make too many concurrent requests
-    delay_between_batches = 10  # seconds
+    # Live queries run concurrently; status updates are written in batches
+    concurrency = max(1, args.query_concurrency)
+    claim_size = concurrency * 2
+    release_stale_claims(conn)
     
-    # Process batches of tasks
+    # Progress is counted once and then tracked incrementally
     cities_dict = {city['id']: city for city in cities}
+    succeeded = failed = 0
+    total_inserted = 0
+    status_updates = []
+    
+    def _query(task):
+        task_id, city_id, query_type = task
+        city = cities_dict.get(city_id)
+        if not city:
+            return None
+        print(f"Querying for '{query_type}' in {city['name']}...")
+        return make_dataforseo_query(city, query_type)
+    
+    def _handle(task, response, error):
+        nonlocal succeeded, failed, total_inserted
+        task_id, city_id, query_type = task
+        if city_id not in cities_dict:
+            status_updates.append((task_id, 'error', 'City not found'))
+            failed += 1
+        elif response:
+            # Process response and insert events (DB work stays on this thread's connection)
+            inserted = process_dataforseo_response(response, city_id, query_type, conn)
+            total_inserted += inserted
+            print(f"Inserted {inserted} events from '{query_type}' in {cities_dict[city_id]['name']}")
+            status_updates.append((task_id, 'completed', None))
+            succeeded += 1
+        else:
+            status_updates.append((task_id, 'error', str(error)[:255] if error else 'API request failed'))
+            failed += 1
+        if len(status_updates) >= claim_size:
+            update_task_statuses(conn, status_updates)
+            status_updates.clear()
     
     while True:
-        pending_tasks = get_pending_tasks(conn, batch_size)
+        pending_tasks = claim_pending_tasks(conn, claim_size)
         if not pending_tasks:
             break
             
-        print(f"Processing batch of {len(pending_tasks)} tasks...")
+        print(f"Processing batch of {len(pending_tasks)} tasks with {concurrency} concurrent queries...")
+        run_bounded(_query, pending_tasks, concurrency, _handle)
+        update_task_statuses(conn, status_updates)
+        status_updates.clear()
         
-        for task in pending_tasks:
-            task_id, city_id, query_type = task
-            
-            if city_id not in cities_dict:
-                update_task_status(conn, task_id, 'error', 'City not found')
-                continue
-                
-            city = cities_dict[city_id]
-            
-            print(f"Querying for '{query_type}' in {city['name']}...")
-            
-            # Make API request
-            response = make_dataforseo_query(city, query_type)
-            
-            if response:
-                # Process response and insert events
-                inserted = process_dataforseo_response(response, city_id, query_type, conn)
-                print(f"Inserted {inserted} events from '{query_type}' in {city['name']}")
-                update_task_status(conn, task_id, 'completed')
-            else:
-                update_task_status(conn, task_id, 'error', 'API request failed')
-        
-        # Check if we're done
-        completed, total = get_query_progress(conn)
         if total:
-            print(f"Progress: {completed}/{total} queries completed ({(completed/total)*100:.1f}%)")
-            
-            if completed == total:
-                print("All queries completed")
-                break
-        
-        # Delay between batches to avoid rate limiting
-        print(f"Waiting {delay_between_batches} seconds before next batch...")
-        time.sleep(delay_between_batches)
+            done = completed + succeeded
+            print(f"Progress: {done}/{total} queries completed ({(done/total)*100:.1f}%), {failed} errors this run")
     
+    print(f"Run finished: {succeeded} completed, {failed} errors, {total_inserted} events inserted")
     print("=== DataForSEO data collection completed ===")
 
 # Processing/Normalization Functions
@@ -589,55 +621,66 @@ def process_raw_events(conn, limit=100):
     
     return processed_count
 
-def invoke_qwen_enrichment(lambda_client, event_data):
+QWEN_LAMBDA_FUNCTION = os.environ.get('QWEN_LAMBDA_FUNCTION', 'event-enrichment-qwen')
+ENRICHMENT_FIELDS = [
+    "price",
+    "eventAttendanceMode",
+    "eventStatus",
+    "organizer_name",
+    "additional_location_details"
+]
+# Bump when the Lambda prompt or model changes; it is part of every cache key
+QWEN_ENRICHMENT_VERSION = os.environ.get('QWEN_ENRICHMENT_VERSION', 'v1')
+ENRICHMENT_CACHE_NAMESPACE = 'qwen-enrichment'
+ENRICHMENT_CACHE = EnrichmentCache()
+
+def enrichment_cache_key_for(event_data):
+    """Content-hash cache key for one event_clean record."""
+    return enrichment_cache_key(
+        event_data['json_data'].get('name', ''),
+        event_data['json_data'].get('description', ''),
+        ENRICHMENT_FIELDS,
+        f"{QWEN_LAMBDA_FUNCTION}:{QWEN_ENRICHMENT_VERSION}"
+    )
+
+def build_enrichment_request(event_data):
+    """Lambda request item for one event_clean record."""
+    return {
+        "event_id": event_data['id'],
+        "description": event_data['json_data'].get('description', ''),
+        "title": event_data['json_data'].get('name', ''),
+        "fields_to_extract": ENRICHMENT_FIELDS
+    }
+
+def invoke_qwen_enrichment_batch(lambda_client, event_batch):
     """
-    Invoke Qwen 3 via Lambda to extract missing fields from event description.
+    Invoke Qwen 3 via Lambda once for a batch of events.
     
     Args:
         lambda_client: Initialized AWS Lambda client
-        event_data: Dict containing event information with description
+        event_batch: List of dicts with 'id' and 'json_data'
         
     Returns:
-        Dict with extracted fields or None if processing failed
+        Dict of event_id -> extracted fields (None where extraction failed).
+        Raises on invocation errors so the caller can mark the whole batch.
     """
-    if not lambda_client:
-        print("Lambda client not initialized")
-        return None
+    payload = {"events": [build_enrichment_request(event_data) for event_data in event_batch]}
+    response = lambda_client.invoke(
+        FunctionName=QWEN_LAMBDA_FUNCTION,
+        InvocationType='RequestResponse',
+        Payload=json.dumps(payload)
+    )
+    response_payload = json.loads(response['Payload'].read().decode('utf-8'))
+    if response['StatusCode'] != 200 or 'results' not in response_payload:
+        raise RuntimeError(f"Lambda batch invocation error: {response_payload.get('errorMessage', response_payload)}")
     
-    try:
-        # Prepare payload for Lambda function
-        payload = {
-            "event_id": event_data['id'],
-            "description": event_data['json_data'].get('description', ''),
-            "title": event_data['json_data'].get('name', ''),
-            "fields_to_extract": [
-                "price",
-                "eventAttendanceMode",
-                "eventStatus",
-                "organizer_name",
-                "additional_location_details"
-            ]
-        }
-        
-        # Invoke Lambda function
-        lambda_function_name = os.environ.get('QWEN_LAMBDA_FUNCTION', 'event-enrichment-qwen')
-        response = lambda_client.invoke(
-            FunctionName=lambda_function_name,
-            InvocationType='RequestResponse',
-            Payload=json.dumps(payload)
-        )
-        
-        # Process response
-        response_payload = json.loads(response['Payload'].read().decode('utf-8'))
-        if response['StatusCode'] != 200:
-            print(f"Lambda invocation error: {response_payload.get('errorMessage', 'Unknown error')}")
-            return None
-            
-        return response_payload.get('extracted_data')
-        
-    except Exception as e:
-        print(f"Error invoking Qwen 3 Lambda: {e}")
-        return None
+    results = {event_data['id']: None for event_data in event_batch}
+    for item in response_payload['results']:
+        if item.get('error'):
+            print(f"  Enrichment error for event {item.get('event_id')}: {item['error']}")
+        elif item.get('event_id') in results:
+            results[item['event_id']] = item.get('extracted_data')
+    return results
 
 def get_events_needing_enrichment(conn, limit=50):
     """
@@ -669,61 +712,153 @@ def get_events_needing_enrichment(conn, limit=50):
         print(f"Database error fetching events needing enrichment: {e}")
         return []
 
-def update_event_with_enrichment(conn, event_id, enrichment_data):
-    """Update event_clean record with enrichment data from Qwen 3."""
-    if not enrichment_data:
-        return False
+def build_enrichment_patch(enrichment_data):
+    """
+    Split Qwen output into the pieces the bulk UPDATE merges with jsonb operators.
+    
+    Returns:
+        tuple: (top-level patch dict, organizer name or None, location address or None)
+    """
+    top_patch = {
+        field: enrichment_data[field]
+        for field in ('price', 'eventAttendanceMode', 'eventStatus')
+        if enrichment_data.get(field)
+    }
+    organizer_name = enrichment_data.get('organizer_name') or None
+    location_details = enrichment_data.get('additional_location_details')
+    location_address = location_details.get('address') if isinstance(location_details, dict) else None
+    return top_patch, organizer_name, location_address or None
+
+def apply_enrichment_results(conn, results):
+    """
+    Write enrichment results to event_clean in one statement, merging in SQL
+    instead of re-reading each row.
+    
+    Args:
+        conn: Database connection
+        results: List of (event_id, enrichment_data or None); None marks the event 'failed'
         
+    Returns:
+        Number of events marked 'processed'
+    """
+    if not results:
+        return 0
+    values = []
+    for event_id, enrichment_data in results:
+        if enrichment_data:
+            top_patch, organizer_name, location_address = build_enrichment_patch(enrichment_data)
+            values.append((event_id, Json(top_patch), organizer_name, location_address, 'processed'))
+        else:
+            # Mark as processed even if we couldn't enrich it
+            values.append((event_id, Json({}), None, None, 'failed'))
+    
     try:
         with conn.cursor() as cur:
-            # Get current event data
-            cur.execute("""
-                SELECT json_data FROM event_clean WHERE id = %s
-            """, (event_id,))
-            result = cur.fetchone()
-            if not result:
-                return False
-                
-            current_data = result[0]
-            
-            # Update fields based on enrichment data
-            if 'price' in enrichment_data and enrichment_data['price']:
-                current_data['price'] = enrichment_data['price']
-                
-            if 'eventAttendanceMode' in enrichment_data and enrichment_data['eventAttendanceMode']:
-                current_data['eventAttendanceMode'] = enrichment_data['eventAttendanceMode']
-                
-            if 'eventStatus' in enrichment_data and enrichment_data['eventStatus']:
-                current_data['eventStatus'] = enrichment_data['eventStatus']
-                
-            if 'organizer_name' in enrichment_data and enrichment_data['organizer_name']:
-                if 'organizer' not in current_data:
-                    current_data['organizer'] = {"@type": "Organization"}
-                current_data['organizer']['name'] = enrichment_data['organizer_name']
-                
-            if 'additional_location_details' in enrichment_data and enrichment_data['additional_location_details']:
-                # Only update if we have a location object
-                if 'location' in current_data:
-                    # Add any additional location details that might help with geocoding later
-                    if 'address' not in current_data['location'] and enrichment_data['additional_location_details'].get('address'):
-                        current_data['location']['address'] = enrichment_data['additional_location_details']['address']
-            
-            # Update the record
-            cur.execute("""
-                UPDATE event_clean
-                SET json_data = %s::jsonb,
-                    enrichment_status = 'processed',
+            # Address is only filled into an existing location that lacks one (helps geocoding later);
+            # the organizer object is created if missing and its name overwritten
+            execute_values(cur, """
+                UPDATE event_clean AS e
+                SET json_data = CASE
+                        WHEN v.location_address IS NOT NULL
+                             AND jsonb_typeof(e.json_data->'location') = 'object'
+                             AND NOT (e.json_data->'location' ? 'address')
+                        THEN jsonb_set(e.json_data, '{location,address}', to_jsonb(v.location_address))
+                        ELSE e.json_data
+                    END
+                    || v.top_patch
+                    || CASE
+                        WHEN v.organizer_name IS NOT NULL
+                        THEN jsonb_build_object('organizer',
+                             COALESCE(e.json_data->'organizer', '{"@type": "Organization"}'::jsonb)
+                             || jsonb_build_object('name', v.organizer_name))
+                        ELSE '{}'::jsonb
+                    END,
+                    enrichment_status = v.status,
                     updated_at = CURRENT_TIMESTAMP
-                WHERE id = %s
-            """, (Json(current_data), event_id))
-            
-            conn.commit()
-            return True
-            
+                FROM (VALUES %s) AS v(id, top_patch, organizer_name, location_address, status)
+                WHERE e.id = v.id
+            """, values, template="(%s::integer, %s::jsonb, %s::text, %s::text, %s::text)")
+        conn.commit()
+        return sum(1 for value in values if value[4] == 'processed')
     except psycopg2.Error as e:
         conn.rollback()
-        print(f"Database error updating event with enrichment: {e}")
-        return False
+        print(f"Database error applying {len(values)} enrichment results: {e}")
+        return 0
+
+def enrich_events(conn, lambda_client, enrichment_records, workers=1, stats=None, batch_size=10):
+    """
+    Enrich event_clean records with Qwen 3: batch_size events per Lambda
+    invocation, several invocations in flight at once, and one bulk UPDATE
+    per returned batch. Records whose content is already in the enrichment
+    cache are applied without a model call, and records sharing content
+    within the run are sent once.
+    
+    Args:
+        conn: Database connection (only used from the calling thread)
+        lambda_client: Initialized AWS Lambda client
+        enrichment_records: Rows from get_events_needing_enrichment
+        workers: Concurrent Lambda invocations
+        stats: Optional StageStats to record outcomes on
+        batch_size: Events packed into one invocation
+        
+    Returns:
+        Number of records enriched
+    """
+    enriched_count = 0
+    batch_size = max(1, batch_size)
+    events = [{'id': record[0], 'json_data': record[1]} for record in enrichment_records]
+    cache_keys = {event_data['id']: enrichment_cache_key_for(event_data) for event_data in events}
+    cached = ENRICHMENT_CACHE.get_many(conn, cache_keys.values())
+    
+    def _apply(results):
+        nonlocal enriched_count
+        applied = apply_enrichment_results(conn, results)
+        enriched_count += applied
+        if stats:
+            stats.record(True, applied)
+            stats.record(False, len(results) - applied)
+        return applied
+    
+    cache_hits = [(event_data['id'], cached[cache_keys[event_data['id']]])
+                  for event_data in events if cache_keys[event_data['id']] in cached]
+    if cache_hits:
+        print(f"Enriched {_apply(cache_hits)} of {len(cache_hits)} events from the enrichment cache")
+    
+    # One representative per distinct content; the others reuse its result
+    representatives, duplicates = {}, {}
+    for event_data in events:
+        key = cache_keys[event_data['id']]
+        if key in cached:
+            continue
+        if key in representatives:
+            duplicates.setdefault(key, []).append(event_data['id'])
+        else:
+            representatives[key] = event_data
+    pending = list(representatives.values())
+    event_batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+    
+    def _invoke(event_batch):
+        print(f"Enriching {len(event_batch)} events (IDs {event_batch[0]['id']}..{event_batch[-1]['id']})...")
+        return invoke_qwen_enrichment_batch(lambda_client, event_batch)
+    
+    def _save(event_batch, batch_results, error):
+        if error:
+            print(f"  Failed to get enrichment data for {len(event_batch)} events: {error}")
+            batch_results = {event_data['id']: None for event_data in event_batch}
+        results, fresh = [], {}
+        for event_data in event_batch:
+            key = cache_keys[event_data['id']]
+            enrichment_data = batch_results.get(event_data['id'])
+            fresh[key] = enrichment_data
+            results.append((event_data['id'], enrichment_data))
+            results.extend((duplicate_id, enrichment_data) for duplicate_id in duplicates.get(key, ()))
+        ENRICHMENT_CACHE.put_many(conn, ENRICHMENT_CACHE_NAMESPACE, fresh)
+        applied = _apply(results)
+        print(f"  Enriched {applied} of {len(results)} events in batch")
+    
+    run_bounded(_invoke, event_batches, workers, _save)
+    print(ENRICHMENT_CACHE.summary())
+    return enriched_count
 
 def get_geocoding_errors(conn, limit=50):
     """Get records from event_raw with geocoding/location errors."""
@@ -742,13 +877,86 @@ def get_geocoding_errors(conn, limit=50):
         print(f"Database error fetching geocoding errors: {e}")
         return []
 
-def fix_geocoding_with_places_api(conn, error_records):
+def resolve_geocoding_fix(record):
+    """
+    Resolve one errored record's venue with the Google Places API.
+    
+    Args:
+        record: (id, raw_json) row from get_geocoding_errors
+        
+    Returns:
+        Updated raw_json with the resolved location, or None if unresolved
+    """
+    raw_json = record[1]
+    
+    if not isinstance(raw_json, dict) or 'location' not in raw_json:
+        return None
+        
+    location = raw_json['location']
+    if not isinstance(location, dict):
+        return None
+        
+    venue_name = location.get('name')
+    address = location.get('address')
+    
+    if not venue_name:
+        return None
+            
+    # Try to extract city from address or event title
+    city = None
+    if address and isinstance(address, str) and ',' in address:
+        parts = address.split(',')
+        if len(parts) >= 2:
+            # Take the last meaningful part as city
+            for i in range(len(parts)-1, 0, -1):
+                potential_city = parts[i].strip()
+                if len(potential_city) > 2 and not potential_city.isdigit():
+                    city = potential_city
+                    break
+    
+    # If city not found in address, try looking in the event title
+    if not city and 'name' in raw_json:
+        title = raw_json['name']
+        for common_city in ['New York', 'San Francisco', 'Los Angeles', 'Chicago', 'London', 
+                           'Paris', 'Barcelona', 'Madrid', 'Berlin', 'Rio', 'Tokyo']:
+            if common_city in title:
+                city = common_city
+                break
+    
+    # resolve_venue_address opens its own connection, so this is safe to call from worker threads
+    venue_data = resolve_venue_address(venue_name, address, city)
+    if not venue_data:
+        return None
+    
+    # Update the record with resolved location
+    updated_location = {
+        "@type": "Place",
+        "name": venue_name
+    }
+    
+    if venue_data['formatted_address']:
+        updated_location["address"] = venue_data['formatted_address']
+        
+    if venue_data['latitude'] and venue_data['longitude']:
+        updated_location["geo"] = {
+            "@type": "GeoCoordinates",
+            "latitude": venue_data['latitude'],
+            "longitude": venue_data['longitude']
+        }
+        
+    # Update the raw_json
+    raw_json['location'] = updated_location
+    return raw_json
+
+def fix_geocoding_with_places_api(conn, error_records, workers=1, stats=None):
     """
     Fix geocoding errors using Google Places API.
     
     Args:
         conn: Database connection
         error_records: List of records with geocoding errors
+        workers: Concurrent Places lookups; DB updates stay on conn
+        stats: Optional StageStats to record outcomes on
         
     Returns:
         tuple: (fixed_count, total_count)
@@ -756,83 +964,37 @@ def fix_geocoding_with_places_api(conn, error_records):
     fixed_count = 0
     total_count = len(error_records)
     
-    for record in error_records:
+    def _save(record, raw_json, error):
+        nonlocal fixed_count
         record_id = record[0]
-        raw_json = record[1]
-        
-        if not isinstance(raw_json, dict) or 'location' not in raw_json:
-            continue
-            
-        location = raw_json['location']
-        if not isinstance(location, dict):
-            continue
-            
-        venue_name = location.get('name')
-        address = location.get('address')
-        
-        if not venue_name:
-            continue
-            
-        # Try to extract city from address or event title
-        city = None
-        if address and isinstance(address, str) and ',' in address:
-            parts = address.split(',')
-            if len(parts) >= 2:
-                # Take the last meaningful part as city
-                for i in range(len(parts)-1, 0, -1):
-                    potential_city = parts[i].strip()
-                    if len(potential_city) > 2 and not potential_city.isdigit():
-                        city = potential_city
-                        break
-        
-        # If city not found in address, try looking in the event title
-        if not city and 'name' in raw_json:
-            title = raw_json['name']
-            for common_city in ['New York', 'San Francisco', 'Los Angeles', 'Chicago', 'London', 
-                               'Paris', 'Barcelona', 'Madrid', 'Berlin', 'Rio', 'Tokyo']:
-                if common_city in title:
-                    city = common_city
-                    break
-        
-        venue_data = resolve_venue_address(venue_name, address, city)
-        
-        if venue_data:
-            # Update the record with resolved location
-            updated_location = {
-                "@type": "Place",
-                "name": venue_name
-            }
-            
-            if venue_data['formatted_address']:
-                updated_location["address"] = venue_data['formatted_address']
-                
-            if venue_data['latitude'] and venue_data['longitude']:
-                updated_location["geo"] = {
-                    "@type": "GeoCoordinates",
-                    "latitude": venue_data['latitude'],
-                    "longitude": venue_data['longitude']
-                }
+        if error:
+            print(f"Error resolving venue for record {record_id}: {error}")
+        if not raw_json:
+            if stats:
+                stats.record(False)
+            return
+        try:
+            # Reset normalization status to try again
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE event_raw
+                    SET raw_json = %s::jsonb,
+                        normalized_at = NULL,
+                        normalization_status = NULL
+                    WHERE id = %s
+                """, (Json(raw_json), record_id))
                 
-            # Update the raw_json
-            raw_json['location'] = updated_location
-            
-            try:
-                # Reset normalization status to try again
-                with conn.cursor() as cur:
-                    cur.execute("""
-                        UPDATE event_raw
-                        SET raw_json = %s::jsonb,
-                            normalized_at = NULL,
-                            normalization_status = NULL
-                        WHERE id = %s
-                    """, (Json(raw_json), record_id))
-                    
-                    conn.commit()
-                    fixed_count += 1
-            except psycopg2.Error as e:
-                conn.rollback()
-                print(f"Database error updating record {record_id}: {e}")
+                conn.commit()
+                fixed_count += 1
+                if stats:
+                    stats.record(True)
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Database error updating record {record_id}: {e}")
+            if stats:
+                stats.record(False)
     
+    run_bounded(resolve_geocoding_fix, error_records, workers, _save)
     return fixed_count, total_count
 
 def run_normalizers():
@@ -844,8 +1006,125 @@ def run_normalizers():
     time.sleep(2)  # Simulate some processing time
     print("Normalization workers triggered")
 
-def process_pipeline(args, conn, lambda_client):
-    """Run the event processing pipeline."""
+def open_stage_connection():
+    """Each concurrent stage gets its own connection; psycopg2 connections must not share a transaction across threads."""
+    conn = initialize_db()
+    if not conn:
+        raise RuntimeError("Failed to connect to database")
+    return conn
+
+def run_collection_stage(args, stats):
+    """Stage: DataForSEO collection of new raw events."""
+    conn = open_stage_connection()
+    try:
+        run_data_collection(args, conn)
+        stats.record(True)
+    finally:
+        conn.close()
+
+def run_normalize_stage(args, stats):
+    """Stage: process raw events into normalized format."""
+    conn = open_stage_connection()
+    try:
+        pending_records = get_pending_normalizations(conn, args.batch_size)
+        if pending_records:
+            print(f"Found {len(pending_records)} records needing normalization")
+            processed = process_raw_events(conn, args.batch_size)
+            print(f"Processed {processed} raw events")
+            stats.record(True, processed)
+            stats.record(False, max(0, len(pending_records) - processed))
+            
+            # Trigger normalizers to process the normalized data
+            run_normalizers()
+        else:
+            print("No records pending normalization")
+    finally:
+        conn.close()
+
+def run_enrichment_stage(args, lambda_client, stats):
+    """Stage: enrich existing event_clean records using Qwen 3."""
+    conn = open_stage_connection()
+    try:
+        setup_enrichment_cache_table(conn)
+        enrichment_records = get_events_needing_enrichment(conn, args.batch_size)
+        if enrichment_records:
+            print(f"Found {len(enrichment_records)} records needing enrichment")
+            enriched_count = enrich_events(conn, lambda_client, enrichment_records, args.enrich_workers, stats,
+                                           args.enrich_batch_size)
+            print(f"Enriched {enriched_count} out of {len(enrichment_records)} records")
+        else:
+            print("No records needing enrichment")
+    finally:
+        conn.close()
+
+def run_dedupe_stage(args, stats):
+    """Stage: embedding/ANN duplicate detection over event_clean, escalating borderline pairs to the LLM."""
+    inference_url = os.environ.get('QWEN_INFERENCE_URL')
+    if not inference_url:
+        print("QWEN_INFERENCE_URL not set, skipping duplicate detection")
+        return
+    client = InferenceClient(inference_url, os.environ.get('API_BEARER_TOKEN', ''))
+    conn = open_stage_connection()
+    try:
+        totals = run_semantic_dedup(conn, client, workers=args.dedupe_workers)
+        print(f"Dedupe: {totals.get('events', 0)} events, {totals.get('candidates', 0)} candidate pairs, "
+              f"{totals.get('llm_calls', 0)} LLM checks, {totals.get('duplicates', 0)} duplicates")
+        stats.record(True, totals.get('events', 0))
+    finally:
+        conn.close()
+
+def run_geocoding_stage(args, stats):
+    """Stage: fix geocoding errors on event_raw with Google Places API."""
+    api_stats = get_api_usage_stats()
+    if not api_stats:
+        print("Failed to get API usage stats, skipping geocoding fixes")
+        return
+    print("\n=== Google Places API Usage ===")
+    print(f"Daily usage: {api_stats['daily_usage']}/{api_stats['daily_limit']} ({api_stats['daily_percent']}%)")
+    print(f"Monthly usage: {api_stats['monthly_usage']}/{api_stats['monthly_limit']} ({api_stats['monthly_percent']}%)")
+    print(f"Cached venues: {api_stats['cached_venues']}")
+    
+    # Only proceed if we're under 80% of daily limit
+    if api_stats['daily_percent'] >= 80:
+        print("API usage near limit, skipping geocoding fixes")
+        return
+    conn = open_stage_connection()
+    try:
+        geocoding_errors = get_geocoding_errors(conn, args.batch_size)
+        if geocoding_errors:
+            print(f"\nFound {len(geocoding_errors)} records with geocoding errors")
+            fixed_count, total_count = fix_geocoding_with_places_api(conn, geocoding_errors, args.geocode_workers, stats)
+            print(f"Fixed {fixed_count} out of {total_count} geocoding errors")
+        else:
+            print("No records with geocoding errors")
+    finally:
+        conn.close()
+
+def build_pipeline_stages(args, lambda_client, include_collection=False):
+    """
+    Stage DAG for one pipeline run. Collection, enrichment of existing
+    event_clean rows and geocoding fixes are independent and run
+    concurrently; normalization waits for collection (new raw rows) and for
+    geocoding (which resets fixed rows for re-normalization), and duplicate
+    detection runs last over the enriched, normalized rows.
+    """
+    stages = []
+    if include_collection:
+        stages.append(Stage('collect', lambda stats: run_collection_stage(args, stats)))
+    if not args.skip_enrichment and lambda_client:
+        stages.append(Stage('enrich', lambda stats: run_enrichment_stage(args, lambda_client, stats)))
+    if not args.skip_geocoding:
+        stages.append(Stage('geocode', lambda stats: run_geocoding_stage(args, stats)))
+    if not args.skip_normalize:
+        stages.append(Stage('normalize', lambda stats: run_normalize_stage(args, stats),
+                            depends_on=('collect', 'geocode')))
+    if not args.skip_dedupe:
+        stages.append(Stage('dedupe', lambda stats: run_dedupe_stage(args, stats),
+                            depends_on=('enrich', 'normalize')))
+    return stages
+
+def process_pipeline(args, conn, lambda_client, include_collection=False):
+    """Run the event processing pipeline as a stage DAG."""
     if not conn:
         print("Failed to connect to database, exiting.")
         return
@@ -854,86 +1133,11 @@ def process_pipeline(args, conn, lambda_client):
     setup_venue_cache_table(conn)
     
     try:
-        # Step 1: Process raw events into normalized format
-        if not args.skip_normalize:
-            print("\n=== Processing Raw Events ===")
-            pending_records = get_pending_normalizations(conn, args.batch_size)
-            if pending_records:
-                print(f"Found {len(pending_records)} records needing normalization")
-                processed = process_raw_events(conn, args.batch_size)
-                print(f"Processed {processed} raw events")
-                
-                # Trigger normalizers to process the normalized data
-                run_normalizers()
-            else:
-                print("No records pending normalization")
-        
-        # Step 2: Enrich event_clean records using Qwen 3
-        if not args.skip_enrichment and lambda_client:
-            print("\n=== Enriching Events with Qwen 3 ===")
-            enrichment_records = get_events_needing_enrichment(conn, args.batch_size)
-            if enrichment_records:
-                print(f"Found {len(enrichment_records)} records needing enrichment")
-                enriched_count = 0
-                
-                for record in enrichment_records:
-                    event_id = record[0]
-                    event_data = {
-                        'id': event_id,
-                        'json_data': record[1]
-                    }
-                    
-                    print(f"Enriching event ID {event_id}...")
-                    enrichment_data = invoke_qwen_enrichment(lambda_client, event_data)
-                    
-                    if enrichment_data:
-                        success = update_event_with_enrichment(conn, event_id, enrichment_data)
-                        if success:
-                            enriched_count += 1
-                            print(f"  Successfully enriched event {event_id}")
-                        else:
-                            print(f"  Failed to update event {event_id} with enrichment data")
-                    else:
-                        print(f"  Failed to get enrichment data for event {event_id}")
-                        
-                        # Mark as processed even if we couldn't enrich it
-                        with conn.cursor() as cur:
-                            cur.execute("""
-                                UPDATE event_clean
-                                SET enrichment_status = 'failed',
-                                    updated_at = CURRENT_TIMESTAMP
-                                WHERE id = %s
-                            """, (event_id,))
-                            conn.commit()
-                
-                print(f"Enriched {enriched_count} out of {len(enrichment_records)} records")
-            else:
-                print("No records needing enrichment")
-        
-        # Step 3: Fix geocoding errors with Google Places API
-        if not args.skip_geocoding:
-            print("\n=== Fixing Geocoding Errors ===")
-            api_stats = get_api_usage_stats()
-            if api_stats:
-                print("\n=== Google Places API Usage ===")
-                print(f"Daily usage: {api_stats['daily_usage']}/{api_stats['daily_limit']} ({api_stats['daily_percent']}%)")
-                print(f"Monthly usage: {api_stats['monthly_usage']}/{api_stats['monthly_limit']} ({api_stats['monthly_percent']}%)")
-                print(f"Cached venues: {api_stats['cached_venues']}")
-                
-                # Only proceed if we're under 80% of daily limit
-                if api_stats['daily_percent'] < 80:
-                    geocoding_errors = get_geocoding_errors(conn, args.batch_size)
-                    if geocoding_errors:
-                        print(f"\nFound {len(geocoding_errors)} records with geocoding errors")
-                        fixed_count, total_count = fix_geocoding_with_places_api(conn, geocoding_errors)
-                        print(f"Fixed {fixed_count} out of {total_count} geocoding errors")
-                    else:
-                        print("No records with geocoding errors")
-                else:
-                    print("API usage near limit, skipping geocoding fixes")
-            else:
-                print("Failed to get API usage stats, skipping geocoding fixes")
-                
+        stages = build_pipeline_stages(args, lambda_client, include_collection)
+        if not stages:
+            print("All stages skipped")
+            return
+        run_stage_graph(stages)
         print("\nPipeline processing complete")
     
     except Exception as e:
@@ -956,12 +1160,12 @@ def run_unified_pipeline(args):
             args.skip_enrichment = True
     
     try:
-        # Stage 1: Data Collection
-        if args.collect or args.full_run:
+        if args.full_run:
+            # Collection runs as one stage of the DAG, alongside enrichment and geocoding
+            process_pipeline(args, conn, lambda_client, include_collection=True)
+        elif args.collect:
             run_data_collection(args, conn)
-        
-        # Stage 2: Data Processing
-        if args.process or args.full_run:
+        elif args.process:
             process_pipeline(args, conn, lambda_client)
         
         print("\n=== Unified pipeline completed ===")
@@ -983,6 +1187,12 @@ if __name__ == "__main__":
     parser.add_argument("--skip-normalize", action="store_true", help="Skip normalization step")
     parser.add_argument("--skip-enrichment", action="store_true", help="Skip Qwen enrichment step")
     parser.add_argument("--skip-geocoding", action="store_true", help="Skip geocoding fixes with Places API")
+    parser.add_argument("--query-concurrency", type=int, default=8, help="Concurrent DataForSEO live queries during collection")
+    parser.add_argument("--enrich-workers", type=int, default=4, help="Concurrent Qwen Lambda invocations in the enrichment stage")
+    parser.add_argument("--enrich-batch-size", type=int, default=10, help="Events packed into one Qwen Lambda invocation")
+    parser.add_argument("--skip-dedupe", action="store_true", help="Skip embedding-based duplicate detection")
+    parser.add_argument("--dedupe-workers", type=int, default=4, help="Concurrent LLM /dedupe checks for borderline pairs")
+    parser.add_argument("--geocode-workers", type=int, default=4, help="Concurrent Places lookups in the geocoding stage")
     
     args = parser.parse_args()
     run_unified_pipeline(args) 
\ No newline at end of file
@@ -6,6 +6,10 @@ import redis
 import time
 import os
 from dotenv import load_dotenv
+from pipeline_metrics import (
+    start_metrics_server, start_queue_depth_monitor, timed,
+    fetch_latency, extraction_seconds, items_processed_total,
+)
 
 load_dotenv()
 
@@ -31,6 +35,8 @@ def initialize_redis():
 
 def worker_fetch(redis_conn):
     print("Starting fetch worker...")
+    start_metrics_server()
+    start_queue_depth_monitor(redis_conn, (INPUT_QUEUE, OUTPUT_QUEUE))
     processed_count = 0
     fail_count = 0
     
@@ -77,18 +83,20 @@ def worker_fetch(redis_conn):
                 page = None 
                 try:
                     page = browser.new_page()
-                    page.goto(url_to_fetch, wait_until="domcontentloaded", timeout=BROWSER_TIMEOUT)
-                    html_content = page.content()
+                    with timed(fetch_latency, worker="fetch"):
+                        page.goto(url_to_fetch, wait_until="domcontentloaded", timeout=BROWSER_TIMEOUT)
+                        html_content = page.content()
                     
                     # Extract JSON-LD
                     # Use uniform=True to attempt normalization across syntaxes if needed
                     # syntaxes=["json-ld"] limits extraction to only JSON-LD
-                    extracted_data = extruct.extract(
-                        html_content,
-                        base_url=url_to_fetch,      # Helps resolve relative URLs if any inside JSON-LD
-                        syntaxes=["json-ld"],
-                        uniform=True
-                    )["json-ld"]
+                    with timed(extraction_seconds, worker="fetch"):
+                        extracted_data = extruct.extract(
+                            html_content,
+                            base_url=url_to_fetch,      # Helps resolve relative URLs if any inside JSON-LD
+                            syntaxes=["json-ld"],
+                            uniform=True
+                        )["json-ld"]
 
                     if extracted_data:
                         print(f"  Found {len(extracted_data)} JSON-LD blob(s) for {url_to_fetch}.")
@@ -102,15 +110,19 @@ def worker_fetch(redis_conn):
                             }
                             redis_conn.rpush(OUTPUT_QUEUE, json.dumps(output_package))
                         processed_count += 1
+                        items_processed_total.labels(worker="fetch", outcome="extracted").inc()
                     else:
                         print(f"  No JSON-LD found for {url_to_fetch}.")
+                        items_processed_total.labels(worker="fetch", outcome="no_jsonld").inc()
 
                 except PlaywrightError as e_page:
                     print(f"  Playwright error processing {url_to_fetch}: {e_page}")
                     fail_count += 1
+                    items_processed_total.labels(worker="fetch", outcome="failed").inc()
                 except Exception as e_general:
                     print(f"  Unexpected error processing {url_to_fetch}: {e_general}")
                     fail_count += 1
+                    items_processed_total.labels(worker="fetch", outcome="failed").inc()
                 finally:
                     if page:
                         page.close()
@@ -13,6 +13,9 @@ from unidecode import unidecode
 import re
 import hashlib # Added for fingerprint
 from datetime import datetime # Added for date operations
+from pipeline_metrics import (
+    start_metrics_server, timed, geocode_latency, db_write_latency, items_processed_total,
+)
 
 # --- Configuration ---
 DB_ENV_VAR = 'DATABASE_URL'
@@ -119,11 +122,12 @@ def geocode_address(address_input, country_code_hint: str | None = None, attempt
         # Nominatim geopy wrapper handles dicts as structured queries
         # and strings as general queries.
         # If query_params contains 'countrycodes', it will be used.
-        if isinstance(final_query, dict):
-             # If countrycodes was added, it should be part of the dict passed directly
-            location = geolocator.geocode(final_query, exactly_one=True, timeout=10, country_codes=query_params.get('countrycodes'))
-        else: # It's a string
-            location = geolocator.geocode(final_query, exactly_one=True, timeout=10, country_codes=query_params.get('countrycodes'))
+        with timed(geocode_latency, provider="nominatim"):
+            if isinstance(final_query, dict):
+                 # If countrycodes was added, it should be part of the dict passed directly
+                location = geolocator.geocode(final_query, exactly_one=True, timeout=10, country_codes=query_params.get('countrycodes'))
+            else: # It's a string
+                location = geolocator.geocode(final_query, exactly_one=True, timeout=10, country_codes=query_params.get('countrycodes'))
         
         return location
     except GeocoderTimedOut:
@@ -465,6 +469,7 @@ def mark_raw_event_status(cur, event_raw_id: int, status: str):
 
 def worker_normalize(db_conn):
     print("Starting Normalizer Worker...")
+    start_metrics_server()
     loop_count = 0
     while True:
         loop_count += 1
@@ -541,14 +546,17 @@ def worker_normalize(db_conn):
                         )
                         ON CONFLICT (metro_id, fingerprint) DO NOTHING; 
                         """
-                        cur.execute(insert_sql, normalized_event_dict)
+                        with timed(db_write_latency, worker="normalize"):
+                            cur.execute(insert_sql, normalized_event_dict)
                         
                         if cur.rowcount > 0:
                             print(f"    Successfully inserted event_clean record for event_raw_id {event_raw_id}.")
                             mark_raw_event_status(cur, event_raw_id, 'processed')
+                            items_processed_total.labels(worker="normalize", outcome="inserted").inc()
                         else:
                             print(f"    Duplicate event (or no insert) for event_raw_id {event_raw_id} based on fingerprint. Marking as 'duplicate'.")
                             mark_raw_event_status(cur, event_raw_id, 'duplicate')
+                            items_processed_total.labels(worker="normalize", outcome="duplicate").inc()
                         events_processed_in_batch += 1
                     except psycopg2.errors.UniqueViolation:
                         db_conn.rollback() # Rollback the main transaction for this event
@@ -600,7 +608,8 @@ def worker_normalize(db_conn):
                 
                 if events_processed_in_batch > 0:
                     print(f"Normalizer: Committing batch of {events_processed_in_batch} processed events.")
-                    db_conn.commit()
+                    with timed(db_write_latency, worker="normalize_commit"):
+                        db_conn.commit()
                 else:
                     # If no events were successfully processed to the point of attempting insert (e.g. all failed validation early)
                     # still commit to save any status updates like 'error' for events that failed before insert stage.
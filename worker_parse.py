@@ -10,6 +10,15 @@ from uuid import uuid4
 import time
 import os
 from dotenv import load_dotenv
+import sys
+from pipeline_metrics import (
+    start_metrics_server, start_queue_depth_monitor, timed,
+    extraction_seconds, db_write_latency, items_processed_total,
+)
+
+# Shared service modules (event_dedup) live in services/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'services'))
+from event_dedup import dedup_key, setup_dedup_columns
 
 # --- Configuration ---
 # Read from environment variables, falling back to defaults
@@ -61,6 +70,11 @@ def parse_datetime(date_string):
 
 def worker_parse(redis_conn, db_conn):
     print("Starting parse worker...")
+    start_metrics_server()
+    if redis_conn:
+        start_queue_depth_monitor(redis_conn)
+    if db_conn:
+        setup_dedup_columns(db_conn)
     processed_count = 0
     inserted_count = 0
     skipped_count = 0
@@ -101,6 +115,7 @@ def worker_parse(redis_conn, db_conn):
 
             processed_count += 1
             current_url_for_logging = "unknown_url_in_package"
+            parse_started = time.perf_counter()
             try:
                 record = json.loads(package_json)
                 # Extract fields from the enriched package
@@ -114,12 +129,14 @@ def worker_parse(redis_conn, db_conn):
                 if not isinstance(ld_blob, dict) or not original_url:
                     print(f"Skipping malformed package (missing blob or original_url): {package_json[:150]}...")
                     skipped_count += 1
+                    items_processed_total.labels(worker="parse", outcome="skipped").inc()
                     continue
                 
                 # metro_id is critical. If not present from upstream, we might skip or handle as an error.
                 if source_metro_id is None:
                     print(f"Skipping package due to missing 'source_metro_id' for URL {original_url}: {package_json[:150]}...")
                     skipped_count += 1
+                    items_processed_total.labels(worker="parse", outcome="skipped").inc()
                     continue
 
                 # Check the type
@@ -134,6 +151,7 @@ def worker_parse(redis_conn, db_conn):
                 if not is_approved_type:
                     print(f"Skipping non-event type: @type='{event_type}' from URL: {original_url}")
                     skipped_count += 1
+                    items_processed_total.labels(worker="parse", outcome="skipped").inc()
                     continue
 
                 # --- Basic Quality Checks ---
@@ -146,6 +164,7 @@ def worker_parse(redis_conn, db_conn):
                     # Added more detail to this log message
                     print(f"Skipping approved event type ('{event_type}') due to missing/invalid fields: name='{event_name}', startDate='{start_date_str}' from URL: {original_url}")
                     skipped_count += 1
+                    items_processed_total.labels(worker="parse", outcome="skipped").inc()
                     continue
                 # --- End Quality Checks ---
 
@@ -157,30 +176,39 @@ def worker_parse(redis_conn, db_conn):
                 if not isinstance(potential_source_event_id, str): # Ensure it's a string
                     potential_source_event_id = None
 
-                # Modified INSERT query: Removed the non-existent 'status' column
+                canonical_url, url_hash = dedup_key(ld_blob)
+
+                # Modified INSERT query: Removed the non-existent 'status' column.
+                # No conflict target, so the (source, url_hash) dedup index also skips duplicates.
                 insert_query = sql.SQL("""
-                    INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, parsed_at)
-                    VALUES (%s, %s, %s, %s, now())
-                    ON CONFLICT (source, source_event_id) DO NOTHING 
+                    INSERT INTO event_raw (source, source_event_id, metro_id, raw_json, canonical_url, url_hash, parsed_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, now())
+                    ON CONFLICT DO NOTHING 
                     RETURNING id;
                 """) 
 
-                cur.execute(insert_query, (
-                    original_url, 
-                    potential_source_event_id, 
-                    source_metro_id, 
-                    Json(ld_blob)
-                ))
-                
-                result = cur.fetchone()
+                extraction_seconds.labels(worker="parse").observe(time.perf_counter() - parse_started)
+                with timed(db_write_latency, worker="parse"):
+                    cur.execute(insert_query, (
+                        original_url, 
+                        potential_source_event_id, 
+                        source_metro_id, 
+                        Json(ld_blob),
+                        canonical_url,
+                        url_hash
+                    ))
+                    
+                    result = cur.fetchone()
+                    db_conn.commit()
+
                 if result:
                     inserted_id = result[0]
                     inserted_count += 1
+                    items_processed_total.labels(worker="parse", outcome="inserted").inc()
                     print(f"Inserted/Found event with event_raw.id: {inserted_id} from URL: {original_url} (Metro: {source_metro_id})")
                 else:
                     skipped_count +=1 
-                
-                db_conn.commit()
+                    items_processed_total.labels(worker="parse", outcome="duplicate").inc()
                 
                 if processed_count % 100 == 0:
                      print(f"Processed {processed_count}, Inserted {inserted_count}, Skipped {skipped_count}, Failed {fail_count}")
@@ -188,14 +216,17 @@ def worker_parse(redis_conn, db_conn):
             except json.JSONDecodeError:
                 print(f"Failed to decode JSON from jsonld_raw: {package_json[:150]}...")
                 fail_count += 1
+                items_processed_total.labels(worker="parse", outcome="failed").inc()
             except psycopg2.Error as e_db_insert:
                 print(f"DB insert error for {current_url_for_logging}: {e_db_insert}")
                 fail_count += 1
+                items_processed_total.labels(worker="parse", outcome="failed").inc()
                 if db_conn_active:
                     db_conn.rollback()
             except Exception as e_parse:
                 print(f"Unexpected error parsing/inserting record from {current_url_for_logging}: {e_parse}")
                 fail_count += 1
+                items_processed_total.labels(worker="parse", outcome="failed").inc()
                 if db_conn_active:
                     db_conn.rollback()
             finally: